@@ -1,5 +1,10 @@
+import pandas as pd
 from pandas import DataFrame
 import numpy as np
+from .sampling import sample_users, scale_counts, add_count_intervals
+
+# segment of the users whose acquisition event has no value in the segment column
+MISSING_SEGMENT = 'Unknown'
 
 
 def user_acquisition_dict(events, acquisition_event_name):
@@ -35,6 +40,38 @@ def user_acquisition_dict(events, acquisition_event_name):
     return acquisition
 
 
+def acquisition_segments(events, acquisition_event_name, segment_col):
+    """
+    Function used to find the segment of each user, i.e. the value of "segment_col" on his/her acquisition event
+    (the first occurrence of "acquisition_event_name"; the first one in the events order if there are ties).
+    Users whose acquisition event has no value in "segment_col" get MISSING_SEGMENT, so they are still counted.
+
+    :param events: (DataFrame)
+                        events dataframe
+
+    :param acquisition_event_name: (str)
+                        event name defining the user acquisition point
+
+    :param segment_col: (str)
+                        column holding a user property (e.g. source, country)
+
+    :return: (pd.Series)
+                        segment of each acquired user, indexed by "distinct_id"
+    """
+    assert hasattr(events, segment_col), '"segment_col" should be a column in the events dataframe'
+
+    acquisition = events[events['name'] == acquisition_event_name] \
+        .sort_values('time', kind='mergesort') \
+        .drop_duplicates(subset='distinct_id', keep='first')
+
+    segment = acquisition.set_index('distinct_id')[segment_col]
+    # categorical columns (e.g. the string columns of "stats.event_store") need the category to be filled in
+    if pd.api.types.is_categorical_dtype(segment) and MISSING_SEGMENT not in segment.cat.categories:
+        segment = segment.cat.add_categories([MISSING_SEGMENT])
+
+    return segment.fillna(MISSING_SEGMENT)
+
+
 def acquisition_events_cohort(events, acquisition_event_name, period='w', month_fmt='period'):
     """
     Function used to add "cohort", "event_period", "user_active" and "user_returns" columns.
@@ -76,30 +113,8 @@ def acquisition_events_cohort(events, acquisition_event_name, period='w', month_
     events['acquisition_time'] = events['distinct_id'].map(acquisition_dict)
 
     # create the "cohort" and "event_period" columns, based on the period defined
-    if period == 'd':
-        events['cohort'] = events['acquisition_time'].dt.date
-        events['event_period'] = events['time'].dt.date
-
-    elif period == 'w':
-        events['cohort'] = (events['acquisition_time'] - events['acquisition_time'] \
-                            .dt.weekday.astype('timedelta64[D]')).astype('datetime64[D]')
-
-        events['event_period'] = (events['time'] - events['time'] \
-                                  .dt.weekday.astype('timedelta64[D]')).astype('datetime64[D]')
-
-    else:
-        # if monthly period, choose between pandas period type and datetime type
-        # period type has a nice monthly format and is fine for aggregations
-        # datetime would show up as first/last day of the month (yyyy-mm-dd),
-        # but easier to work with for further manipulations
-        # datetime type will be more useful later
-        if month_fmt == 'period':
-            events['cohort'] = events['acquisition_time'].dt.to_period('M')
-            events['event_period'] = events['time'].dt.to_period('M')
-
-        elif month_fmt == 'datetime':
-            events['cohort'] = events['acquisition_time'].dt.date.astype('datetime64[M]')
-            events['event_period'] = events['time'].dt.date.astype('datetime64[M]')
+    events['cohort'] = period_bucket(events['acquisition_time'], period=period, month_fmt=month_fmt)
+    events['event_period'] = period_bucket(events['time'], period=period, month_fmt=month_fmt)
 
     # indicate if the user did any action at or after his/her acquisition time
     # if you do not want to count same-day activity replace following line with:
@@ -112,7 +127,102 @@ def acquisition_events_cohort(events, acquisition_event_name, period='w', month_
     return events
 
 
-def users_per_period(events, acquisition_event_name, user_source_col, period='w', month_fmt='period'):
+def period_bucket(times, period='w', month_fmt='period'):
+    """
+    Function used to assign each time to the daily/weekly/monthly period it belongs to.
+    Weeks start on Monday.
+
+    :param times: (pd.Series)
+                        datetime series
+
+    :param period: (str)
+                        'd' for daily, 'w' for weekly or 'm' for monthly
+
+    :param month_fmt: (str)
+                        'period' for %Y-%m and 'datetime' for datetime like
+
+    :return: (pd.Series)
+    """
+    assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+
+    if period == 'd':
+        return times.dt.date
+
+    elif period == 'w':
+        return (times - pd.to_timedelta(times.dt.weekday, unit='D')).dt.floor('D')
+
+    # if monthly period, choose between pandas period type and datetime type
+    # period type has a nice monthly format and is fine for aggregations
+    # datetime would show up as first/last day of the month (yyyy-mm-dd),
+    # but easier to work with for further manipulations
+    # datetime type will be more useful later
+    if month_fmt == 'period':
+        return times.dt.to_period('M')
+
+    return times.dt.date.astype('datetime64[M]')
+
+
+def period_index(values, period, month_fmt='period'):
+    """
+    Function used to convert period start dates (e.g. strings or datetimes returned by another backend)
+    to the index type used by "acquisition_events_cohort" for the same period and month format.
+
+    :param values: (list/array/Series)
+                        start date of each period
+
+    :param period: (str)
+                        'd' for daily, 'w' for weekly or 'm' for monthly
+
+    :param month_fmt: (str)
+                        'period' for %Y-%m and 'datetime' for datetime like
+
+    :return: (pd.Index)
+    """
+    values = pd.to_datetime(pd.Series(values))
+
+    if period == 'd':
+        return pd.Index(values.dt.date)
+    elif period == 'm' and month_fmt == 'period':
+        return pd.PeriodIndex(values, freq='M')
+
+    return pd.DatetimeIndex(values)
+
+
+def cohort_sizes(events):
+    """
+    Function used to count the number of users acquired in each cohort.
+
+    :param events: (DataFrame)
+                        events dataframe as returned by "acquisition_events_cohort"
+
+    :return: (pd.Series)
+                        number of users indexed by "cohort"
+    """
+    return events.drop_duplicates(subset=['distinct_id', 'cohort']).groupby(['cohort']).size()
+
+
+def activity_per_period(events):
+    """
+    Function used to count the active and returning users of each period with a single groupby.
+    Returning events are a subset of the active ones, so each (period, user) pair is only grouped once.
+
+    :param events: (DataFrame)
+                        events dataframe as returned by "acquisition_events_cohort"
+
+    :return: (DataFrame)
+                        "Active Users" and "Returning Users" columns indexed by "event_period"
+    """
+    activity = events[events['user_active']] \
+        .groupby(['event_period', 'distinct_id'])['user_returns'].max() \
+        .groupby(level='event_period') \
+        .agg(['size', 'sum']) \
+        .rename({'size': 'Active Users', 'sum': 'Returning Users'}, axis=1)
+
+    return activity
+
+
+def users_per_period(events, acquisition_event_name, user_source_col, period='w', month_fmt='period',
+                     backend='pandas', sample=None, numeric=False):
     """
     Function used to group new users into period cohorts.
     The first time a user generates a plan is treated as the acquisition time.
@@ -132,64 +242,163 @@ def users_per_period(events, acquisition_event_name, user_source_col, period='w'
     :param month_fmt: (str)
                     str denoting format for monthly date. Use 'period' for %Y-%m and 'datetime' for datetime like.
 
-    :return:
+    :param backend: (str)
+                    "pandas" or "polars" (see "stats.polars_backend" for the inputs accepted by "polars")
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
+    :param numeric: (bool)
+                    True to return "W/W Growth" (in %) and "N/R Ratio" as float columns instead of formatted strings,
+                    e.g. for plotting
+
+    :return: (DataFrame)
+                    stats per period, plus "<col>_low" and "<col>_high" columns with the confidence interval of
+                    every user count if "sample" is set
     """
+    assert backend in ['pandas', 'polars'], '"backend" should be either "pandas" or "polars"'
+    if backend == 'polars':
+        assert sample is None, '"sample" is only supported by the pandas backend'
+        from . import polars_backend
+        df = polars_backend.users_per_period(events, acquisition_event_name, user_source_col,
+                                             period=period, month_fmt=month_fmt)
+        return growth_columns(df, numeric=True) if numeric else df
+
     if user_source_col:
         assert hasattr(events, user_source_col), '"user_source_col" should be a column in the events dataframe'
 
+    if sample is not None:
+        events = sample_users(events, sample)
+
     # calculate the cohort for each user and period for each event
     events = acquisition_events_cohort(events, acquisition_event_name, period=period, month_fmt=month_fmt)
 
-    # will be used to rename the period column of each groupby result
-    period_name = {'w': 'Week Starting',
-                   'm': "Month"}
+    df = users_per_period_from_cohort(events, acquisition_event_name, user_source_col, period=period,
+                                      numeric=numeric)
+
+    # scale the user counts of the sample back up and add their confidence intervals; growth and ratios are
+    # unaffected
+    if sample is not None:
+        counts = df.columns.drop(['W/W Growth', 'N/R Ratio'])
+        df = add_count_intervals(scale_counts(df, sample, columns=counts), sample, columns=counts)
+
+    return df
+
+
+def users_per_period_from_cohort(events, acquisition_event_name, user_source_col, period='w',
+                                 sizes=None, activity=None, numeric=False):
+    """
+    Function used to calculate the "users_per_period" stats from events that already have the cohort columns.
+    Precomputed "cohort_sizes" and "activity_per_period" results can be passed in when they are shared with
+    other metrics (see "stats.analysis.Analysis").
+
+    :param events: (DataFrame)
+                        events dataframe as returned by "acquisition_events_cohort"
+
+    :param acquisition_event_name: (str)
+                        event name defining the user acquisition point
+
+    :param user_source_col: (str)
+                        name of column defining if user is an Organic/Non-organic acquisition
+
+    :param period: (str)
+                        period used when generating the cohort columns
+
+    :param sizes: (pd.Series)
+                        output of "cohort_sizes"; calculated if None
+
+    :param activity: (DataFrame)
+                        output of "activity_per_period"; calculated if None
+
+    :param numeric: (bool)
+                        True for float "W/W Growth" and "N/R Ratio" columns instead of formatted strings
 
+    :return: (DataFrame)
+    """
     # calculate size of each users cohort
-    new_users = events.drop_duplicates(subset=['distinct_id', 'cohort']) \
-        .groupby(['cohort']).size() \
-        .reset_index() \
-        .rename({0: 'New Users (Total)', 'cohort': period_name[period]}, axis=1) \
-        .set_index(period_name[period])
+    if sizes is None:
+        sizes = cohort_sizes(events)
 
     # break down new users into Organic/Non-organic
+    source = None
     if user_source_col:
         source = events[events['name'] == acquisition_event_name] \
-            .groupby(['cohort', 'user_source'])['distinct_id'] \
-            .nunique() \
-            .reset_index() \
-            .rename({'distinct_id': 'New Users', 'cohort': period_name[period]}, axis=1) \
-            .set_index(period_name[period])
+            .groupby(['cohort', user_source_col])['distinct_id'] \
+            .nunique()
 
-        source = source.pivot(columns='user_source', values='New Users')[['Organic', 'Non-organic']] \
-            .rename({'Organic': 'New Organic Users', 'Non-organic': 'New Paid Users'}, axis=1)
+    # calculate number of active and returning users per period
+    if activity is None:
+        activity = activity_per_period(events)
+
+    return users_per_period_table(sizes, activity, period=period, source=source, numeric=numeric)
+
+
+def users_per_period_table(sizes, activity, period='w', source=None, numeric=False):
+    """
+    Function used to assemble the "users_per_period" table from the per-period counts.
+
+    :param sizes: (pd.Series)
+                        number of new users indexed by cohort, as returned by "cohort_sizes"
+
+    :param activity: (DataFrame)
+                        "Active Users" and "Returning Users" indexed by period, as returned by "activity_per_period"
+
+    :param period: (str)
+                        period used when generating the cohorts
+
+    :param source: (pd.Series)
+                        number of new users indexed by (cohort, user source); breakdown skipped if None
 
-    # calculate number of active users per period
-    active_users = events[events['user_active']] \
-        .groupby(['event_period'])['distinct_id'].nunique() \
-        .reset_index() \
-        .rename({'distinct_id': 'Active Users', 'event_period': period_name[period]}, axis=1) \
-        .set_index(period_name[period])
+    :param numeric: (bool)
+                        True for float "W/W Growth" and "N/R Ratio" columns instead of formatted strings
 
-    # calculate number of returning users per period
-    returning_users = events[events['user_returns']] \
-        .groupby(['event_period'])['distinct_id'].nunique() \
-        .reset_index() \
-        .rename({'distinct_id': 'Returning Users', 'event_period': period_name[period]}, axis=1) \
-        .set_index(period_name[period])
+    :return: (DataFrame)
+    """
+    # will be used to rename the period column of each groupby result
+    period_name = {'d': 'Day',
+                   'w': 'Week Starting',
+                   'm': "Month"}
+
+    new_users = sizes.rename('New Users (Total)').to_frame()
 
     # merge into a single dataframe
-    if user_source_col:
-        df = new_users.join([source, active_users, returning_users], how='outer', sort=False).astype('Int64').copy()
+    if source is not None:
+        source = source.unstack(-1) \
+            .reindex(columns=['Organic', 'Non-organic']) \
+            .rename({'Organic': 'New Organic Users', 'Non-organic': 'New Paid Users'}, axis=1)
+        df = new_users.join([source, activity], how='outer', sort=False)
     else:
-        df = new_users.join([active_users, returning_users], how='outer', sort=False).astype('Int64').copy()
-    df.fillna(0, inplace=True)
+        df = new_users.join(activity, how='outer', sort=False)
+    df = df.sort_index().fillna(0).astype('Int64')
+    df.index.name = period_name[period]
+    df.columns.name = None
+
+    return growth_columns(df, numeric=numeric)
+
 
+def growth_columns(df, numeric=False):
+    """
+    Function used to add (or replace) the "W/W Growth" and "N/R Ratio" columns of a "users_per_period" table.
+
+    :param df: (DataFrame)
+                        "users_per_period" table
+
+    :param numeric: (bool)
+                        True for float columns ("W/W Growth" in %), False for formatted strings
+
+    :return: (DataFrame)
+    """
     # calculate period-on-period growth
-    df['W/W Growth'] = df['New Users (Total)'].pct_change().apply(lambda x: "{0:.2f}%".format(x * 100))
-    df['N/R Ratio'] = (df['New Users (Total)'] / df['Returning Users']) \
-        .fillna(0) \
-        .replace(np.inf, np.nan) \
-        .apply(lambda x: "{0:.1f}".format(x))
+    if numeric:
+        df['W/W Growth'] = df['New Users (Total)'].astype(float).pct_change() * 100
+        df['N/R Ratio'] = (df['New Users (Total)'].astype(float) / df['Returning Users'].astype(float)) \
+            .fillna(0) \
+            .replace(np.inf, np.nan)
+    else:
+        df['W/W Growth'] = df['New Users (Total)'].pct_change().apply(lambda x: "{0:.2f}%".format(x * 100))
+        df['N/R Ratio'] = (df['New Users (Total)'] / df['Returning Users']) \
+            .fillna(0) \
+            .replace(np.inf, np.nan) \
+            .apply(lambda x: "{0:.1f}".format(x))
 
     return df
-
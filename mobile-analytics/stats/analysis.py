@@ -0,0 +1,198 @@
+import pandas as pd
+from .acquisition import acquisition_events_cohort, cohort_sizes, activity_per_period, users_per_period_from_cohort
+from .retention import retention_table_from_cohort
+from .funnel import create_funnel_df, funnel_trend_df
+from .user_journey import user_journey, sankey_df
+
+
+class Analysis(object):
+    """
+    Lazy query plan over a single events dataframe.
+
+    Metric requests are only recorded when the methods are called; "run" then plans them together so that
+    the events are sorted by ("distinct_id", "time") and encoded once, the acquisition cohort of each
+    (acquisition event, period, month format) combination is computed once, and the cohort sizes and the
+    active/returning users groupby are shared between all the metrics that need them.
+
+    Example:
+        analysis = Analysis(events)
+        growth = analysis.users_per_period('Install', 'user_source', period='m')
+        retention = analysis.retention_table('Install', period='m')
+        funnel = analysis.create_funnel_df(['Install', 'SignUp', 'Purchase'])
+        results = analysis.run()
+        results[growth], results[retention], results[funnel]
+
+    :param events: (DataFrame)
+                        events dataframe
+
+    :param presorted: (bool)
+                        True if events are already sorted by ("distinct_id", "time"),
+                        e.g. the output of "stats.correct_events.correct_events"
+    """
+
+    def __init__(self, events, presorted=False):
+        if not isinstance(events, pd.DataFrame):
+            raise TypeError('"events" should be a pandas dataframe')
+
+        self._events = events
+        self._presorted = presorted
+        self._requests = []
+
+    def __len__(self):
+        return len(self._requests)
+
+    def _add(self, kind, **kwargs):
+        self._requests.append((kind, kwargs))
+        return len(self._requests) - 1
+
+    def users_per_period(self, acquisition_event_name, user_source_col, period='w', month_fmt='period',
+                         numeric=False):
+        """
+        Record a "stats.acquisition.users_per_period" request.
+
+        :return: (int)
+                        position of the result in the list returned by "run"
+        """
+        assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+        if user_source_col:
+            assert hasattr(self._events, user_source_col), \
+                '"user_source_col" should be a column in the events dataframe'
+
+        return self._add('users_per_period', acquisition_event_name=acquisition_event_name,
+                         user_source_col=user_source_col, period=period, month_fmt=month_fmt, numeric=numeric)
+
+    def retention_table(self, acquisition_event_name, period='w', month_fmt='period', event_filter=None,
+                        segment_col=None):
+        """
+        Record a "stats.retention.retention_table" request.
+
+        :return: (int)
+                        position of the result in the list returned by "run"
+        """
+        assert period in ['w', 'm'], '"period" should be either "w" or "m"'
+        if segment_col:
+            assert hasattr(self._events, segment_col), '"segment_col" should be a column in the events dataframe'
+
+        return self._add('retention_table', acquisition_event_name=acquisition_event_name,
+                         period=period, month_fmt=month_fmt, event_filter=event_filter, segment_col=segment_col)
+
+    def create_funnel_df(self, steps, from_date=None, to_date=None, step_interval=0):
+        """
+        Record a "stats.funnel.create_funnel_df" request.
+
+        :return: (int)
+                        position of the result in the list returned by "run"
+        """
+        assert isinstance(steps, list), '"steps" should be a list of strings'
+
+        return self._add('create_funnel_df', steps=steps, from_date=from_date, to_date=to_date,
+                         step_interval=step_interval)
+
+    def funnel_trend_df(self, steps, period='w', month_fmt='period', from_date=None, to_date=None, step_interval=0):
+        """
+        Record a "stats.funnel.funnel_trend_df" request.
+
+        :return: (int)
+                        position of the result in the list returned by "run"
+        """
+        assert isinstance(steps, list), '"steps" should be a list of strings'
+        assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+
+        return self._add('funnel_trend_df', steps=steps, period=period, month_fmt=month_fmt, from_date=from_date,
+                         to_date=to_date, step_interval=step_interval)
+
+    def user_journey(self, starting_step, n_steps=3, events_per_step=5):
+        """
+        Record a "stats.user_journey.user_journey" request.
+
+        :return: (int)
+                        position of the result in the list returned by "run"
+        """
+        return self._add('user_journey', starting_step=starting_step, n_steps=n_steps,
+                         events_per_step=events_per_step)
+
+    def sankey_df(self, starting_step, n_steps=3, events_per_step=5):
+        """
+        Record a "stats.user_journey.sankey_df" request.
+
+        :return: (int)
+                        position of the result in the list returned by "run"
+        """
+        return self._add('sankey_df', starting_step=starting_step, n_steps=n_steps,
+                         events_per_step=events_per_step)
+
+    def _prepare(self):
+        """
+        Keep only the columns needed by the recorded requests, sort them once and encode "distinct_id".
+        """
+        columns = ['distinct_id', 'name', 'time']
+        for kind, kwargs in self._requests:
+            for col in (kwargs.get('user_source_col'), kwargs.get('segment_col')):
+                if col and col not in columns:
+                    columns.append(col)
+
+        events = self._events[columns]
+        if not self._presorted:
+            events = events.sort_values(['distinct_id', 'time'], kind='mergesort')
+
+        # every metric only counts users, so the raw ids can be replaced with compact integer codes
+        # which are cheaper to hash in all the following groupbys; the sort order is preserved
+        events = events.assign(distinct_id=pd.factorize(events['distinct_id'])[0])
+
+        return events
+
+    def run(self):
+        """
+        Plan and execute all the recorded requests.
+
+        :return: (list)
+                        results in the same order as the requests were recorded
+        """
+        events = self._prepare()
+
+        # shared intermediate results, keyed by (acquisition_event_name, period, month_fmt)
+        cohorts = {}
+        # events filtered once for all the funnel steps requested
+        funnel_steps = set(step for kind, kwargs in self._requests
+                           if kind in ('create_funnel_df', 'funnel_trend_df') for step in kwargs['steps'])
+        funnel_events = events[events['name'].isin(funnel_steps)] if funnel_steps else None
+
+        results = []
+        for kind, kwargs in self._requests:
+            if kind in ('users_per_period', 'retention_table'):
+                key = (kwargs['acquisition_event_name'], kwargs['period'], kwargs['month_fmt'])
+                if key not in cohorts:
+                    cohort_events = acquisition_events_cohort(events, key[0], period=key[1], month_fmt=key[2])
+                    cohorts[key] = {'events': cohort_events, 'sizes': cohort_sizes(cohort_events)}
+                shared = cohorts[key]
+
+                if kind == 'users_per_period':
+                    if 'activity' not in shared:
+                        shared['activity'] = activity_per_period(shared['events'])
+                    result = users_per_period_from_cohort(shared['events'], kwargs['acquisition_event_name'],
+                                                          kwargs['user_source_col'], period=kwargs['period'],
+                                                          sizes=shared['sizes'], activity=shared['activity'],
+                                                          numeric=kwargs['numeric'])
+                else:
+                    result = retention_table_from_cohort(shared['events'], period=kwargs['period'],
+                                                         month_fmt=kwargs['month_fmt'],
+                                                         event_filter=kwargs['event_filter'],
+                                                         sizes=shared['sizes'],
+                                                         segment_col=kwargs['segment_col'],
+                                                         acquisition_event_name=kwargs['acquisition_event_name'])
+
+            elif kind == 'create_funnel_df':
+                result = create_funnel_df(funnel_events, **kwargs)
+
+            elif kind == 'funnel_trend_df':
+                result = funnel_trend_df(funnel_events, **kwargs)
+
+            elif kind == 'user_journey':
+                result = user_journey(events, presorted=True, **kwargs)
+
+            else:
+                result = sankey_df(events, presorted=True, **kwargs)
+
+            results.append(result)
+
+        return results
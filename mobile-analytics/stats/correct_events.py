@@ -2,5 +2,256 @@
 # -*- coding: utf-8 -*-
 
 """
-    A placeholder for any functions needed to correct the raw events dataframe before calculating metrics.
-"""
\ No newline at end of file
+    Functions needed to correct the raw events dataframe before calculating metrics.
+
+    Each stage is vectorised and can be used on its own, while "correct_events" chains them together so that
+    the events are sorted by ("distinct_id", "time") only once and the returned dataframe can be passed
+    straight to any of the stats functions.
+"""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from .identity import IdentityIndex
+
+
+def alias_mapping(alias_pairs):
+    """
+    Function used to generate a dict with "alias": "canonical_id" key:value pairs from (alias, distinct_id) pairs.
+    The pairs are merged using a union-find structure (see "stats.identity.IdentityIndex"), so that chains of
+    aliases (e.g. anonymous id -> device id -> user id) all resolve to the same canonical id.
+
+    :param alias_pairs: (DataFrame/list)
+                        dataframe with two columns or list of (alias, distinct_id) tuples
+
+    :return: (dict)
+                        "alias": "canonical_id" pairs, only for ids that are not already canonical
+    """
+    return IdentityIndex(alias_pairs).to_dict()
+
+
+def filter_testers(events, testers, col='distinct_id'):
+    """
+    Function used to filter out events generated by internal testers.
+
+    :param events: (DataFrame)
+                        events dataframe
+
+    :param testers: (list/set/Series)
+                        ids of the internal testers
+
+    :param col: (str)
+                        column holding the ids to be matched against "testers"
+
+    :return: (DataFrame)
+    """
+    if not isinstance(events, DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+
+    return events[~events[col].isin(testers)]
+
+
+def resolve_aliases(events, aliases, col='distinct_id'):
+    """
+    Function used to replace any aliased id with its canonical id, so that anonymous and identified
+    activity of the same user is counted once.
+
+    :param events: (DataFrame)
+                        events dataframe
+
+    :param aliases: (IdentityIndex/dict/DataFrame/list)
+                        identity index, "alias": "canonical_id" dict as returned by "alias_mapping"
+                        or (alias, distinct_id) pairs accepted by "IdentityIndex"
+
+    :param col: (str)
+                        column holding the ids to be resolved
+
+    :return: (DataFrame)
+    """
+    if not isinstance(events, DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+
+    if not isinstance(aliases, dict):
+        if not isinstance(aliases, IdentityIndex):
+            aliases = IdentityIndex(aliases)
+        return aliases.remap(events, col=col)
+
+    # only touch the rows that actually carry an alias
+    aliased = events[col].isin(aliases.keys())
+    if aliased.any():
+        events = events.copy()
+        events.loc[aliased, col] = events.loc[aliased, col].map(aliases)
+
+    return events
+
+
+def clamp_time_skew(events, min_time=None, max_time=None, received_col=None):
+    """
+    Function used to fix timestamps affected by device clock skew.
+    Events claiming to have happened after they were received by the server are moved to the received time,
+    and all remaining times are clipped to the [min_time, max_time] range.
+
+    :param events: (DataFrame)
+                        events dataframe
+
+    :param min_time: (str/pd.Timestamp)
+                        earliest valid event time, e.g. the app release date
+
+    :param max_time: (str/pd.Timestamp)
+                        latest valid event time, e.g. the export time
+
+    :param received_col: (str)
+                        name of column holding the time each event was received by the server
+
+    :return: (DataFrame)
+    """
+    if not isinstance(events, DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+
+    if received_col:
+        assert hasattr(events, received_col), '"received_col" should be a column in the events dataframe'
+
+    if not (min_time or max_time or received_col):
+        return events
+
+    time = events['time']
+    if received_col:
+        time = time.where(time <= events[received_col], events[received_col])
+
+    time = time.clip(lower=pd.Timestamp(min_time) if min_time else None,
+                     upper=pd.Timestamp(max_time) if max_time else None)
+
+    events = events.copy()
+    events['time'] = time
+
+    return events
+
+
+def dedup_events(events, tolerance=pd.Timedelta(seconds=1), subset=None, presorted=False):
+    """
+    Function used to drop events that were resent by the client.
+    An event is treated as a duplicate if the same user generated the same event within "tolerance"
+    of the last kept one, so a burst of resends spanning more than "tolerance" keeps one event per window
+    (e.g. five identical events 0.9s apart with a 1s tolerance keep the 1st, 3rd and 5th).
+
+    :param events: (DataFrame)
+                        events dataframe
+
+    :param tolerance: (pd.Timedelta)
+                        maximum time between two identical events for the latter to be dropped
+
+    :param subset: (list)
+                        extra columns that must also match for two events to be identical
+
+    :param presorted: (bool)
+                        True if events are already sorted by ("distinct_id", "time")
+
+    :return: (DataFrame)
+    """
+    if not isinstance(events, DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+
+    assert isinstance(tolerance, pd.Timedelta), '"tolerance" should be a valid pd.Timedelta object'
+
+    if not presorted:
+        events = events.sort_values(['distinct_id', 'time'], kind='mergesort')
+
+    keys = ['distinct_id', 'name'] + list(subset or [])
+    groups = events.groupby(keys, sort=False)['time']
+    # time since the previous identical event of the same user; NaT for the first occurrence
+    gap = groups.diff()
+
+    # events further than "tolerance" from the previous identical event are always kept; the others form
+    # runs after such an event and are only kept if they are further than "tolerance" from the last kept one
+    candidate = (gap <= tolerance).values
+    if not candidate.any():
+        return events
+
+    # positions of the identical events of each user, in time order
+    order = np.argsort(groups.ngroup().values, kind='mergesort')
+    time = events['time'].values.astype('datetime64[ns]').view(np.int64)[order]
+    candidate = candidate[order]
+
+    run = np.cumsum(~candidate) - 1
+    run_start = np.flatnonzero(~candidate)
+    position = np.arange(len(order)) - run_start[run]
+
+    keep = ~candidate
+    last_kept = time[run_start]
+
+    # the k-th events of all the runs are checked together, so the loop is over the length of the longest run
+    pending = np.flatnonzero(candidate)
+    pending = pending[np.argsort(position[pending], kind='mergesort')]
+    bounds = np.flatnonzero(np.diff(position[pending])) + 1
+    for step in np.split(pending, bounds):
+        kept = step[time[step] > last_kept[run[step]] + tolerance.value]
+        keep[kept] = True
+        last_kept[run[kept]] = time[kept]
+
+    mask = np.empty(len(order), dtype=bool)
+    mask[order] = keep
+
+    return events[mask]
+
+
+def correct_events(events, aliases=None, testers=None, dedup_tolerance=pd.Timedelta(seconds=1),
+                   dedup_subset=None, min_time=None, max_time=None, received_col=None):
+    """
+    Function used to run the full correction pipeline on the raw events.
+    Row-wise stages (alias resolution, tester filtering and time-skew clamping) are applied to each chunk
+    as it is read, the result is sorted by ("distinct_id", "time") once and resent events are dropped.
+
+    :param events: (DataFrame/iterable)
+                        events dataframe or an iterable of dataframe chunks, e.g. pd.read_csv(..., chunksize=n)
+
+    :param aliases: (IdentityIndex/dict/DataFrame/list)
+                        aliases passed to "resolve_aliases"; skipped if None
+
+    :param testers: (list/set/Series)
+                        ids of internal testers passed to "filter_testers"; skipped if None
+
+    :param dedup_tolerance: (pd.Timedelta)
+                        tolerance passed to "dedup_events"; deduplication is skipped if None
+
+    :param dedup_subset: (list)
+                        extra columns passed to "dedup_events"
+
+    :param min_time: (str/pd.Timestamp)
+                        passed to "clamp_time_skew"
+
+    :param max_time: (str/pd.Timestamp)
+                        passed to "clamp_time_skew"
+
+    :param received_col: (str)
+                        passed to "clamp_time_skew"
+
+    :return: (DataFrame)
+                        corrected events sorted by ("distinct_id", "time")
+    """
+    chunks = [events] if isinstance(events, DataFrame) else events
+
+    # build the identity index once rather than once per chunk
+    if aliases is not None and not isinstance(aliases, (dict, IdentityIndex)):
+        aliases = IdentityIndex(aliases)
+
+    corrected = []
+    for chunk in chunks:
+        if aliases is not None:
+            chunk = resolve_aliases(chunk, aliases)
+        # testers are filtered after alias resolution so that their anonymous activity is dropped as well
+        if testers is not None:
+            chunk = filter_testers(chunk, testers)
+        chunk = clamp_time_skew(chunk, min_time=min_time, max_time=max_time, received_col=received_col)
+        corrected.append(chunk)
+
+    if not corrected:
+        raise ValueError('"events" should contain at least one dataframe chunk')
+
+    events = pd.concat(corrected, ignore_index=True) if len(corrected) > 1 else corrected[0]
+
+    # single sort shared by every following stage and by the stats functions
+    events = events.sort_values(['distinct_id', 'time'], kind='mergesort')
+
+    if dedup_tolerance is not None:
+        events = dedup_events(events, tolerance=dedup_tolerance, subset=dedup_subset, presorted=True)
+
+    return events.reset_index(drop=True)
@@ -0,0 +1,191 @@
+"""
+    Compact on-disk columnar format for the events, opened with np.memmap so that every process and kernel
+    reading the same store shares one copy of it in the page cache.
+
+    A store is a directory with one ".npy" file per column and a "meta.json" file describing them:
+        - "distinct_id" is encoded as int32 codes (int64 above 2 ** 31 users); the original ids are kept in
+          "distinct_id.ids.pkl" and can be recovered with "EventStore.decode_ids". Every metric only counts
+          users, so the codes can be passed to the stats functions as they are.
+        - "name" and every other string column are stored as categorical codes, in the integer dtype pandas
+          itself uses for the number of categories, so that the categorical columns can wrap the mapped codes
+          without converting them; the categories are kept in "<column>.categories.pkl".
+        - "time" and every other datetime column are stored as int64 nanoseconds since the epoch.
+        - numeric and boolean columns are stored as they are.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+
+def _column_path(path, col, suffix='npy'):
+    return os.path.join(path, '{}.{}'.format(col, suffix))
+
+
+def write_event_store(events, path):
+    """
+    Function used to write an events dataframe as an event store.
+
+    :param events: (DataFrame)
+                    events dataframe having 'distinct_id', 'name' and 'time' columns, plus any property columns;
+                    every event should have a "distinct_id"
+
+    :param path: (str)
+                    directory of the store; created if it does not exist, existing columns are overwritten
+
+    :return: (EventStore)
+                    the store opened for reading
+    """
+    if not isinstance(events, DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+
+    for col in ('distinct_id', 'name', 'time'):
+        assert hasattr(events, col), '"{}" should be a column in the events dataframe'.format(col)
+    for col in events.columns:
+        assert isinstance(col, str) and os.sep not in col, 'column names should be strings usable as file names'
+
+    os.makedirs(path, exist_ok=True)
+
+    columns = {}
+    for col in events.columns:
+        values = events[col]
+
+        if col == 'distinct_id':
+            # the code of a missing id (-1) would be counted as one more user by the stats functions
+            if values.isna().any():
+                raise ValueError('"distinct_id" should not have missing values; drop or fill them first')
+            codes, ids = pd.factorize(values)
+            dtype = np.int32 if len(ids) < np.iinfo(np.int32).max else np.int64
+            np.save(_column_path(path, col), codes.astype(dtype))
+            pd.to_pickle(pd.Index(ids), _column_path(path, col, 'ids.pkl'))
+            columns[col] = {'kind': 'ids', 'dtype': np.dtype(dtype).name}
+
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            assert getattr(values.dt, 'tz', None) is None, \
+                '"{}" should be timezone naive; convert it to UTC and drop the timezone first'.format(col)
+            np.save(_column_path(path, col), values.values.astype('datetime64[ns]').view(np.int64))
+            columns[col] = {'kind': 'time', 'dtype': 'int64'}
+
+        elif pd.api.types.is_numeric_dtype(values):
+            # nullable integers are stored as floats so that missing values survive
+            array = values.values.astype(float) if pd.api.types.is_extension_array_dtype(values) else values.values
+            np.save(_column_path(path, col), array)
+            columns[col] = {'kind': 'numeric', 'dtype': array.dtype.name}
+
+        else:
+            # codes of a pandas categorical are already in the dtype pandas uses for that many categories
+            categorical = pd.Categorical(values)
+            np.save(_column_path(path, col), categorical.codes)
+            pd.to_pickle(categorical.categories, _column_path(path, col, 'categories.pkl'))
+            columns[col] = {'kind': 'category', 'dtype': categorical.codes.dtype.name}
+
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'n_rows': len(events), 'columns': columns}, f, indent=2)
+
+    return EventStore(path)
+
+
+class EventStore(object):
+    """
+    Read access to an event store written with "write_event_store".
+    Opening a store only reads its metadata; the columns are memory mapped and only paged in when used.
+
+    Example:
+        store = EventStore('/data/events_store')
+        events = store.to_frame()                       # no copy of the events is made
+        retention_table(events, 'Install', period='m')
+
+    :param path: (str)
+                    directory of the store
+
+    :param mode: (str)
+                    "r" to map the columns read-only (shared between processes) or "c" for copy-on-write,
+                    where the pages modified by this process are copied privately
+    """
+
+    def __init__(self, path, mode='r'):
+        assert mode in ['r', 'c'], '"mode" should be either "r" or "c"'
+
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            raise ValueError('"{}" is not an event store; "{}" is missing'.format(path, META_FILE))
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError('unsupported event store version {}'.format(meta['version']))
+
+        self.path = path
+        self.mode = mode
+        self.n_rows = meta['n_rows']
+        self._columns = meta['columns']
+        self._ids = None
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def columns(self):
+        """
+        (list) columns of the store
+        """
+        return list(self._columns)
+
+    def column(self, col):
+        """
+        Function used to get a single column, backed by the memory mapped file.
+
+        :param col: (str)
+                    column name
+
+        :return: (np.memmap/pd.Categorical)
+        """
+        if col not in self._columns:
+            raise KeyError('"{}" is not a column of the store'.format(col))
+
+        kind = self._columns[col]['kind']
+        values = np.load(_column_path(self.path, col), mmap_mode=self.mode)
+
+        if kind == 'time':
+            return values.view('datetime64[ns]')
+        elif kind == 'category':
+            categories = pd.read_pickle(_column_path(self.path, col, 'categories.pkl'))
+            return pd.Categorical.from_codes(values, categories=categories)
+
+        return values
+
+    def to_frame(self, columns=None):
+        """
+        Function used to get the events as a dataframe whose columns are views of the memory mapped files.
+        Nothing is copied, so it can be passed to any "stats" function without loading the events in memory;
+        "distinct_id" holds the integer codes of the users (see "decode_ids").
+
+        :param columns: (list)
+                    columns to include; all of them if None
+
+        :return: (DataFrame)
+        """
+        columns = self.columns if columns is None else columns
+
+        # copy=False keeps every column as its own block instead of consolidating (copying) same dtype columns
+        return DataFrame({col: self.column(col) for col in columns}, columns=columns, copy=False)
+
+    def decode_ids(self, codes):
+        """
+        Function used to convert "distinct_id" codes back to the original ids.
+
+        :param codes: (array/pd.Series/pd.Index)
+                    "distinct_id" codes, e.g. the index of a per-user result
+
+        :return: (pd.Index)
+                    original ids; missing for the codes equal to -1
+        """
+        if self._ids is None:
+            self._ids = pd.read_pickle(_column_path(self.path, 'distinct_id', 'ids.pkl'))
+
+        # "pd.Index.take" treats -1 as the last position unless given a fill value, which integer indexes reject
+        return pd.Index(pd.api.extensions.take(self._ids.values, np.asarray(codes), allow_fill=True))
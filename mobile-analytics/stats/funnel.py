@@ -1,7 +1,9 @@
 import pandas as pd
+from .acquisition import period_bucket
+from .sampling import sample_users, scale_counts, add_count_intervals
 
 
-def create_funnel_df(df, steps, from_date=None, to_date=None, step_interval=0):
+def create_funnel_df(df, steps, from_date=None, to_date=None, step_interval=0, backend='pandas', sample=None):
     """
     Function used to create a dataframe that can be passed to functions for generating funnel plots
 
@@ -21,8 +23,15 @@ def create_funnel_df(df, steps, from_date=None, to_date=None, step_interval=0):
                     for more info:
                     https://pandas.pydata.org/pandas-docs/version/0.23.4/generated/pandas.Timedelta.html
 
+    :param backend: (str)
+                    "pandas" or "polars" (see "stats.polars_backend" for the inputs accepted by "polars")
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
     :return: (pd.DataFrame)
-                df with 'step', 'val', 'pct', 'val-1' columns
+                df with 'step', 'val', 'pct', 'val-1' columns, plus 'val_low' and 'val_high' with the confidence
+                interval of 'val' if "sample" is set
     """
     assert isinstance(steps, list), '"steps" should be a list of strings'
 
@@ -30,65 +39,159 @@ def create_funnel_df(df, steps, from_date=None, to_date=None, step_interval=0):
         assert isinstance(step_interval, pd.Timedelta), \
             '"step_interval" should be a valid pd.Timedelta object. For more info visit:' \
             'https://pandas.pydata.org/pandas-docs/version/0.23.4/generated/pandas.Timedelta.html'
+    step_interval = pd.Timedelta(step_interval)
+
+    assert backend in ['pandas', 'polars'], '"backend" should be either "pandas" or "polars"'
+    if backend == 'polars':
+        assert sample is None, '"sample" is only supported by the pandas backend'
+        from . import polars_backend
+        return polars_backend.create_funnel_df(df, steps, from_date=from_date, to_date=to_date,
+                                               step_interval=step_interval)
+
+    if sample is not None:
+        df = sample_users(df, sample)
+
+    times = funnel_step_times(df, steps, from_date=from_date, to_date=to_date, step_interval=step_interval)
+
+    # create dataframe with the number of users that reached each step
+    funnel_df = pd.DataFrame({'step': steps, 'val': times.notna().sum().values})
+
+    if sample is not None:
+        funnel_df = add_count_intervals(scale_counts(funnel_df, sample, columns=['val']), sample, columns=['val'])
+
+    return funnel_df
+
+
+def funnel_step_times(df, steps, from_date=None, to_date=None, step_interval=pd.Timedelta(0)):
+    """
+    Function used to find the time each user completed every step of the funnel.
+    The 1st step is the user's first occurrence of it, filtered according to the dates; every subsequent step
+    is the first occurrence at least "step_interval" after the previous step, found for all the users at once
+    with a sorted as-of join instead of a full many-to-many merge.
+
+    :param df: (pd.DataFrame)
+                    events df having 'distinct_id', 'name' and 'time' columns
+
+    :param steps: (list)
+                    list containing funnel steps as strings
+
+    :param from_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param to_date: (str)
+                    date with format "yyyy-mm-dd"
 
+    :param step_interval: (pd.Timedelta)
+                    minimum time between two consecutive steps
+
+    :return: (pd.DataFrame)
+                    one column per step with the time the step was completed (NaT if not reached),
+                    indexed by the "distinct_id" of the users that did the 1st step
+    """
     # filter df for only events in the steps list
-    df = df[['distinct_id', 'name', 'time']]
-    df = df[df['name'].isin(steps)]
+    df = df.loc[df['name'].isin(steps), ['distinct_id', 'name', 'time']]
 
-    values = []
-    # create a dict to hold the filtered dataframe of each step
-    dfs = {}
-    # for each step, create a df and filter only for that step
-    for i, step in enumerate(steps):
-        if i == 0:
+    # filter for users that did the 1st event and find the minimum time
+    first = df[df['name'] == steps[0]] \
+        .sort_values(['distinct_id', 'time'], ascending=True) \
+        .drop_duplicates(subset='distinct_id', keep='first')
 
-            # filter for users that did the 1st event and find the minimum time
-            dfs[step] = df[df['name'] == step] \
-                .sort_values(['distinct_id', 'time'], ascending=True) \
-                .drop_duplicates(subset=['distinct_id', 'name'], keep='first')
+    # filter df of 1st step according to dates
+    # this will allow the 1st step to have started during the defined period
+    # but subsequent steps are allowed to occur at a later date so that the funnel
+    # is not penalised unfairly
+    if from_date:
+        first = first[first['time'] >= from_date]
 
-            # filter df of 1st step according to dates
-            # this will allow the 1st step to have started during the defined period
-            # but subsequent steps are allowed to occur at a later date so that the funnel
-            # is not penalised unfairly
-            if from_date:
-                dfs[step] = dfs[step][(dfs[step]['time'] >= from_date)]
+    if to_date:
+        first = first[first['time'] <= to_date]
 
-            if to_date:
-                dfs[step] = dfs[step][(dfs[step]['time'] <= to_date)]
+    # columns are positional while building, so that a step can appear more than once in the funnel
+    times = pd.DataFrame({0: first['time'].values}, index=pd.Index(first['distinct_id'].values, name='distinct_id'))
 
-        else:
-            # filter for specific event
-            dfs[step] = df[df['name'] == step]
+    previous = first[['distinct_id', 'time']]
+    for i, step in enumerate(steps[1:], 1):
+        # events of this step, sorted by time as required by the as-of join
+        step_events = df.loc[df['name'] == step, ['distinct_id', 'time']] \
+            .sort_values('time', kind='mergesort') \
+            .rename({'time': 'step_time'}, axis=1)
 
-            # left join with previous step
-            # this ensures only rows for which the distinct_ids appear in the previous step
-            merged = pd.merge(dfs[steps[i - 1]], dfs[step], on='distinct_id', how='left')
+        # earliest time each user can complete this step
+        previous = previous.assign(earliest=previous['time'] + step_interval) \
+            .sort_values('earliest', kind='mergesort')
 
-            # keep only events that happened after previous step and sort by time
-            merged = merged[merged['time_y'] >=
-                            (merged['time_x'] + step_interval)].sort_values('time_y', ascending=True)
+        # for each user, take the first event of this step at or after the earliest time
+        merged = pd.merge_asof(previous, step_events, left_on='earliest', right_on='step_time',
+                               by='distinct_id', direction='forward').dropna(subset=['step_time'])
 
-            # take the minimum time of the valid ones for each user
-            merged = merged.drop_duplicates(subset=['distinct_id', 'name_x', 'name_y'], keep='first')
+        times[i] = merged.set_index('distinct_id')['step_time']
+        previous = merged[['distinct_id', 'step_time']].rename({'step_time': 'time'}, axis=1)
 
-            # keep only the necessary columns and rename them to match the original structure
-            merged = merged[['distinct_id', 'name_y', 'time_y']].rename({'name_y': 'name',
-                                                                         'time_y': 'time'}, axis=1)
+    times.columns = steps
 
-            # include the df in the df dictionary so that it can be joined to the next step's df
-            dfs[step] = merged
+    return times
 
-        # append number of users to the "values" list
-        values.append(len(dfs[step]))
 
-    # create dataframe
-    funnel_df = pd.DataFrame({'step': steps, 'val': values})
+def funnel_trend_df(df, steps, period='w', month_fmt='period', from_date=None, to_date=None, step_interval=0,
+                    sample=None):
+    """
+    Function used to calculate the funnel of every period at once, with users assigned to the period in which
+    they did the 1st step (same bucketing as "stats.acquisition.acquisition_events_cohort").
+    Later steps are counted for the period of the 1st step, even if they happened in a later period.
 
-    return funnel_df
+    :param df: (pd.DataFrame)
+                    events df having 'distinct_id', 'name' and 'time' columns
 
+    :param steps: (list)
+                    list containing funnel steps as strings
+
+    :param period: (str)
+                    'd' for daily, 'w' for weekly or 'm' for monthly
+
+    :param month_fmt: (str)
+                    'period' for %Y-%m and 'datetime' for datetime like
+
+    :param from_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param to_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param step_interval: (pd.Timedelta)
+                    minimum time between two consecutive steps
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
+    :return: (pd.DataFrame)
+                number of users that reached each step (columns) per period of the 1st step (index), followed by
+                "<step>_low" and "<step>_high" columns with the confidence interval of each count if "sample" is set
+    """
+    assert isinstance(steps, list), '"steps" should be a list of strings'
+    assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+
+    if step_interval != 0:
+        assert isinstance(step_interval, pd.Timedelta), \
+            '"step_interval" should be a valid pd.Timedelta object. For more info visit:' \
+            'https://pandas.pydata.org/pandas-docs/version/0.23.4/generated/pandas.Timedelta.html'
+    step_interval = pd.Timedelta(step_interval)
+
+    if sample is not None:
+        df = sample_users(df, sample)
 
-def group_funnel_dfs(events, steps, col):
+    times = funnel_step_times(df, steps, from_date=from_date, to_date=to_date, step_interval=step_interval)
+    cohort = period_bucket(times.iloc[:, 0], period=period, month_fmt=month_fmt).rename('cohort')
+
+    trend_df = times.notna().groupby(cohort).sum().astype(int)
+    trend_df.columns.name = 'step'
+
+    if sample is not None:
+        trend_df = add_count_intervals(scale_counts(trend_df, sample), sample, columns=trend_df.columns)
+
+    return trend_df
+
+
+def group_funnel_dfs(events, steps, col, sample=None):
     """
     Function used to create a dict of funnel dataframes used to generate a stacked funnel plot
 
@@ -102,13 +205,20 @@ def group_funnel_dfs(events, steps, col):
     :param col: (str)
                     column to be used for grouping the funnel dataframes
 
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
     :return: (dict)
-                    dict of dataframes
+                    dict of dataframes, with the confidence interval columns of "create_funnel_df" if "sample" is set
     """
     assert isinstance(events, pd.DataFrame), '"events" should be a pandas dataframe'
     assert isinstance(col, str), '"col" should be a string'
     assert hasattr(events, col), '"col" should be a column in "events"'
 
+    # sample the users once for all the groups
+    if sample is not None:
+        events = sample_users(events, sample)
+
     dict_ = {}
     # get the distinct_ids for each property that we are grouping by
     ids = dict(events.groupby([col])['distinct_id'].apply(set))
@@ -118,5 +228,8 @@ def group_funnel_dfs(events, steps, col):
         df = events[events['distinct_id'].isin(ids_list)].copy()
         if len(df[df['name'] == steps[0]]) > 0:
            dict_[entry] = create_funnel_df(df, steps)
+           if sample is not None:
+               dict_[entry] = add_count_intervals(scale_counts(dict_[entry], sample, columns=['val']), sample,
+                                                  columns=['val'])
 
     return dict_
@@ -0,0 +1,214 @@
+import time
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+class IdentityIndex(object):
+    """
+    Union-find index over (alias, distinct_id) pairs used to stitch the anonymous and identified ids of a user
+    into a single canonical id.
+
+    Ids are encoded into integer positions the first time they are seen, and the union-find forest is kept as a
+    numpy "parent" array, so that both merging new alias pairs and remapping the events are vectorised.
+    The canonical id of each group is the first id seen for the group that never appears as an alias
+    (first element of a pair), i.e. the identified user id at the end of a chain of aliases.
+
+    :param alias_pairs: (DataFrame/list)
+                        optional initial (alias, distinct_id) pairs, see "add_aliases"
+    """
+
+    def __init__(self, alias_pairs=None):
+        self._ids = pd.Index([], dtype=object)
+        self._parent = np.empty(0, dtype=np.int64)
+        self._aliased = np.empty(0, dtype=bool)
+        self._mapping = None
+
+        if alias_pairs is not None:
+            self.add_aliases(alias_pairs)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _encode(self, ids):
+        """
+        Encode ids into positions in the index, appending the ones that have not been seen before.
+        """
+        ids = pd.Index(ids)
+        new_ids = ids.unique()
+        new_ids = new_ids[self._ids.get_indexer(new_ids) < 0]
+
+        if len(new_ids):
+            n = len(self._ids)
+            self._ids = self._ids.append(new_ids)
+            self._parent = np.concatenate([self._parent, np.arange(n, n + len(new_ids))])
+            self._aliased = np.concatenate([self._aliased, np.zeros(len(new_ids), dtype=bool)])
+
+        return self._ids.get_indexer(ids)
+
+    def _compress(self):
+        """
+        Point every node directly at the root of its tree (pointer jumping).
+        """
+        parent = self._parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        self._parent = parent
+
+    def add_aliases(self, alias_pairs):
+        """
+        Merge new (alias, distinct_id) pairs into the index. Can be called repeatedly as new pairs arrive.
+
+        :param alias_pairs: (DataFrame/list)
+                        dataframe with two columns or list of (alias, distinct_id) tuples
+
+        :return: (IdentityIndex)
+                        self, to allow chaining
+        """
+        if isinstance(alias_pairs, DataFrame):
+            assert alias_pairs.shape[1] == 2, '"alias_pairs" should have exactly two columns'
+            aliases, distinct_ids = alias_pairs.iloc[:, 0].values, alias_pairs.iloc[:, 1].values
+        else:
+            alias_pairs = list(alias_pairs)
+            if not alias_pairs:
+                return self
+            aliases, distinct_ids = zip(*alias_pairs)
+
+        a = self._encode(aliases)
+        b = self._encode(distinct_ids)
+        self._aliased[a] = True
+
+        # link the root with the higher position below the one with the lower position until every pair
+        # shares a root; the parent of a node is never greater than the node itself, so this converges
+        while True:
+            self._compress()
+            root_a, root_b = self._parent[a], self._parent[b]
+            unmerged = root_a != root_b
+            if not unmerged.any():
+                break
+            np.minimum.at(self._parent,
+                          np.maximum(root_a[unmerged], root_b[unmerged]),
+                          np.minimum(root_a[unmerged], root_b[unmerged]))
+
+        self._mapping = None
+
+        return self
+
+    @property
+    def mapping(self):
+        """
+        (np.array) position of the canonical id for each encoded id
+        """
+        if self._mapping is None:
+            n = len(self._ids)
+            positions = np.arange(n)
+            roots = self._parent
+
+            # the lowest position of each group that was never used as an alias wins,
+            # otherwise (a cycle of aliases) fall back to the root
+            key = np.where(self._aliased, positions + n, positions)
+            best = np.full(n, 2 * n, dtype=np.int64)
+            np.minimum.at(best, roots, key)
+            best = best[roots]
+            self._mapping = np.where(best >= n, best - n, best)
+
+        return self._mapping
+
+    def canonical_codes(self):
+        """
+        Function used to generate a compact 0..k-1 code of the canonical user for each encoded id.
+
+        :return: (np.array)
+        """
+        return np.unique(self.mapping, return_inverse=True)[1]
+
+    def to_dict(self):
+        """
+        Function used to generate a dict with "alias": "canonical_id" key:value pairs.
+
+        :return: (dict)
+                        pairs only for ids that are not already canonical
+        """
+        aliased = self.mapping != np.arange(len(self._ids))
+
+        return dict(zip(self._ids[aliased], self._ids[self.mapping[aliased]]))
+
+    def remap(self, events, col='distinct_id'):
+        """
+        Function used to replace every aliased id in "col" with its canonical id.
+        The column is factorized once, so only its unique ids are looked up in the index before a single take
+        back to the events. Ids that are not present in the index (and missing ids) are left untouched.
+
+        :param events: (DataFrame)
+                        events dataframe
+
+        :param col: (str)
+                        column holding the ids to be resolved
+
+        :return: (DataFrame)
+        """
+        if not isinstance(events, DataFrame):
+            raise TypeError('"events" should be a pandas dataframe')
+
+        values = events[col].values
+        codes, uniques = pd.factorize(values)
+        positions = self._ids.get_indexer(uniques)
+        known = positions >= 0
+        if not known.any():
+            return events
+
+        canonical = self._ids.values.take(self.mapping)
+        uniques = np.array(uniques, dtype=uniques.dtype if uniques.dtype == canonical.dtype else object)
+        uniques[known] = canonical.take(positions[known])
+
+        ids = uniques.take(codes)
+        missing = codes < 0
+        if missing.any():
+            ids = ids.astype(object)
+            ids[missing] = values[missing]
+
+        # copy=False only replaces "col" instead of copying every column of the events
+        return DataFrame({c: ids if c == col else events[c] for c in events.columns}, columns=events.columns,
+                         index=events.index, copy=False)
+
+
+def benchmark(events, alias_pairs, col='distinct_id', repeat=3):
+    """
+    Function used to time the identity stitching of the events against a plain dict lookup.
+
+    :param events: (DataFrame)
+                    events dataframe
+
+    :param alias_pairs: (DataFrame/list)
+                    (alias, distinct_id) pairs, see "IdentityIndex.add_aliases"
+
+    :param col: (str)
+                    column holding the ids to be resolved
+
+    :param repeat: (int)
+                    number of runs per step; the best time is kept
+
+    :return: (pd.Series)
+                    best time in seconds of building the index ('add_aliases'), remapping the events with it
+                    ('remap') and of resolving the same ids with "Series.map" over the "to_dict" pairs ('dict_map')
+    """
+    index = IdentityIndex(alias_pairs)
+    mapping = index.to_dict()
+    steps = {'add_aliases': lambda: IdentityIndex(alias_pairs),
+             'remap': lambda: index.remap(events, col=col),
+             'dict_map': lambda: events[col].map(lambda x: mapping.get(x, x))}
+
+    timings = {}
+    for step, function in steps.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[step] = best
+
+    return pd.Series(timings)
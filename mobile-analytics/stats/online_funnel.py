@@ -0,0 +1,228 @@
+"""
+    Online version of "stats.funnel.create_funnel_df", updated with micro-batches of events as they land.
+
+    Each user is tracked from his/her first occurrence of the 1st step with the index of the next step to
+    complete, the time of the last completed step and the time of the 1st step (for the conversion window),
+    stored in numpy arrays indexed by an integer code per user. Consuming a batch only looks at the events of
+    the batch and the state of the users in it, so the funnel is never recomputed from the full history.
+"""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# step index of users whose 1st step happened outside of the (from_date, to_date) range; never counted
+EXCLUDED = -1
+
+
+class OnlineFunnel(object):
+    """
+    Funnel counts kept up to date with micro-batches of events consumed in time order.
+
+    Replaying the events in time ordered batches gives the same "funnel_df" as "stats.funnel.create_funnel_df"
+    with the same steps, dates and step interval (and no conversion window).
+
+    Example:
+        funnel = OnlineFunnel(['Install', 'SignUp', 'Purchase'], step_interval=pd.Timedelta('1m'))
+        for batch in batches:
+            funnel.update(batch)
+            funnel.funnel_df()
+        funnel.save('funnel.pkl')
+
+    :param steps: (list)
+                        list containing funnel steps as strings
+
+    :param from_date: (str)
+                        date with format "yyyy-mm-dd"; users that did the 1st step earlier are not counted
+
+    :param to_date: (str)
+                        date with format "yyyy-mm-dd"; users that did the 1st step later are not counted
+
+    :param step_interval: (pd.Timedelta)
+                        minimum time between two consecutive steps
+
+    :param conversion_window: (pd.Timedelta)
+                        maximum time between the 1st step and any subsequent step; no limit if None
+    """
+
+    def __init__(self, steps, from_date=None, to_date=None, step_interval=0, conversion_window=None):
+        assert isinstance(steps, list) and steps, '"steps" should be a non-empty list of strings'
+        assert len(steps) < np.iinfo(np.int16).max, '"steps" has too many steps'
+
+        self.steps = steps
+        self.from_date = from_date
+        self.to_date = to_date
+        self.step_interval = pd.Timedelta(step_interval)
+        self.conversion_window = pd.Timedelta(conversion_window) if conversion_window is not None else None
+
+        # code of the event name required by each step; the extra -1 entry never matches and is used
+        # for users that completed the funnel (and, indexed by -1, for the excluded ones)
+        self._names = pd.Index(pd.unique(pd.Series(steps)))
+        self._step_names = np.append(self._names.get_indexer(steps), -1)
+
+        # per user state; the code of each user is the position of his/her id in "_ids"
+        self._ids = pd.Index([], dtype=object)
+        self._n = 0
+        self._step = np.zeros(0, dtype=np.int16)
+        self._last = np.zeros(0, dtype=np.int64)
+        self._start = np.zeros(0, dtype=np.int64)
+
+        # latest event time consumed, used to check that batches arrive in time order
+        self._watermark = None
+
+    def __len__(self):
+        return self._n
+
+    def _grow(self, n_users):
+        """
+        Make room for "n_users" more users, doubling the capacity of the state arrays when needed.
+        """
+        needed = self._n + n_users
+        if needed <= len(self._step):
+            return
+
+        capacity = max(needed, 2 * len(self._step), 1024)
+        for name in ('_step', '_last', '_start'):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self._n] = array[:self._n]
+            setattr(self, name, grown)
+
+    def _encode(self, ids, first_step):
+        """
+        Integer code of the user of each event; users are added the first time they do the 1st step
+        and events of users that are not tracked get -1.
+        """
+        batch_codes, uniques = pd.factorize(ids)
+
+        codes = self._ids.get_indexer(uniques)
+
+        # start tracking the users doing the 1st step for the first time
+        new = (codes == -1) & np.isin(np.arange(len(uniques)), batch_codes[first_step])
+        n_new = int(new.sum())
+        codes[new] = np.arange(self._n, self._n + n_new)
+        self._ids = self._ids.append(pd.Index(uniques[new], dtype=object))
+
+        self._grow(n_new)
+        self._n += n_new
+
+        # events with a missing id (code -1) are never tracked
+        return np.append(codes, -1)[batch_codes]
+
+    def update(self, events):
+        """
+        Function used to consume a micro-batch of events.
+        Batches should be consumed in time order, i.e. no event can be earlier than an event already consumed,
+        and events with the same time should not be split across batches.
+
+        :param events: (DataFrame)
+                        events dataframe having 'distinct_id', 'name' and 'time' columns
+
+        :return: (OnlineFunnel)
+                        self, to allow chaining
+        """
+        if not isinstance(events, DataFrame):
+            raise TypeError('"events" should be a pandas dataframe')
+
+        events = events.loc[events['name'].isin(self._names), ['distinct_id', 'name', 'time']]
+        if not len(events):
+            return self
+
+        events = events.sort_values('time', kind='mergesort')
+        time = events['time'].values.astype('datetime64[ns]').astype(np.int64)
+        if self._watermark is not None and time[0] < self._watermark:
+            raise ValueError('events should be consumed in time order; the batch starts at {} but events up to {} '
+                             'have already been consumed'.format(pd.Timestamp(time[0]),
+                                                                 pd.Timestamp(self._watermark)))
+        self._watermark = time[-1]
+
+        name = self._names.get_indexer(events['name'])
+        user = self._encode(events['distinct_id'].values, name == self._step_names[0])
+
+        tracked = user >= 0
+        user, name, time = user[tracked], name[tracked], time[tracked]
+
+        interval = self.step_interval.value
+        window = self.conversion_window.value if self.conversion_window is not None else None
+
+        # every round advances each user by at most one step, using the earliest event of the batch that
+        # completes his/her next step; an event can complete consecutive steps in successive rounds
+        while True:
+            step = self._step[user]
+            valid = (self._step_names[step] == name) & ((step == 0) | (time >= self._last[user] + interval))
+            if window is not None:
+                valid &= (step == 0) | (time <= self._start[user] + window)
+
+            matched = np.flatnonzero(valid)
+            if not len(matched):
+                break
+
+            # events are sorted by time, so the first match of each user is the earliest one
+            matched = matched[np.unique(user[matched], return_index=True)[1]]
+            advanced, advanced_time = user[matched], time[matched]
+            previous_step = self._step[advanced]
+
+            self._start[advanced] = np.where(previous_step == 0, advanced_time, self._start[advanced])
+            self._last[advanced] = advanced_time
+            self._step[advanced] = previous_step + 1
+
+            # users whose 1st step happened outside of the date range are never counted
+            started = previous_step == 0
+            if self.from_date:
+                self._step[advanced[started & (advanced_time < pd.Timestamp(self.from_date).value)]] = EXCLUDED
+            if self.to_date:
+                self._step[advanced[started & (advanced_time > pd.Timestamp(self.to_date).value)]] = EXCLUDED
+
+        return self
+
+    def funnel_df(self):
+        """
+        Function used to get the current funnel counts.
+
+        :return: (pd.DataFrame)
+                    df with 'step' and 'val' columns, as returned by "stats.funnel.create_funnel_df"
+        """
+        step = self._step[:self._n]
+        completed = np.bincount(step[step != EXCLUDED], minlength=len(self.steps) + 1)
+
+        # users that completed i steps also reached all the previous ones
+        values = completed[::-1].cumsum()[::-1][1:]
+
+        return pd.DataFrame({'step': self.steps, 'val': values})
+
+    def save(self, path):
+        """
+        Function used to checkpoint the funnel state to disk.
+
+        :param path: (str)
+                    file path
+        """
+        pd.to_pickle({'steps': self.steps,
+                      'from_date': self.from_date,
+                      'to_date': self.to_date,
+                      'step_interval': self.step_interval,
+                      'conversion_window': self.conversion_window,
+                      'ids': self._ids,
+                      'step': self._step[:self._n],
+                      'last': self._last[:self._n],
+                      'start': self._start[:self._n],
+                      'watermark': self._watermark}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Function used to restore a funnel checkpointed with "save"; consuming can carry on from the next batch.
+
+        :param path: (str)
+                    file path
+
+        :return: (OnlineFunnel)
+        """
+        state = pd.read_pickle(path)
+        funnel = cls(state['steps'], from_date=state['from_date'], to_date=state['to_date'],
+                     step_interval=state['step_interval'], conversion_window=state['conversion_window'])
+        funnel._ids = state['ids']
+        funnel._n = len(state['step'])
+        funnel._step, funnel._last, funnel._start = state['step'], state['last'], state['start']
+        funnel._watermark = state['watermark']
+
+        return funnel
@@ -0,0 +1,386 @@
+"""
+    Polars/Arrow backend for the core stats functions.
+
+    Each metric is built as a polars lazy query, so it runs on the multithreaded polars engine and the
+    sub-queries shared by a metric (e.g. the acquisition time of each user) are only computed once.
+    Inputs can be polars DataFrames/LazyFrames, pyarrow Tables or pandas DataFrames; outputs are assembled by
+    the same helpers the pandas path uses ("users_per_period_table", "retention_table_from_counts" and
+    "journey_counts"), so they have exactly the same shape.
+
+    polars (and pyarrow for Arrow/pandas inputs) are optional dependencies, only needed for this backend.
+    The backend is normally used through the "backend='polars'" argument of the stats functions.
+"""
+import time as timer
+import pandas as pd
+from pandas import DataFrame
+from .acquisition import users_per_period_table, period_index, MISSING_SEGMENT
+from .retention import retention_table_from_counts
+from .user_journey import journey_counts
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# polars truncation interval per period; polars weeks start on Monday, as in "acquisition_events_cohort"
+PERIOD_INTERVAL = {'d': '1d', 'w': '1w', 'm': '1mo'}
+
+
+def _lazy(events):
+    """
+    Convert the supported inputs to a polars LazyFrame.
+    """
+    if pl is None:
+        raise ImportError('"polars" should be installed to use the polars backend: pip install polars')
+
+    if isinstance(events, pl.LazyFrame):
+        return events
+    elif isinstance(events, pl.DataFrame):
+        return events.lazy()
+    elif isinstance(events, DataFrame):
+        return pl.from_pandas(events).lazy()
+
+    # anything else is expected to be an Arrow table/record batch
+    return pl.from_arrow(events).lazy()
+
+
+def _truncate(col, period):
+    return pl.col(col).dt.truncate(PERIOD_INTERVAL[period])
+
+
+def _to_pandas(df):
+    """
+    Convert a (small, aggregated) polars DataFrame to pandas without requiring pyarrow.
+    """
+    return DataFrame(df.to_dict(as_series=False), columns=df.columns)
+
+
+def _acquisition(lf, acquisition_event_name, period):
+    """
+    Lazy queries for the acquisition time of each user and the cohort columns of each event,
+    mirroring "acquisition_events_cohort".
+    """
+    acquisition = lf.filter(pl.col('name') == acquisition_event_name) \
+        .group_by('distinct_id') \
+        .agg(pl.col('time').min().alias('acquisition_time'))
+
+    events = lf.join(acquisition, on='distinct_id', how='inner') \
+        .with_columns(_truncate('acquisition_time', period).alias('cohort'),
+                      _truncate('time', period).alias('event_period'))
+
+    sizes = acquisition.group_by(_truncate('acquisition_time', period).alias('cohort')) \
+        .agg(pl.len().alias('size'))
+
+    return events, sizes
+
+
+def _sizes_series(sizes, period, month_fmt):
+    sizes = _to_pandas(sizes)
+    if sizes.empty:
+        raise ValueError('"acquisition_event_name" should be a valid event present in the events dataframe')
+
+    return pd.Series(sizes['size'].values, index=period_index(sizes['cohort'], period, month_fmt), name='size') \
+        .rename_axis('cohort')
+
+
+def users_per_period(events, acquisition_event_name, user_source_col, period='w', month_fmt='period'):
+    """
+    Polars version of "stats.acquisition.users_per_period".
+
+    :param events: (pl.DataFrame/pl.LazyFrame/pa.Table/DataFrame)
+                        events table
+
+    :param acquisition_event_name: (str)
+                        event name defining the user acquisition point
+
+    :param user_source_col: (str)
+                        name of column defining if user is an Organic/Non-organic acquisition
+
+    :param period: (str)
+                        str denoting period for cohort breakdown.
+                        Use 'd' for daily, 'w' for weekly or 'm' for monthly
+
+    :param month_fmt: (str)
+                        str denoting format for monthly date.
+                        Use 'period' for %Y-%m and 'datetime' for datetime like.
+
+    :return: (DataFrame)
+    """
+    assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+
+    lf = _lazy(events)
+    if user_source_col:
+        assert user_source_col in lf.collect_schema().names(), \
+            '"user_source_col" should be a column in the events dataframe'
+
+    cohort_events, sizes = _acquisition(lf, acquisition_event_name, period)
+
+    # active and returning users in a single aggregation; returning events are a subset of the active ones
+    activity = cohort_events.filter(pl.col('time') >= pl.col('acquisition_time')) \
+        .group_by('event_period') \
+        .agg(pl.col('distinct_id').n_unique().alias('Active Users'),
+             pl.col('distinct_id').filter(pl.col('event_period') > pl.col('cohort')).n_unique()
+             .alias('Returning Users'))
+
+    queries = [sizes, activity]
+    if user_source_col:
+        queries.append(cohort_events.filter(pl.col('name') == acquisition_event_name)
+                       .group_by(['cohort', user_source_col])
+                       .agg(pl.col('distinct_id').n_unique().alias('n')))
+
+    # run all the queries together so that the common sub-plans are computed once
+    results = pl.collect_all(queries)
+
+    sizes = _sizes_series(results[0], period, month_fmt)
+
+    activity = _to_pandas(results[1])
+    activity.index = period_index(activity.pop('event_period'), period, month_fmt)
+
+    source = None
+    if user_source_col:
+        source = _to_pandas(results[2])
+        source = pd.Series(source['n'].values,
+                           index=pd.MultiIndex.from_arrays([period_index(source['cohort'], period, month_fmt),
+                                                            source[user_source_col]],
+                                                           names=['cohort', user_source_col]))
+
+    return users_per_period_table(sizes, activity, period=period, source=source)
+
+
+def retention_table(events, acquisition_event_name, period='w', month_fmt='period', event_filter=None,
+                    segment_col=None):
+    """
+    Polars version of "stats.retention.retention_table".
+
+    :param events: (pl.DataFrame/pl.LazyFrame/pa.Table/DataFrame)
+                    events table
+
+    :param acquisition_event_name: (str)
+                    event name defining the user acquisition point
+
+    :param period: (str)
+                    str denoting period for cohort breakdown. use 'w' for weekly and 'm' for monthly
+
+    :param month_fmt: (str)
+                    str denoting format for monthly date. Use 'period' for %Y-%m and 'datetime' for datetime like.
+
+    :param event_filter: (str)
+                    event to filter for
+
+    :param segment_col: (str)
+                    string column used to break the retention tables down by a user property, taken from the
+                    acquisition event of each user (see "stats.retention.retention_table")
+
+    :return: (DataFrame, DataFrame)
+    """
+    assert period in ['w', 'm'], '"period" should be either "w" or "m"'
+
+    lf = _lazy(events)
+    cohort_events, sizes = _acquisition(lf, acquisition_event_name, period)
+
+    keys = ['cohort', 'event_period']
+    if segment_col:
+        assert segment_col in lf.collect_schema().names(), '"segment_col" should be a column in the events dataframe'
+
+        # value on the first acquisition event of each user, the first one in the events order if there are ties
+        segments = lf.filter(pl.col('name') == acquisition_event_name) \
+            .sort('time', maintain_order=True) \
+            .group_by('distinct_id', maintain_order=True) \
+            .agg(pl.col(segment_col).first().cast(pl.String).fill_null(MISSING_SEGMENT))
+        cohort_events = cohort_events.drop(segment_col).join(segments, on='distinct_id', how='inner')
+        sizes = cohort_events.group_by([segment_col, 'cohort']) \
+            .agg(pl.col('distinct_id').n_unique().alias('size'))
+        keys = [segment_col] + keys
+
+    active = cohort_events.filter(pl.col('time') >= pl.col('acquisition_time'))
+    if event_filter:
+        active = active.filter(pl.col('name') == event_filter)
+
+    counts = active.group_by(keys) \
+        .agg(pl.col('distinct_id').n_unique())
+
+    sizes, counts = pl.collect_all([sizes, counts])
+
+    if event_filter:
+        assert len(counts) > 0, '"event_filter" should be a valid event present in "events"'
+
+    counts = _to_pandas(counts)
+    index = [period_index(counts['cohort'], period, month_fmt),
+             period_index(counts['event_period'], period, month_fmt)]
+
+    if segment_col:
+        sizes = _to_pandas(sizes)
+        if sizes.empty:
+            raise ValueError('"acquisition_event_name" should be a valid event present in the events dataframe')
+        sizes = pd.Series(sizes['size'].values, name='size',
+                          index=pd.MultiIndex.from_arrays([sizes[segment_col],
+                                                           period_index(sizes['cohort'], period, month_fmt)],
+                                                          names=[segment_col, 'cohort']))
+        index = [counts[segment_col]] + index
+    else:
+        sizes = _sizes_series(sizes, period, month_fmt)
+
+    counts.index = pd.MultiIndex.from_arrays(index, names=keys)
+    counts = counts[['distinct_id']]
+
+    return retention_table_from_counts(counts, sizes, period=period, month_fmt=month_fmt)
+
+
+def create_funnel_df(events, steps, from_date=None, to_date=None, step_interval=0):
+    """
+    Polars version of "stats.funnel.create_funnel_df".
+    Each step is matched to the first valid event of the next step with a forward as-of join by user.
+
+    :param events: (pl.DataFrame/pl.LazyFrame/pa.Table/DataFrame)
+                    events table having 'distinct_id', 'name' and 'time' columns
+
+    :param steps: (list)
+                    list containing funnel steps as strings
+
+    :param from_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param to_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param step_interval: (pd.Timedelta)
+                    minimum time between two consecutive steps
+
+    :return: (pd.DataFrame)
+                df with 'step' and 'val' columns
+    """
+    assert isinstance(steps, list), '"steps" should be a list of strings'
+
+    lf = _lazy(events).select(['distinct_id', 'name', 'time'])
+    step_interval = pd.Timedelta(step_interval).to_pytimedelta()
+    # the as-of join keys must have the same time unit as the events
+    time_dtype = lf.collect_schema()['time']
+
+    # the 1st step is the first time each user did it, filtered by dates afterwards
+    # so that subsequent steps are allowed to occur at a later date
+    current = lf.filter(pl.col('name') == steps[0]) \
+        .group_by('distinct_id') \
+        .agg(pl.col('time').min())
+    if from_date:
+        current = current.filter(pl.col('time') >= pd.Timestamp(from_date).to_pydatetime())
+    if to_date:
+        current = current.filter(pl.col('time') <= pd.Timestamp(to_date).to_pydatetime())
+
+    counts = [current.select(pl.len())]
+    for step in steps[1:]:
+        candidates = lf.filter(pl.col('name') == step) \
+            .select(['distinct_id', pl.col('time').alias('step_time')]) \
+            .sort('step_time')
+
+        # both sides are sorted on their join keys, so polars does not need to check it per user
+        current = current.with_columns((pl.col('time') + step_interval).cast(time_dtype).alias('earliest')) \
+            .sort('earliest') \
+            .join_asof(candidates, left_on='earliest', right_on='step_time', by='distinct_id', strategy='forward',
+                       check_sortedness=False) \
+            .filter(pl.col('step_time').is_not_null()) \
+            .select(['distinct_id', pl.col('step_time').alias('time')])
+        counts.append(current.select(pl.len()))
+
+    values = [count.item() for count in pl.collect_all(counts)]
+
+    return DataFrame({'step': steps, 'val': values})
+
+
+def user_journey(events, starting_step, n_steps=3, events_per_step=5):
+    """
+    Polars version of "stats.user_journey.user_journey".
+    Events with the same time are ordered by input order, matching the stable sort of the pandas path.
+
+    :param events: (pl.DataFrame/pl.LazyFrame/pa.Table/DataFrame)
+                    events table
+
+    :param starting_step: (str)
+                    the event which should be considered as the starting point of the user journey.
+
+    :param n_steps: (int)
+                    number of events to return
+
+    :param events_per_step: (int)
+                    number of events to show per step.
+                    The rest (less frequent) events will be grouped together into an "Other" block.
+
+    :return: (DataFrame)
+    """
+    assert isinstance(events_per_step, int), '"events_per_step" should be an integer'
+    if events_per_step < 1:
+        raise ValueError('"events_per_step" should be equal or greater than 1')
+
+    ranked = _lazy(events).select(['distinct_id', 'name', 'time']) \
+        .sort(['distinct_id', 'time'], maintain_order=True) \
+        .with_columns(pl.int_range(pl.len()).over('distinct_id').alias('rn'))
+
+    start = ranked.filter(pl.col('name') == starting_step) \
+        .group_by('distinct_id') \
+        .agg(pl.col('rn').min().alias('start'))
+
+    steps = ranked.join(start, on='distinct_id', how='inner') \
+        .filter((pl.col('rn') >= pl.col('start')) & (pl.col('rn') < pl.col('start') + n_steps)) \
+        .select(['distinct_id', (pl.col('rn') - pl.col('start')).alias('step'), 'name']) \
+        .collect()
+
+    # one row per user with the i-th event of the journey in column i
+    flow = _to_pandas(steps).set_index(['distinct_id', 'step'])['name'] \
+        .unstack('step') \
+        .reindex(columns=range(n_steps))
+    flow.columns = list(range(n_steps))
+
+    return journey_counts(flow, n_steps=n_steps, events_per_step=events_per_step)
+
+
+def benchmark(events, acquisition_event_name, steps, starting_step, period='w', repeat=3):
+    """
+    Function used to compare the run time of the pandas and polars backends on the same events.
+
+    :param events: (DataFrame)
+                    pandas events dataframe; it is converted to polars once, outside of the timings
+
+    :param acquisition_event_name: (str)
+                    event name defining the user acquisition point
+
+    :param steps: (list)
+                    funnel steps
+
+    :param starting_step: (str)
+                    starting step of the user journeys
+
+    :param period: (str)
+                    period used for "users_per_period" and "retention_table"
+
+    :param repeat: (int)
+                    number of runs per metric and backend; the best time is kept
+
+    :return: (DataFrame)
+                    best time in seconds per metric (rows) and backend (columns)
+    """
+    from .acquisition import users_per_period as users_per_period_pd
+    from .retention import retention_table as retention_table_pd
+    from .funnel import create_funnel_df as create_funnel_df_pd
+    from .user_journey import user_journey as user_journey_pd
+
+    inputs = {'pandas': events, 'polars': pl.from_pandas(events)}
+    metrics = {
+        'users_per_period': ((users_per_period_pd, users_per_period),
+                             (acquisition_event_name, None), {'period': period}),
+        'retention_table': ((retention_table_pd, retention_table),
+                            (acquisition_event_name,), {'period': period}),
+        'create_funnel_df': ((create_funnel_df_pd, create_funnel_df), (steps,), {}),
+        'user_journey': ((user_journey_pd, user_journey), (starting_step,), {}),
+    }
+
+    timings = {}
+    for metric, (functions, args, kwargs) in metrics.items():
+        for backend, function in zip(['pandas', 'polars'], functions):
+            best = None
+            for _ in range(repeat):
+                start = timer.perf_counter()
+                function(inputs[backend], *args, **kwargs)
+                elapsed = timer.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[(metric, backend)] = best
+
+    return pd.Series(timings).unstack()
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
-from .acquisition import acquisition_events_cohort
+from .acquisition import acquisition_events_cohort, acquisition_segments, cohort_sizes
+from .sampling import sample_users, scale_counts, table_proportion_intervals
 
 
 def cohort_period(df):
@@ -34,13 +35,17 @@ def mask_retention_table(dim):
     return mask
 
 
-def retention_table(events, period='w', month_fmt='period', event_filter=None):
+def retention_table(events, acquisition_event_name, period='w', month_fmt='period', event_filter=None,
+                    segment_col=None, backend='pandas', sample=None):
     """
     Function used to generate retention stats split into weekly cohorts
 
     :param events: (DataFrame)
                     Mixpanel events dataframe
 
+    :param acquisition_event_name: (str)
+                    event name defining the user acquisition point
+
     :param period: (str)
                     str denoting period for cohort breakdown. use 'w' for weekly and 'm' for monthly
 
@@ -50,94 +55,224 @@ def retention_table(events, period='w', month_fmt='period', event_filter=None):
     :param event_filter: (str)
                     mixpanel event to filter for
 
-    :return: (DataFrame)
+    :param segment_col: (str)
+                    column used to break the retention tables down by a user property (e.g. source, country).
+                    Each user belongs to the segment of his/her acquisition event, or to the
+                    "stats.acquisition.MISSING_SEGMENT" segment if it has no value. All the segments are
+                    calculated in a single grouped pass and returned with "segment_col" as an extra outer
+                    index level, so "user_retention.loc[segment]" is the table of one segment.
+
+    :param backend: (str)
+                    "pandas" or "polars" (see "stats.polars_backend" for the inputs accepted by "polars")
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
+    :return: (DataFrame, DataFrame)
+                    user retention counts and percentages. If "sample" is set, the confidence interval of the
+                    percentages is given by "retention_intervals"
     """
     assert period in ['w', 'm'], '"period" should be either "w" or "m"'
+    assert backend in ['pandas', 'polars'], '"backend" should be either "pandas" or "polars"'
+    if backend == 'polars':
+        assert sample is None, '"sample" is only supported by the pandas backend'
+        from . import polars_backend
+        return polars_backend.retention_table(events, acquisition_event_name, period=period, month_fmt=month_fmt,
+                                              event_filter=event_filter, segment_col=segment_col)
+
     if event_filter:
         assert event_filter in events['name'].unique(), '"event_filter" should be a valid event present in "events"'
+    if segment_col:
+        assert hasattr(events, segment_col), '"segment_col" should be a column in the events dataframe'
+
+    if sample is not None:
+        events = sample_users(events, sample)
+
+    # get acquisition time of each user and create an event_period column for each event
+    # determine if each event happened at or after the user acquisition
+    events = acquisition_events_cohort(events, acquisition_event_name, period=period, month_fmt=month_fmt)
+
+    user_retention, user_retention_pct = retention_table_from_cohort(events, period=period, month_fmt=month_fmt,
+                                                                     event_filter=event_filter,
+                                                                     segment_col=segment_col,
+                                                                     acquisition_event_name=acquisition_event_name)
+
+    # scale the counts and cohort sizes of the sample back up; percentages are unaffected
+    if sample is not None:
+        user_retention = scale_counts(user_retention, sample, index_levels=['size'])
+        user_retention_pct = scale_counts(user_retention_pct, sample, columns=[], index_levels=['size'])
+
+    return user_retention, user_retention_pct
+
+
+def retention_intervals(user_retention, sample, confidence=0.95):
+    """
+    Function used to calculate the confidence interval of the retention percentages of a sampled
+    "retention_table", e.g. to pass to "visualisations.retention_plots.retention_heatmap".
+
+    :param user_retention: (DataFrame)
+                    user retention counts, as returned by "retention_table" with "sample"
+
+    :param sample: (float)
+                    sampling rate passed to "retention_table"
+
+    :param confidence: (float)
+                    confidence level of the interval
+
+    :return: (DataFrame, DataFrame)
+                    lower and upper bounds, shaped as the retention percentages
+    """
+    return table_proportion_intervals(user_retention, sample, confidence=confidence)
+
+
+def retention_table_from_cohort(events, period='w', month_fmt='period', event_filter=None, sizes=None,
+                                segment_col=None, acquisition_event_name=None):
+    """
+    Function used to calculate the "retention_table" stats from events that already have the cohort columns.
+    A precomputed "cohort_sizes" result can be passed in when it is shared with other metrics
+    (see "stats.analysis.Analysis").
+
+    :param events: (DataFrame)
+                    events dataframe as returned by "acquisition_events_cohort"
+
+    :param period: (str)
+                    period used when generating the cohort columns
+
+    :param month_fmt: (str)
+                    month format used when generating the cohort columns
+
+    :param event_filter: (str)
+                    mixpanel event to filter for
+
+    :param sizes: (pd.Series)
+                    output of "stats.acquisition.cohort_sizes"; calculated if None. Ignored with "segment_col".
+
+    :param segment_col: (str)
+                    column used to break the retention tables down by a user property
+
+    :param acquisition_event_name: (str)
+                    event name used when generating the cohort columns; needed with "segment_col"
+
+    :return: (DataFrame, DataFrame)
+    """
+    keys = ['cohort', 'event_period']
 
-    # filter out internal testers and get acquisition time of each user
-    # create an event_period column for each event
-    # determine if each event happened at least 1 day after the user acquisition
-    events = acquisition_events_cohort(events, period=period, month_fmt=month_fmt)
+    if segment_col:
+        assert acquisition_event_name, '"acquisition_event_name" should be given with "segment_col"'
+        segment = acquisition_segments(events, acquisition_event_name, segment_col)
+        events = events.assign(**{segment_col: events['distinct_id'].map(segment)})
+        # only the observed segments of a categorical "segment_col", as for any other dtype
+        sizes = events.drop_duplicates(subset=['distinct_id', 'cohort']) \
+            .groupby([segment_col, 'cohort'], observed=True).size()
+        keys = [segment_col] + keys
 
     # calculate size of each users cohort
-    cohort_sizes = events.drop_duplicates(subset=['distinct_id', 'cohort']).cohort.value_counts() \
-        .to_frame() \
-        .rename({'cohort': 'size'}, axis=1)
-    cohort_sizes.index.rename('cohort', inplace=True)
+    elif sizes is None:
+        sizes = cohort_sizes(events)
 
     # filter only for events after acquisition date
-    events = events[events['plan_user_active']]
+    events = events[events['user_active']]
     # filter for event of interest
     if event_filter:
         events = events[events['name'] == event_filter]
 
-    grouped = events.groupby(['cohort', 'event_period'])
+    # count the unique users per (Segment +) Group + Period
+    cohorts = events.groupby(keys, observed=True).agg({'distinct_id': pd.Series.nunique})
+
+    return retention_table_from_counts(cohorts, sizes, period=period, month_fmt=month_fmt)
+
+
+def retention_table_from_counts(cohorts, sizes, period='w', month_fmt='period'):
+    """
+    Function used to assemble the retention tables from the unique users per (cohort, event_period).
+
+    The counts are scattered into a (segment, cohort, cohort_period) array in one vectorised step,
+    so cohorts and periods without any activity are filled in without looping over every combination.
+
+    :param cohorts: (DataFrame)
+                    "distinct_id" column with the number of unique users, indexed by ("cohort", "event_period"),
+                    optionally with an extra outer segment level
+
+    :param sizes: (pd.Series)
+                    number of users acquired in each cohort, as returned by "stats.acquisition.cohort_sizes",
+                    indexed by "cohort" or by (segment, "cohort")
 
-    # count the unique users per Group + Period
-    cohorts = grouped.agg({'distinct_id': pd.Series.nunique})
-    # reindex the "cohort" (and "event_period" columns) to avoid empty weeks causing misalignment
-    # grab the minimum 'cohort' date and maximum 'event_period' date
-    start, end = cohorts.index.get_level_values('cohort').min(), \
-                 cohorts.index.get_level_values('event_period').max()
+    :param period: (str)
+                    period used when generating the cohorts
+
+    :param month_fmt: (str)
+                    month format used when generating the cohorts
+
+    :return: (DataFrame, DataFrame)
+                    user retention counts and percentages
+    """
+    counts = cohorts['distinct_id']
+    segmented = counts.index.nlevels == 3
+
+    # every period from the first cohort to the last event, so that empty periods do not cause misalignment
+    cohort_values = counts.index.get_level_values(-2)
+    period_values = counts.index.get_level_values(-1)
+    size_cohorts = sizes.index.get_level_values(-1)
+    start = min(cohort_values.min(), size_cohorts.min()) if len(counts) else size_cohorts.min()
+    end = max(period_values.max(), size_cohorts.max()) if len(counts) else size_cohorts.max()
 
     # TODO: if more periods will be considered need to add more here
     if period == 'w':
         full_index = pd.date_range(start=start, end=end, freq='W-MON', name='cohort')
-    elif period == 'm':
-        if month_fmt == 'period':
-            full_index = pd.date_range(start=start.to_timestamp(), end=end.to_timestamp(), freq='MS')
-        elif month_fmt == 'datetime':
-            full_index = pd.date_range(start=start, end=end, freq='MS')
-    cohorts.reset_index(inplace=True)
-
-    # create all possible combinations of possible date periods
-    # date_period needs to be equal to or greater than cohort
-    possible_dates = []
-    for i in range(len(full_index)):
-        for j in range(len(full_index)):
-            if i <= j:
-                possible_dates.append((i, j))
-
-    # fill in missing combinations of cohort and event_period
-    # add a new row in the df for a combination of possible dates with value=0
-    for combo in possible_dates:
-        if len(cohorts[(cohorts['cohort'] == full_index[combo[0]]) &
-                       (cohorts['event_period'] == full_index[combo[1]])]) < 1:
-            cohorts = cohorts.append({'cohort': full_index[combo[0]],
-                                      'event_period': full_index[combo[1]],
-                                      'distinct_id': 0},
-                                     ignore_index=True) \
-                .sort_values(['cohort', 'event_period'])
-    cohorts = cohorts.set_index(['cohort', 'event_period'])
-
-    # create 'cohort_period' column
-    cohorts = cohorts.astype(str).groupby(level=0).apply(cohort_period)
-
-    # reindex the DataFrame
-    cohorts.reset_index(inplace=True)
-    cohorts.set_index(['cohort', 'cohort_period'], inplace=True)
-
-    # create user_retention df
-    user_retention = cohorts['distinct_id'].unstack(0).T
+    elif month_fmt == 'period':
+        full_index = pd.period_range(start=start, end=end, freq='M', name='cohort')
+    else:
+        full_index = pd.date_range(start=start, end=end, freq='MS', name='cohort')
+    n_periods = len(full_index)
+
+    if segmented:
+        # plain sorted segments, so that a categorical "segment_col" gives the same tables as any other dtype
+        segments = pd.Index(counts.index.get_level_values(0).unique(), dtype=object) \
+            .union(pd.Index(sizes.index.get_level_values(0).unique(), dtype=object))
+        try:
+            segments = segments.sort_values()
+        except TypeError:
+            # e.g. numeric segments along with MISSING_SEGMENT
+            pass
+        count_segment = segments.get_indexer(counts.index.get_level_values(0))
+        size_segment = segments.get_indexer(sizes.index.get_level_values(0))
+    else:
+        segments = [None]
+        count_segment = np.zeros(len(counts), dtype=int)
+        size_segment = np.zeros(len(sizes), dtype=int)
+
+    # scatter the counts into a (segment, cohort, cohort_period) array
+    cohort_position = full_index.get_indexer(cohort_values)
+    offset = full_index.get_indexer(period_values) - cohort_position
+    # activity before the cohort would wrap around to the last columns
+    valid = offset >= 0
+    user_retention = np.zeros((len(segments), n_periods, n_periods))
+    user_retention[count_segment[valid], cohort_position[valid], offset[valid]] = counts.values[valid]
+
+    size = np.zeros((len(segments), n_periods), dtype=int)
+    size[size_segment, full_index.get_indexer(size_cohorts)] = sizes.values
+
+    # convert to percentages; empty cohorts have 0% retention
+    with np.errstate(divide='ignore', invalid='ignore'):
+        user_retention_pct = user_retention / size[:, :, None]
+    user_retention_pct[np.isnan(user_retention_pct)] = 0
+
+    # force NaN where a value is not possible to exist
+    mask_array = np.broadcast_to(mask_retention_table((n_periods, n_periods)), user_retention.shape)
+    user_retention[mask_array] = np.nan
+    user_retention_pct[mask_array] = np.nan
+
     # include the cohort size as a secondary index
-    user_retention = user_retention.join(cohort_sizes, how='outer', sort=False)
-    user_retention['size'].fillna(0, inplace=True)
-    user_retention['size'] = user_retention['size'].astype(int)
-    user_retention.set_index('size', append=True, inplace=True)
-    user_retention.columns.name = 'cohort_period'
-    # convert float to Int64
-    user_retention = user_retention[user_retention.columns].replace('NaN', np.NaN) \
-        .astype('float64')
-    # .astype('Int64')
-
-    # convert to percentages
-    user_retention_pct = user_retention.divide(user_retention.index.get_level_values('size'), axis='rows')
-
-    # fill NaNs with 0 where a value is possible to exist
-    mask_array = mask_retention_table(user_retention.shape)
-    user_retention = user_retention.fillna(0).mask(mask_array)
-    user_retention_pct = user_retention_pct.fillna(0).mask(mask_array)
-
-    return user_retention, user_retention_pct
\ No newline at end of file
+    if segmented:
+        index = pd.MultiIndex.from_arrays([segments.repeat(n_periods),
+                                           full_index[np.tile(np.arange(n_periods), len(segments))],
+                                           size.ravel()],
+                                          names=[counts.index.names[0], 'cohort', 'size'])
+    else:
+        index = pd.MultiIndex.from_arrays([full_index, size[0]], names=['cohort', 'size'])
+    columns = pd.RangeIndex(n_periods, name='cohort_period')
+
+    user_retention = pd.DataFrame(user_retention.reshape(-1, n_periods), index=index, columns=columns)
+    user_retention_pct = pd.DataFrame(user_retention_pct.reshape(-1, n_periods), index=index, columns=columns)
+
+    return user_retention, user_retention_pct
@@ -0,0 +1,355 @@
+"""
+    Pre-aggregated daily rollup cube used to answer "users_per_period" at any granularity without rescanning
+    the raw events.
+
+    New users are stored as exact counts per (acquisition_day, user_source), since every user is acquired once
+    and they can simply be summed into weeks/months. Active users are stored per
+    (activity_day, user_source, lag), where lag is the number of days since acquisition (capped at MAX_LAG).
+    Each cell holds the exact number of distinct users of that day and a HyperLogLog sketch, which is merged
+    across days to estimate the distinct active and returning users of a week or month.
+
+    Most cells only cover a handful of users, so the sketches are stored sparsely: one (cell, register, value)
+    row per non-zero register, which is never larger than the (cell, user) pairs of the activity. They are only
+    expanded to dense registers once merged per period.
+"""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from .acquisition import users_per_period_table, period_index
+
+# the longest period is a month, so any lag above 31 days always means the user returned
+MAX_LAG = 31
+# source used in the cells for users without one, so that they are still counted as active
+MISSING_SOURCE = 'Unknown'
+
+
+def _hash(values):
+    return pd.util.hash_array(np.asarray(values))
+
+
+def _bit_length(x):
+    """
+    Vectorised int.bit_length for uint64 arrays.
+    """
+    x = x.copy()
+    n = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = x >= np.uint64(1 << shift)
+        n[mask] += shift
+        x[mask] >>= np.uint64(shift)
+
+    return n + (x > 0)
+
+
+def hll_registers(ids, precision):
+    """
+    Function used to calculate the HyperLogLog register index and value of each id.
+
+    :param ids: (array)
+                    user ids
+
+    :param precision: (int)
+                    number of bits used for the register index; the sketch has 2 ** precision registers
+
+    :return: (np.array, np.array)
+                    register index and register value of each id
+    """
+    hashes = _hash(ids)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    # position of the leftmost 1-bit in the remaining bits
+    rho = (64 - precision) - _bit_length(rest) + 1
+
+    return index, rho.astype(np.uint8)
+
+
+def hll_estimate(registers):
+    """
+    Function used to estimate the number of distinct ids of each HyperLogLog sketch.
+
+    :param registers: (np.array)
+                    (n_sketches, 2 ** precision) array of registers
+
+    :return: (np.array)
+                    estimated distinct count of each sketch
+    """
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m ** 2 / np.power(2.0, -registers.astype(np.float64)).sum(axis=1)
+
+    # use linear counting for small cardinalities
+    zeros = (registers == 0).sum(axis=1)
+    small = (estimate <= 2.5 * m) & (zeros > 0)
+    estimate[small] = m * np.log(m / zeros[small])
+
+    return estimate
+
+
+def _merged_estimate(sketches, groups, n_groups, precision):
+    """
+    Merge the sparse sketches of the cells of each group (-1 to skip a cell) and estimate the distinct ids of
+    each group.
+    """
+    registers = np.zeros((n_groups, 2 ** precision), dtype=np.uint8)
+
+    group = groups[sketches['cell'].values]
+    selected = group >= 0
+    np.maximum.at(registers, (group[selected], sketches['register'].values[selected]),
+                  sketches['value'].values[selected])
+
+    # empty groups have all their registers at 0, which linear counting estimates as 0
+    return hll_estimate(registers)
+
+
+def _empty_sketches():
+    return DataFrame({'cell': pd.Series([], dtype=np.int32),
+                      'register': pd.Series([], dtype=np.uint16),
+                      'value': pd.Series([], dtype=np.uint8)})
+
+
+def _select_cells(cells, sketches, selected):
+    """
+    Keep the "selected" cells (boolean array) and renumber the cells of their sketches.
+    """
+    position = np.cumsum(selected) - 1
+    sketches = sketches[selected[sketches['cell'].values]]
+    sketches = sketches.assign(cell=position[sketches['cell'].values].astype(np.int32))
+
+    return cells[selected].reset_index(drop=True), sketches
+
+
+def _period_start(days, period):
+    """
+    Start day of the period each day (datetime64[D] array) belongs to; weeks start on Monday.
+    """
+    if period == 'd':
+        return days
+    elif period == 'w':
+        # 1970-01-01 was a Thursday
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+class AcquisitionCube(object):
+    """
+    Rollup cube of the acquisition metrics, refreshable day by day.
+
+    Example:
+        cube = AcquisitionCube('Install', user_source_col='user_source')
+        cube.refresh(events)                 # build from history
+        cube.refresh(todays_events)          # then refresh day by day
+        cube.users_per_period(period='w')
+
+    :param acquisition_event_name: (str)
+                        event name defining the user acquisition point
+
+    :param user_source_col: (str)
+                        name of column defining if user is an Organic/Non-organic acquisition
+
+    :param precision: (int)
+                        HyperLogLog precision; each sketch has 2 ** precision one-byte registers and the
+                        relative error of weekly/monthly active users is about 1.04 / sqrt(2 ** precision).
+                        On the dummy events of the notebook (1M events, 50k users), the mean/worst error of the
+                        weekly active users is 2.5%/8% at precision 10, 1.3%/4% at 12 and 0.5%/1.8% at 14.
+                        Sketches are stored sparsely at 7 bytes per non-zero register, i.e. at most 7 bytes per
+                        distinct (day, user) of activity whatever the precision, where dense sketches would
+                        take 2 ** precision bytes per cell (80MB for the 20k cells of the dummy events at 12)
+    """
+
+    def __init__(self, acquisition_event_name, user_source_col=None, precision=12):
+        assert isinstance(acquisition_event_name, str), '"acquisition_event_name" should be a string'
+        assert 4 <= precision <= 16, '"precision" should be between 4 and 16'
+
+        self.acquisition_event_name = acquisition_event_name
+        self.user_source_col = user_source_col
+        self.precision = precision
+
+        # acquisition time and source of each user, needed to place the activity of later days
+        self.users = DataFrame({'acquisition_time': pd.Series([], dtype='datetime64[ns]'),
+                                'user_source': pd.Series([], dtype=object)})
+        # one row per (activity_day, user_source, lag) cell and the non-zero registers of their sketches,
+        # with "cell" the row of the cell
+        self.cells = DataFrame({'activity_day': pd.Series([], dtype='datetime64[ns]'),
+                                'user_source': pd.Series([], dtype=object),
+                                'lag': pd.Series([], dtype=np.int64),
+                                'users': pd.Series([], dtype=np.int64)})
+        self.sketches = _empty_sketches()
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def new_users(self):
+        """
+        (pd.Series) exact number of new users per (acquisition_day, user_source)
+        """
+        return self.users.assign(acquisition_day=self.users['acquisition_time'].dt.floor('D')) \
+            .groupby(['acquisition_day', 'user_source']).size()
+
+    def refresh(self, events):
+        """
+        Function used to add (or replace) the cells of the days covered by "events".
+        Days should be refreshed in chronological order. Refreshing days again replaces all their cells and
+        acquisitions, including the ones that are no longer present in the new events; the cells of later days
+        are only updated if those days are refreshed as well.
+
+        :param events: (DataFrame)
+                        all the events of one or more whole, consecutive days; every day between the first
+                        and the last event is refreshed
+
+        :return: (AcquisitionCube)
+                        self, to allow chaining
+        """
+        if not isinstance(events, DataFrame):
+            raise TypeError('"events" should be a pandas dataframe')
+
+        if self.user_source_col:
+            assert hasattr(events, self.user_source_col), \
+                '"user_source_col" should be a column in the events dataframe'
+
+        if not len(events):
+            return self
+
+        # refreshed days: [first_day, end)
+        first_day = events['time'].min().floor('D')
+        end = events['time'].max().floor('D') + pd.Timedelta(days=1)
+
+        # forget the users acquired in these days, they are acquired again from the new events below
+        self.users = self.users[(self.users['acquisition_time'] < first_day) |
+                                (self.users['acquisition_time'] >= end)]
+
+        # update the acquisition time of the users acquired in these days, keeping the earliest one
+        acquired = events[events['name'] == self.acquisition_event_name] \
+            .sort_values('time', kind='mergesort') \
+            .drop_duplicates(subset='distinct_id', keep='first') \
+            .set_index('distinct_id')
+        acquired = DataFrame({'acquisition_time': acquired['time'],
+                              'user_source': acquired[self.user_source_col] if self.user_source_col else None})
+        acquired['user_source'] = acquired['user_source'].fillna(MISSING_SOURCE)
+        self.users = pd.concat([self.users, acquired]) \
+            .sort_values('acquisition_time', kind='mergesort')
+        self.users = self.users[~self.users.index.duplicated(keep='first')]
+
+        # activity of acquired users at or after their acquisition time, placed in its cell
+        active = events[['distinct_id', 'time']].join(self.users, on='distinct_id', how='inner')
+        active = active[active['time'] >= active['acquisition_time']]
+        activity_day = active['time'].dt.floor('D')
+        lag = (activity_day - active['acquisition_time'].dt.floor('D')).dt.days.clip(upper=MAX_LAG)
+        active = DataFrame({'activity_day': activity_day.values,
+                            'user_source': active['user_source'].values,
+                            'lag': lag.values,
+                            'distinct_id': active['distinct_id'].values}) \
+            .drop_duplicates()
+
+        grouped = active.groupby(['activity_day', 'user_source', 'lag'], sort=False)
+        cell_codes = grouped.ngroup().values
+        cells = grouped.size().rename('users').reset_index()
+
+        # highest register value of each (cell, register)
+        index, rho = hll_registers(active['distinct_id'].values, self.precision)
+        sketches = DataFrame({'cell': cell_codes.astype(np.int32), 'register': index.astype(np.uint16),
+                              'value': rho}) \
+            .groupby(['cell', 'register'], sort=False)['value'].max() \
+            .reset_index() \
+            .astype({'cell': np.int32, 'register': np.uint16})
+
+        # replace every cell of the refreshed days, not only the ones that still have activity
+        keep = ((self.cells['activity_day'] < first_day) | (self.cells['activity_day'] >= end)).values
+        kept_cells, kept_sketches = _select_cells(self.cells, self.sketches, keep)
+        self.cells = pd.concat([kept_cells, cells], ignore_index=True)
+        self.sketches = pd.concat([kept_sketches,
+                                   sketches.assign(cell=(sketches['cell'] + len(kept_cells)).astype(np.int32))],
+                                  ignore_index=True)
+
+        return self
+
+    def users_per_period(self, period='w', month_fmt='period', user_source=None):
+        """
+        Function used to generate the "stats.acquisition.users_per_period" table from the cube.
+        Daily active and returning users are exact; weekly and monthly ones are HyperLogLog estimates.
+
+        :param period: (str)
+                    'd' for daily, 'w' for weekly or 'm' for monthly
+
+        :param month_fmt: (str)
+                    'period' for %Y-%m and 'datetime' for datetime like
+
+        :param user_source: (str)
+                    only count users of this source; all users if None
+
+        :return: (DataFrame)
+        """
+        assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+        if not len(self.users):
+            raise ValueError('the cube is empty; call "refresh" with some events first')
+
+        users = self.users
+        cells, sketches = self.cells, self.sketches
+        if user_source is not None:
+            users = users[users['user_source'] == user_source]
+            cells, sketches = _select_cells(cells, sketches, (cells['user_source'] == user_source).values)
+
+        # new users are additive, so they are summed exactly into periods
+        acquisition_day = users['acquisition_time'].values.astype('datetime64[D]')
+        cohort = period_index(_period_start(acquisition_day, period), period, month_fmt)
+        sizes = pd.Series(1, index=cohort).groupby(level=0).sum().rename_axis('cohort')
+
+        source = None
+        if self.user_source_col:
+            source = pd.Series(1, index=pd.MultiIndex.from_arrays([cohort, users['user_source'].values],
+                                                                  names=['cohort', self.user_source_col])) \
+                .groupby(level=[0, 1]).sum()
+
+        activity_day = cells['activity_day'].values.astype('datetime64[D]')
+        start = _period_start(activity_day, period)
+        period_codes, periods = pd.factorize(start)
+        # a user returns if acquired before the start of the period, i.e. more days ago than the period started
+        returns = cells['lag'].values > (activity_day - start).astype(np.int64)
+
+        if period == 'd':
+            # distinct users of a day are additive across sources and lags, so daily counts are exact
+            active = np.bincount(period_codes, weights=cells['users'].values, minlength=len(periods))
+            returning = np.bincount(period_codes[returns], weights=cells['users'].values[returns],
+                                    minlength=len(periods))
+        else:
+            active = _merged_estimate(sketches, period_codes, len(periods), self.precision)
+            returning = _merged_estimate(sketches, np.where(returns, period_codes, -1), len(periods),
+                                         self.precision)
+
+        activity = DataFrame({'Active Users': np.round(active).astype(np.int64),
+                              'Returning Users': np.round(returning).astype(np.int64)},
+                             index=period_index(periods, period, month_fmt))
+
+        return users_per_period_table(sizes, activity, period=period, source=source)
+
+    def save(self, path):
+        """
+        Function used to persist the cube to disk.
+
+        :param path: (str)
+                    file path
+        """
+        pd.to_pickle({'acquisition_event_name': self.acquisition_event_name,
+                      'user_source_col': self.user_source_col,
+                      'precision': self.precision,
+                      'users': self.users,
+                      'cells': self.cells,
+                      'sketches': self.sketches}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Function used to load a cube persisted with "save".
+
+        :param path: (str)
+                    file path
+
+        :return: (AcquisitionCube)
+        """
+        state = pd.read_pickle(path)
+        cube = cls(state['acquisition_event_name'], user_source_col=state['user_source_col'],
+                   precision=state['precision'])
+        cube.users, cube.cells, cube.sketches = state['users'], state['cells'], state['sketches']
+
+        return cube
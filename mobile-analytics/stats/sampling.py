@@ -0,0 +1,230 @@
+"""
+    Deterministic user sampling used for fast previews of the metrics.
+
+    Users are kept when the hash of their "distinct_id" falls below the sampling rate, so every call (and every
+    metric) keeps the same users with their whole event history, and funnels, retention and journeys stay valid.
+    Each user is kept independently with probability "rate", so user counts of the sample are scaled back up
+    by 1 / rate and their binomial standard error is sqrt(n * (1 - rate)) / rate for n sampled users.
+
+    The stats functions and plots take the rate as their "sample" argument: the metrics are computed on the
+    sampled users, their user counts are scaled back up with "scale_counts" and their 95% confidence intervals
+    are returned as well, as "<col>_low"/"<col>_high" columns ("stats.retention.retention_intervals" gives the
+    ones of the retention percentages), which the plots draw as error bars or in the hover labels.
+"""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# hash key used for sampling; different from the default one of "pd.util.hash_array" so that sampled users are
+# independent of any other hash based structure (e.g. the HyperLogLog registers of "stats.rollup")
+SAMPLE_HASH_KEY = 'mobile-analytics'
+
+
+def check_rate(rate):
+    """
+    Function used to validate a sampling rate.
+
+    :param rate: (float)
+                    fraction of users to keep, in (0, 1]
+    """
+    if not isinstance(rate, (int, float)) or isinstance(rate, bool):
+        raise TypeError('"sample" should be a float')
+    if not 0 < rate <= 1:
+        raise ValueError('"sample" should be greater than 0 and at most 1')
+
+
+def sample_users(events, rate, col='distinct_id'):
+    """
+    Function used to keep the events of a deterministic sample of users.
+    Only the unique ids are hashed, as strings, so the same users are kept regardless of the id dtype.
+
+    :param events: (DataFrame)
+                    events dataframe
+
+    :param rate: (float)
+                    fraction of users to keep, in (0, 1]
+
+    :param col: (str)
+                    user id column
+
+    :return: (DataFrame)
+                    events of the sampled users
+    """
+    if not isinstance(events, DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+    check_rate(rate)
+
+    if rate == 1:
+        return events
+
+    codes, ids = pd.factorize(events[col])
+    hashes = pd.util.hash_array(np.asarray(ids).astype(str), hash_key=SAMPLE_HASH_KEY)
+
+    # compare the top 53 bits, which are exactly representable as a float
+    keep = (hashes >> np.uint64(11)).astype(np.float64) < rate * 2 ** 53
+    # ids with missing values (code -1) are never kept
+    keep = np.append(keep, False)
+
+    return events[keep[codes]]
+
+
+def scale_counts(df, rate, columns=None, index_levels=None):
+    """
+    Function used to scale user counts calculated on a sample back up to the whole population.
+
+    :param df: (DataFrame)
+                    metric calculated on the sampled events
+
+    :param rate: (float)
+                    sampling rate used
+
+    :param columns: (list)
+                    count columns to scale; all the numeric columns if None
+
+    :param index_levels: (list)
+                    names of index levels holding counts to scale as well (e.g. the cohort "size")
+
+    :return: (DataFrame)
+    """
+    if rate == 1:
+        return df
+
+    df = df.copy()
+    if columns is None:
+        columns = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+
+    for col in columns:
+        scaled = (df[col].astype(float) / rate).round()
+        df[col] = scaled.astype(df[col].dtype) if pd.api.types.is_integer_dtype(df[col]) else scaled
+
+    if index_levels:
+        index = df.index.to_frame(index=False)
+        for level in index_levels:
+            index[level] = np.round(index[level] / rate).astype(index[level].dtype)
+        df.index = pd.MultiIndex.from_frame(index)
+
+    return df
+
+
+def count_interval(counts, rate, confidence=0.95):
+    """
+    Function used to calculate the normal approximation confidence interval of user counts scaled up with
+    "scale_counts".
+
+    :param counts: (pd.Series/DataFrame/np.array)
+                    scaled user counts
+
+    :param rate: (float)
+                    sampling rate used
+
+    :param confidence: (float)
+                    confidence level of the interval
+
+    :return: (lower, upper)
+                    interval bounds with the same shape as "counts"; lower bounds are clipped at 0
+    """
+    from scipy.stats import norm
+
+    check_rate(rate)
+    z = norm.ppf(0.5 + confidence / 2)
+
+    counts = counts.astype(float)
+    margin = z * np.sqrt(counts * (1 - rate) / rate)
+
+    return np.maximum(counts - margin, 0), counts + margin
+
+
+def proportion_interval(successes, totals, rate, confidence=0.95):
+    """
+    Function used to calculate the Wilson confidence interval of proportions (e.g. conversion or retention)
+    calculated from counts scaled up with "scale_counts".
+
+    :param successes: (pd.Series/DataFrame/np.array)
+                    scaled number of users that converted/retained
+
+    :param totals: (pd.Series/DataFrame/np.array)
+                    scaled number of users that could convert/retain
+
+    :param rate: (float)
+                    sampling rate used
+
+    :param confidence: (float)
+                    confidence level of the interval
+
+    :return: (lower, upper)
+                    interval bounds with the same shape as "successes"; the exact proportion if "rate" is 1
+    """
+    from scipy.stats import norm
+
+    check_rate(rate)
+    z = norm.ppf(0.5 + confidence / 2)
+
+    # the interval depends on the number of users actually sampled, with the finite population correction used
+    # by "count_interval" so that it narrows to the exact proportion as the rate goes to 1
+    with np.errstate(divide='ignore'):
+        n = totals * rate / (1 - rate)
+    p = successes / totals
+    centre = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    margin = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+
+    return centre - margin, centre + margin
+
+
+def add_count_intervals(df, rate, columns, confidence=0.95):
+    """
+    Function used to add the confidence interval of user counts scaled up with "scale_counts",
+    as "<col>_low" and "<col>_high" columns after the existing ones.
+
+    :param df: (DataFrame)
+                    metric with scaled user counts
+
+    :param rate: (float)
+                    sampling rate used
+
+    :param columns: (list)
+                    count columns to add the interval of
+
+    :param confidence: (float)
+                    confidence level of the interval
+
+    :return: (DataFrame)
+    """
+    df = df.copy()
+    for col in list(columns):
+        low, high = count_interval(df[col], rate, confidence=confidence)
+        df[col + '_low'], df[col + '_high'] = low, high
+
+    return df
+
+
+def table_proportion_intervals(counts, rate, confidence=0.95, totals_level='size'):
+    """
+    Function used to calculate the confidence interval of every cell of a table of proportions, from the table of
+    scaled user counts and the scaled totals held in one of its index levels (e.g. retention tables).
+
+    :param counts: (DataFrame)
+                    scaled user counts
+
+    :param rate: (float)
+                    sampling rate used
+
+    :param confidence: (float)
+                    confidence level of the interval
+
+    :param totals_level: (str)
+                    index level holding the scaled number of users of each row
+
+    :return: (DataFrame, DataFrame)
+                    lower and upper bounds, shaped as "counts"
+    """
+    totals = counts.index.get_level_values(totals_level).values.astype(float)[:, None]
+
+    values = counts.values.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low, high = proportion_interval(values, np.where(totals > 0, totals, np.nan), rate, confidence=confidence)
+
+    # empty rows keep their 0 proportions (and masked cells), as in the percentages table
+    low, high = np.where(totals > 0, low, values), np.where(totals > 0, high, values)
+
+    return DataFrame(low, index=counts.index, columns=counts.columns), \
+        DataFrame(high, index=counts.index, columns=counts.columns)
@@ -0,0 +1,507 @@
+"""
+    Out-of-core backend running the stats functions as SQL against a local embedded database file.
+
+    SQLite is used by default since it ships with python; DuckDB is used instead when a duckdb connection is
+    passed in (duckdb is an optional dependency and only imported by "connect(..., engine='duckdb')").
+    Only the aggregated counts are brought back into pandas, where they are assembled by the same helpers
+    the pandas path uses, so both return identical dataframes.
+"""
+import os
+import sqlite3
+import time as timer
+import pandas as pd
+from pandas import DataFrame
+from .acquisition import users_per_period_table, period_index
+from .retention import retention_table_from_counts
+from .user_journey import journey_counts, sankey_from_journey
+
+# fixed width text format so that times stored in sqlite sort and compare correctly as strings
+TIME_FMT = '%Y-%m-%d %H:%M:%S.%f'
+
+# period truncation expressions per engine; weeks start on Monday, as in "acquisition_events_cohort"
+PERIOD_SQL = {
+    'sqlite': {'d': "date({col})",
+               'w': "date({col}, 'weekday 0', '-6 days')",
+               'm': "strftime('%Y-%m-01', {col})"},
+    'duckdb': {'d': "CAST({col} AS DATE)",
+               'w': "CAST(date_trunc('week', {col}) AS DATE)",
+               'm': "CAST(date_trunc('month', {col}) AS DATE)"},
+}
+
+
+def connect(path=':memory:', engine='sqlite'):
+    """
+    Function used to open (or create) the embedded database file.
+
+    :param path: (str)
+                    path of the database file; use ':memory:' for a temporary in-memory database
+
+    :param engine: (str)
+                    either "sqlite" or "duckdb"
+
+    :return: database connection
+    """
+    assert engine in ['sqlite', 'duckdb'], '"engine" should be either "sqlite" or "duckdb"'
+
+    if engine == 'sqlite':
+        return sqlite3.connect(path)
+
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError('"duckdb" should be installed to use the duckdb engine: pip install duckdb')
+
+    return duckdb.connect(path)
+
+
+def _engine(con):
+    return 'sqlite' if isinstance(con, sqlite3.Connection) else 'duckdb'
+
+
+def _query(con, sql, params=()):
+    """
+    Run a query and return the result as a dataframe, for both sqlite and duckdb connections.
+    """
+    cursor = con.execute(sql, list(params))
+    columns = [description[0] for description in cursor.description]
+
+    return DataFrame(cursor.fetchall(), columns=columns)
+
+
+def _to_time_param(con, value):
+    value = pd.Timestamp(value)
+    return value.strftime(TIME_FMT) if _engine(con) == 'sqlite' else value.to_pydatetime()
+
+
+def _epoch_us_sql(col):
+    """
+    Exact sqlite integer microseconds since the epoch of a time stored with "TIME_FMT".
+    """
+    return "(CAST(strftime('%s', {0}) AS INTEGER) * 1000000 + CAST(substr({0}, 21, 6) AS INTEGER))".format(col)
+
+
+def load_events(con, events, table='events', columns=None):
+    """
+    Function used to append events to a table of the embedded database.
+    Can be called repeatedly (or with an iterable of chunks) so that the events never have to fit in memory.
+
+    :param con: database connection as returned by "connect"
+
+    :param events: (DataFrame/iterable)
+                    events dataframe or an iterable of dataframe chunks, e.g. pd.read_csv(..., chunksize=n)
+
+    :param table: (str)
+                    name of the events table
+
+    :param columns: (list)
+                    columns to be stored; all columns if None
+
+    :return: (int)
+                    number of rows loaded
+    """
+    chunks = [events] if isinstance(events, DataFrame) else events
+    engine = _engine(con)
+
+    n_rows = 0
+    for chunk in chunks:
+        if columns:
+            chunk = chunk[columns]
+
+        if engine == 'sqlite':
+            chunk = chunk.assign(time=chunk['time'].dt.strftime(TIME_FMT))
+            chunk.to_sql(table, con, if_exists='append', index=False)
+        else:
+            con.register('events_chunk', chunk)
+            con.execute('CREATE TABLE IF NOT EXISTS "{0}" AS SELECT * FROM events_chunk LIMIT 0'.format(table))
+            con.execute('INSERT INTO "{0}" SELECT * FROM events_chunk'.format(table))
+            con.unregister('events_chunk')
+
+        n_rows += len(chunk)
+
+    if engine == 'sqlite':
+        # indexes used by the per-user window functions and the event name filters
+        con.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_user_time" ON "{0}" (distinct_id, time)'.format(table))
+        con.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_name" ON "{0}" (name)'.format(table))
+        con.commit()
+
+    return n_rows
+
+
+def _cohort_sql(con, table, period, user_source_col=None):
+    """
+    Common table expressions adding the acquisition time, "cohort" and "event_period" to every event of an
+    acquired user, mirroring "acquisition_events_cohort".
+    """
+    trunc = PERIOD_SQL[_engine(con)][period]
+    source = ', e."{0}" AS user_source'.format(user_source_col) if user_source_col else ''
+
+    return '''
+        WITH acq AS (
+            SELECT distinct_id, MIN(time) AS acquisition_time
+            FROM "{table}"
+            WHERE name = ?
+            GROUP BY distinct_id
+        ), ev AS (
+            SELECT e.distinct_id, e.name, e.time{source},
+                   a.acquisition_time,
+                   {cohort} AS cohort,
+                   {event_period} AS event_period
+            FROM "{table}" e
+            JOIN acq a ON e.distinct_id = a.distinct_id
+        )
+    '''.format(table=table, source=source,
+               cohort=trunc.format(col='a.acquisition_time'),
+               event_period=trunc.format(col='e.time'))
+
+
+def _cohort_sizes_sql(con, table, acquisition_event_name, period, month_fmt):
+    trunc = PERIOD_SQL[_engine(con)][period]
+    sizes = _query(con, '''
+        SELECT {cohort} AS cohort, COUNT(*) AS size
+        FROM (SELECT distinct_id, MIN(time) AS acquisition_time FROM "{table}" WHERE name = ? GROUP BY distinct_id) a
+        GROUP BY 1
+    '''.format(table=table, cohort=trunc.format(col='acquisition_time')), [acquisition_event_name])
+
+    if sizes.empty:
+        raise ValueError('"acquisition_event_name" should be a valid event present in the events table')
+
+    return pd.Series(sizes['size'].values, index=period_index(sizes['cohort'], period, month_fmt), name='size') \
+        .rename_axis('cohort')
+
+
+def users_per_period_sql(con, acquisition_event_name, user_source_col, period='w', month_fmt='period',
+                         table='events'):
+    """
+    SQL version of "stats.acquisition.users_per_period".
+
+    :param con: database connection as returned by "connect"
+
+    :param acquisition_event_name: (str)
+                        event name defining the user acquisition point
+
+    :param user_source_col: (str)
+                        name of column defining if user is an Organic/Non-organic acquisition
+
+    :param period: (str)
+                        str denoting period for cohort breakdown.
+                        Use 'd' for daily, 'w' for weekly or 'm' for monthly
+
+    :param month_fmt: (str)
+                        str denoting format for monthly date.
+                        Use 'period' for %Y-%m and 'datetime' for datetime like.
+
+    :param table: (str)
+                        name of the events table
+
+    :return: (DataFrame)
+    """
+    assert period in ['d', 'w', 'm'], '"period" should be either "d", "w" or "m"'
+
+    sizes = _cohort_sizes_sql(con, table, acquisition_event_name, period, month_fmt)
+    cohort_sql = _cohort_sql(con, table, period, user_source_col)
+
+    # active and returning users in a single scan; returning events are a subset of the active ones
+    activity = _query(con, cohort_sql + '''
+        SELECT event_period,
+               COUNT(DISTINCT distinct_id) AS active,
+               COUNT(DISTINCT CASE WHEN event_period > cohort THEN distinct_id END) AS returned
+        FROM ev
+        WHERE time >= acquisition_time
+        GROUP BY 1
+    ''', [acquisition_event_name])
+    activity = DataFrame({'Active Users': activity['active'].values,
+                          'Returning Users': activity['returned'].values},
+                         index=period_index(activity['event_period'], period, month_fmt))
+
+    source = None
+    if user_source_col:
+        source = _query(con, cohort_sql + '''
+            SELECT cohort, user_source, COUNT(DISTINCT distinct_id) AS n
+            FROM ev
+            WHERE name = ?
+            GROUP BY 1, 2
+        ''', [acquisition_event_name, acquisition_event_name])
+        source = pd.Series(source['n'].values,
+                           index=pd.MultiIndex.from_arrays([period_index(source['cohort'], period, month_fmt),
+                                                            source['user_source']],
+                                                           names=['cohort', user_source_col]))
+
+    return users_per_period_table(sizes, activity, period=period, source=source)
+
+
+def retention_table_sql(con, acquisition_event_name, period='w', month_fmt='period', event_filter=None,
+                        table='events'):
+    """
+    SQL version of "stats.retention.retention_table".
+
+    :param con: database connection as returned by "connect"
+
+    :param acquisition_event_name: (str)
+                    event name defining the user acquisition point
+
+    :param period: (str)
+                    str denoting period for cohort breakdown. use 'w' for weekly and 'm' for monthly
+
+    :param month_fmt: (str)
+                    str denoting format for monthly date. Use 'period' for %Y-%m and 'datetime' for datetime like.
+
+    :param event_filter: (str)
+                    event to filter for
+
+    :param table: (str)
+                    name of the events table
+
+    :return: (DataFrame, DataFrame)
+    """
+    assert period in ['w', 'm'], '"period" should be either "w" or "m"'
+
+    sizes = _cohort_sizes_sql(con, table, acquisition_event_name, period, month_fmt)
+
+    params = [acquisition_event_name]
+    name_filter = ''
+    if event_filter:
+        name_filter = 'AND name = ?'
+        params.append(event_filter)
+
+    counts = _query(con, _cohort_sql(con, table, period) + '''
+        SELECT cohort, event_period, COUNT(DISTINCT distinct_id) AS distinct_id
+        FROM ev
+        WHERE time >= acquisition_time {name_filter}
+        GROUP BY 1, 2
+    '''.format(name_filter=name_filter), params)
+
+    if event_filter:
+        assert len(counts) > 0, '"event_filter" should be a valid event present in "events"'
+
+    counts.index = pd.MultiIndex.from_arrays([period_index(counts['cohort'], period, month_fmt),
+                                              period_index(counts['event_period'], period, month_fmt)],
+                                             names=['cohort', 'event_period'])
+    counts = counts[['distinct_id']]
+
+    return retention_table_from_counts(counts, sizes, period=period, month_fmt=month_fmt)
+
+
+def create_funnel_df_sql(con, steps, from_date=None, to_date=None, step_interval=0, table='events'):
+    """
+    SQL version of "stats.funnel.create_funnel_df". All steps run as a single chained query.
+
+    :param con: database connection as returned by "connect"
+
+    :param steps: (list)
+                    list containing funnel steps as strings
+
+    :param from_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param to_date: (str)
+                    date with format "yyyy-mm-dd"
+
+    :param step_interval: (pd.Timedelta)
+                    minimum time between two consecutive steps
+
+    :param table: (str)
+                    name of the events table
+
+    :return: (pd.DataFrame)
+                df with 'step' and 'val' columns
+    """
+    assert isinstance(steps, list), '"steps" should be a list of strings'
+
+    step_interval = pd.Timedelta(step_interval)
+    engine = _engine(con)
+
+    # the 1st step is the first time each user did it, filtered by dates afterwards
+    # so that subsequent steps are allowed to occur at a later date
+    having, first_params = [], []
+    if from_date:
+        having.append('MIN(time) >= ?')
+        first_params.append(_to_time_param(con, from_date))
+    if to_date:
+        having.append('MIN(time) <= ?')
+        first_params.append(_to_time_param(con, to_date))
+
+    ctes = ['''step_0 AS (
+            SELECT distinct_id, MIN(time) AS time
+            FROM "{table}"
+            WHERE name = ?
+            GROUP BY distinct_id
+            {having}
+        )'''.format(table=table, having='HAVING ' + ' AND '.join(having) if having else '')]
+    params = [steps[0]] + first_params
+
+    # each following step is the first matching event at least "step_interval" after the previous step,
+    # compared in whole microseconds (the resolution of both engines) so that events exactly on the boundary
+    # are kept; intervals with a fraction of a microsecond are rounded up
+    interval_us = -(-step_interval.value // 1000)
+    if step_interval == pd.Timedelta(0):
+        after = 'e.time >= p.time'
+    elif engine == 'sqlite':
+        after = '{0} - {1} >= {2:d}'.format(_epoch_us_sql('e.time'), _epoch_us_sql('p.time'), interval_us)
+    else:
+        after = 'e.time >= p.time + to_microseconds({0:d})'.format(interval_us)
+
+    for i, step in enumerate(steps[1:], start=1):
+        ctes.append('''step_{i} AS (
+            SELECT p.distinct_id, MIN(e.time) AS time
+            FROM step_{prev} p
+            JOIN "{table}" e ON e.distinct_id = p.distinct_id AND e.name = ? AND {after}
+            GROUP BY p.distinct_id
+        )'''.format(i=i, prev=i - 1, table=table, after=after))
+        params.append(step)
+
+    counts = _query(con, 'WITH ' + ', '.join(ctes) + ' SELECT ' +
+                    ', '.join('(SELECT COUNT(*) FROM step_{0}) AS step_{0}'.format(i) for i in range(len(steps))),
+                    params)
+
+    return DataFrame({'step': steps, 'val': counts.iloc[0].astype(int).values})
+
+
+def user_journey_sql(con, starting_step, n_steps=3, events_per_step=5, table='events'):
+    """
+    SQL version of "stats.user_journey.user_journey".
+    The events of each user are numbered with a window function and the journeys are pivoted in the database,
+    so only one row per user is brought back. Events with the same time are ordered by load order,
+    matching the stable sort of the pandas path.
+
+    :param con: database connection as returned by "connect"
+
+    :param starting_step: (str)
+                    the event which should be considered as the starting point of the user journey.
+
+    :param n_steps: (int)
+                    number of events to return
+
+    :param events_per_step: (int)
+                    number of events to show per step.
+                    The rest (less frequent) events will be grouped together into an "Other" block.
+
+    :param table: (str)
+                    name of the events table
+
+    :return: (DataFrame)
+    """
+    assert isinstance(events_per_step, int), '"events_per_step" should be an integer'
+    if events_per_step < 1:
+        raise ValueError('"events_per_step" should be equal or greater than 1')
+
+    flow = _query(con, '''
+        WITH numbered AS (
+            SELECT distinct_id, name, ROW_NUMBER() OVER (PARTITION BY distinct_id ORDER BY time, rowid) AS rn
+            FROM "{table}"
+        ), start AS (
+            SELECT distinct_id, MIN(rn) AS rn
+            FROM numbered
+            WHERE name = ?
+            GROUP BY distinct_id
+        )
+        SELECT n.distinct_id, {steps}
+        FROM numbered n
+        JOIN start s ON n.distinct_id = s.distinct_id AND n.rn >= s.rn AND n.rn < s.rn + ?
+        GROUP BY n.distinct_id
+    '''.format(table=table,
+               steps=', '.join('MAX(CASE WHEN n.rn - s.rn = {0} THEN n.name END) AS step_{0}'.format(i)
+                               for i in range(n_steps))),
+        [starting_step, n_steps])
+
+    flow = flow.set_index('distinct_id')
+    flow.columns = list(range(n_steps))
+
+    return journey_counts(flow, n_steps=n_steps, events_per_step=events_per_step)
+
+
+def sankey_df_sql(con, starting_step, n_steps=3, events_per_step=5, table='events'):
+    """
+    SQL version of "stats.user_journey.sankey_df".
+
+    :return: (list, list, DataFrame)
+    """
+    flow = user_journey_sql(con, starting_step, n_steps, events_per_step, table=table)
+
+    return sankey_from_journey(flow)
+
+
+def benchmark(events, acquisition_event_name, user_source_col, steps, starting_step, period='w',
+              engines=('sqlite', 'duckdb'), directory=None, repeat=3):
+    """
+    Function used to compare the run time of the pandas path and of the SQL backend on the same events.
+
+    :param events: (DataFrame)
+                    events dataframe; it is loaded once into a database per engine, outside of the metric timings
+
+    :param acquisition_event_name: (str)
+                    event name defining the user acquisition point
+
+    :param user_source_col: (str)
+                    name of column defining if user is an Organic/Non-organic acquisition
+
+    :param steps: (list)
+                    funnel steps
+
+    :param starting_step: (str)
+                    starting step of the user journeys
+
+    :param period: (str)
+                    period used for "users_per_period" and "retention_table"
+
+    :param engines: (tuple)
+                    engines to compare with pandas, "sqlite" and/or "duckdb"
+
+    :param directory: (str)
+                    directory where the database files are written ("events.<engine>"), replacing the events
+                    of any previous run; in memory if None
+
+    :param repeat: (int)
+                    number of runs per metric and backend; the best time is kept
+
+    :return: (DataFrame)
+                    best time in seconds per metric (rows) and backend (columns), with the time taken to load the
+                    events into each database in the "load_events" row
+    """
+    from .acquisition import users_per_period
+    from .retention import retention_table
+    from .funnel import create_funnel_df
+    from .user_journey import user_journey
+
+    timings = {}
+    runners = {'pandas': {
+        'users_per_period': lambda: users_per_period(events, acquisition_event_name, user_source_col, period=period),
+        'retention_table': lambda: retention_table(events, acquisition_event_name, period=period),
+        'create_funnel_df': lambda: create_funnel_df(events, steps),
+        'user_journey': lambda: user_journey(events, starting_step)}}
+
+    columns = [col for col in ['distinct_id', 'name', 'time', user_source_col] if col]
+
+    connections = []
+    for engine in engines:
+        path = os.path.join(directory, 'events.{}'.format(engine)) if directory else ':memory:'
+        con = connect(path, engine=engine)
+        connections.append(con)
+
+        # "load_events" appends, so the events of a previous run in the same file are dropped first
+        con.execute('DROP TABLE IF EXISTS "events"')
+
+        start = timer.perf_counter()
+        load_events(con, events, columns=columns)
+        timings[('load_events', engine)] = timer.perf_counter() - start
+
+        runners[engine] = {
+            'users_per_period': lambda con=con: users_per_period_sql(con, acquisition_event_name, user_source_col,
+                                                                     period=period),
+            'retention_table': lambda con=con: retention_table_sql(con, acquisition_event_name, period=period),
+            'create_funnel_df': lambda con=con: create_funnel_df_sql(con, steps),
+            'user_journey': lambda con=con: user_journey_sql(con, starting_step)}
+
+    for backend, metrics in runners.items():
+        for metric, function in metrics.items():
+            best = None
+            for _ in range(repeat):
+                start = timer.perf_counter()
+                function()
+                elapsed = timer.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[(metric, backend)] = best
+
+    for con in connections:
+        con.close()
+
+    return pd.Series(timings).unstack()[['pandas'] + list(engines)]
@@ -1,4 +1,5 @@
 import pandas as pd
+from .sampling import sample_users, scale_counts, add_count_intervals
 
 
 def filter_starting_step(x, starting_step, n_steps):
@@ -26,7 +27,8 @@ def filter_starting_step(x, starting_step, n_steps):
     return x[starting_step_index: starting_step_index + n_steps]
 
 
-def user_journey(events, starting_step, n_steps=3, events_per_step=5):
+def user_journey(events, starting_step, n_steps=3, events_per_step=5, presorted=False, backend='pandas',
+                 sample=None):
     """
     Function used to map out the journey for each user starting from the defined "starting_step" and count
     how many identical journeys exist across users.
@@ -44,8 +46,25 @@ def user_journey(events, starting_step, n_steps=3, events_per_step=5):
                     number of events to show per step.
                     The rest (less frequent) events will be grouped together into an "Other" block.
 
+    :param presorted: (bool)
+                    True if events are already sorted by ("distinct_id", "time")
+
+    :param backend: (str)
+                    "pandas" or "polars" (see "stats.polars_backend" for the inputs accepted by "polars")
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
     :return: (DataFrame)
+                    one column per step and the 'count' of each journey, plus 'count_low' and 'count_high' with its
+                    confidence interval if "sample" is set
     """
+    assert backend in ['pandas', 'polars'], '"backend" should be either "pandas" or "polars"'
+    if backend == 'polars':
+        assert sample is None, '"sample" is only supported by the pandas backend'
+        from . import polars_backend
+        return polars_backend.user_journey(events, starting_step, n_steps=n_steps, events_per_step=events_per_step)
+
     if not isinstance(events, pd.DataFrame):
         raise TypeError('"events" should be a dataframe')
 
@@ -53,8 +72,12 @@ def user_journey(events, starting_step, n_steps=3, events_per_step=5):
     if events_per_step < 1:
         raise ValueError('"events_per_step" should be equal or greater than 1')
 
+    if sample is not None:
+        events = sample_users(events, sample)
+
     # sort events by time
-    events = events.sort_values(['distinct_id', 'time'])
+    if not presorted:
+        events = events.sort_values(['distinct_id', 'time'], kind='mergesort')
     # find the users that have performed the starting_step
     valid_ids = events[events['name'] == starting_step]['distinct_id'].unique()
 
@@ -67,6 +90,30 @@ def user_journey(events, starting_step, n_steps=3, events_per_step=5):
         .to_frame() \
         ['name'].apply(pd.Series)
 
+    flow = journey_counts(flow, n_steps=n_steps, events_per_step=events_per_step)
+
+    if sample is not None:
+        flow = add_count_intervals(scale_counts(flow, sample, columns=['count']), sample, columns=['count'])
+
+    return flow
+
+
+def journey_counts(flow, n_steps=3, events_per_step=5):
+    """
+    Function used to count identical journeys from the per-user journey table.
+
+    :param flow: (DataFrame)
+                    one row per user with the name of the i-th event of the journey in column i (NaN if none)
+
+    :param n_steps: (int)
+                    number of events in each journey
+
+    :param events_per_step: (int)
+                    number of events to show per step.
+                    The rest (less frequent) events will be grouped together into an "Other" block.
+
+    :return: (DataFrame)
+    """
     # fill NaNs with "End" to denote no further step by user; this will be filtered out later
     flow = flow.fillna('End')
 
@@ -93,7 +140,7 @@ def user_journey(events, starting_step, n_steps=3, events_per_step=5):
     return flow
 
 
-def sankey_df(events, starting_step, n_steps=3, events_per_step=5):
+def sankey_df(events, starting_step, n_steps=3, events_per_step=5, presorted=False, sample=None):
     """
     Function used to generate the dataframe needed to be passed to the sankey generation function.
     "source" and "target" column pairs denote links that will be shown in the sankey diagram.
@@ -111,14 +158,42 @@ def sankey_df(events, starting_step, n_steps=3, events_per_step=5):
                     number of events to show per step.
                     The rest (less frequent) events will be grouped together into an "Other" block.
 
-    :return: (DataFrame)
+    :param presorted: (bool)
+                    True if events are already sorted by ("distinct_id", "time")
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
+    :return: (list, list, DataFrame)
+                    node labels, node colours and source-target pairs, with 'count_low' and 'count_high' columns
+                    holding the confidence interval of each link if "sample" is set
     """
     # generate the user user flow dataframe
-    flow = user_journey(events, starting_step, n_steps, events_per_step)
+    flow = user_journey(events, starting_step, n_steps, events_per_step, presorted=presorted, sample=sample)
+
+    label_list, colors_list, source_target_df = sankey_from_journey(flow)
+
+    # the links add up several journeys, so their intervals are calculated from the summed counts
+    if sample is not None:
+        source_target_df = add_count_intervals(source_target_df, sample, columns=['count'])
+
+    return label_list, colors_list, source_target_df
+
+
+def sankey_from_journey(flow):
+    """
+    Function used to transform the output of "user_journey" into the sankey diagram inputs.
+
+    :param flow: (DataFrame)
+                    journey counts as returned by "user_journey"; the confidence interval columns are ignored
+
+    :return: (list, list, DataFrame)
+                    node labels, node colours and source-target pairs
+    """
 
     # create the nodes labels list
     label_list = []
-    cat_cols = flow.columns[:-1].values.tolist()
+    cat_cols = flow.columns.drop(['count', 'count_low', 'count_high'], errors='ignore').values.tolist()
     for cat_col in cat_cols:
         label_list_temp = list(set(flow[cat_col].values))
         label_list = label_list + label_list_temp
@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# the stats and visualisations packages are imported from the mobile-analytics directory, as in the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_events(n=20000, n_users=1000, seed=0):
+    """
+    Dummy events generated as in "user_acquisition.ipynb", with a fixed seed.
+    """
+    rng = np.random.RandomState(seed)
+    name_list = ['Install', 'SignUp', 'Click Product', 'Purchase', 'Change Adress', 'Cancel Order',
+                 'Accept Conditions']
+    date_list = pd.date_range(start='2018-01-01', end='2019-01-01', freq='H')
+
+    events = pd.DataFrame({'distinct_id': rng.randint(1, n_users + 1, n),
+                           'name': rng.choice(name_list, n),
+                           'time': date_list[rng.randint(0, len(date_list), n)]})
+    user_source = pd.Series(rng.choice(['Organic', 'Non-organic'], n_users), index=np.arange(1, n_users + 1))
+    events['user_source'] = events['distinct_id'].map(user_source)
+
+    return events
+
+
+@pytest.fixture(scope='session')
+def events():
+    return make_events()
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+from stats.analysis import Analysis
+from stats.acquisition import users_per_period
+from stats.retention import retention_table
+from stats.funnel import create_funnel_df, funnel_trend_df
+from stats.user_journey import user_journey, sankey_df
+
+STEPS = ['Install', 'SignUp', 'Purchase']
+
+
+def _assert_equal(result, expected):
+    if isinstance(expected, tuple):
+        assert len(result) == len(expected)
+        for r, e in zip(result, expected):
+            _assert_equal(r, e)
+    elif isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(result, expected)
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize('presorted', [False, True])
+def test_run_matches_standalone_functions(events, presorted):
+    if presorted:
+        events = events.sort_values(['distinct_id', 'time'], kind='mergesort')
+
+    analysis = Analysis(events, presorted=presorted)
+    requests = [
+        (analysis.users_per_period('Install', 'user_source', period='w'),
+         users_per_period(events, 'Install', 'user_source', period='w')),
+        (analysis.users_per_period('Install', 'user_source', period='m', numeric=True),
+         users_per_period(events, 'Install', 'user_source', period='m', numeric=True)),
+        (analysis.users_per_period('SignUp', None, period='d'),
+         users_per_period(events, 'SignUp', None, period='d')),
+        (analysis.retention_table('Install', period='w'),
+         retention_table(events, 'Install', period='w')),
+        (analysis.retention_table('Install', period='m', month_fmt='datetime'),
+         retention_table(events, 'Install', period='m', month_fmt='datetime')),
+        (analysis.retention_table('Install', period='m', event_filter='Purchase'),
+         retention_table(events, 'Install', period='m', event_filter='Purchase')),
+        (analysis.retention_table('Install', period='m', segment_col='user_source'),
+         retention_table(events, 'Install', period='m', segment_col='user_source')),
+        (analysis.create_funnel_df(STEPS, step_interval=pd.Timedelta('1h')),
+         create_funnel_df(events, STEPS, step_interval=pd.Timedelta('1h'))),
+        (analysis.funnel_trend_df(STEPS, period='w', from_date='2018-03-01'),
+         funnel_trend_df(events, STEPS, period='w', from_date='2018-03-01')),
+        (analysis.user_journey('Install', n_steps=3),
+         user_journey(events, 'Install', n_steps=3)),
+        (analysis.sankey_df('Install', n_steps=3),
+         sankey_df(events, 'Install', n_steps=3)),
+    ]
+
+    results = analysis.run()
+
+    assert len(results) == len(requests)
+    for position, expected in requests:
+        _assert_equal(results[position], expected)
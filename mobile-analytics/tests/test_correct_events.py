@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from stats.correct_events import correct_events, dedup_events
+from conftest import make_events
+
+
+def _dedup_reference(events, tolerance):
+    """
+    Event by event version of "dedup_events".
+    """
+    keep = []
+    last_kept = {}
+    for i, row in events.sort_values(['distinct_id', 'time'], kind='mergesort').iterrows():
+        key = (row['distinct_id'], row['name'])
+        if key not in last_kept or row['time'] - last_kept[key] > tolerance:
+            last_kept[key] = row['time']
+            keep.append(i)
+
+    return keep
+
+
+def test_dedup_chain_is_anchored_on_kept_event():
+    start = pd.Timestamp('2019-01-01')
+    events = pd.DataFrame({'distinct_id': 1, 'name': 'Purchase',
+                           'time': [start + pd.Timedelta(seconds=0.9 * i) for i in range(5)]})
+
+    deduped = dedup_events(events, tolerance=pd.Timedelta(seconds=1))
+
+    assert deduped.index.tolist() == [0, 2, 4]
+
+
+def test_dedup_matches_reference():
+    events = make_events(n=3000, n_users=20, seed=1)
+    # resends a fraction of a second to a few seconds after the original events
+    resent = events.sample(1500, random_state=1)
+    resent['time'] += pd.to_timedelta(np.random.RandomState(1).randint(0, 3000, len(resent)), unit='ms')
+    events = pd.concat([events, resent], ignore_index=True)
+
+    tolerance = pd.Timedelta(seconds=1)
+    deduped = dedup_events(events, tolerance=tolerance)
+
+    assert sorted(deduped.index) == sorted(_dedup_reference(events, tolerance))
+
+
+def test_chunked_input_matches_single_frame():
+    events = make_events(n=5000, n_users=100, seed=2)
+    aliases = [(1001, 1), (1002, 2)]
+    testers = [3]
+
+    expected = correct_events(events, aliases=aliases, testers=testers)
+    chunked = correct_events((events.iloc[i:i + 1000] for i in range(0, len(events), 1000)),
+                             aliases=aliases, testers=testers)
+
+    pd.testing.assert_frame_equal(chunked, expected)
+
+
+def test_aliases_are_resolved_before_filtering_testers():
+    start = pd.Timestamp('2019-01-01')
+    events = pd.DataFrame({'distinct_id': ['anon-tester', 'tester', 'anon-user', 'user'],
+                           'name': ['Install', 'SignUp', 'Install', 'SignUp'],
+                           'time': [start, start + pd.Timedelta('1h'), start, start + pd.Timedelta('1h')]})
+
+    corrected = correct_events(events, aliases=[('anon-tester', 'tester'), ('anon-user', 'user')],
+                               testers=['tester'])
+
+    assert corrected['distinct_id'].tolist() == ['user', 'user']
+    assert corrected['name'].tolist() == ['Install', 'SignUp']
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+from stats.event_store import EventStore, write_event_store
+from stats.retention import retention_table
+
+
+def test_round_trip(events, tmp_path):
+    events = events.assign(distinct_id='user-' + events['distinct_id'].astype(str))
+    store = write_event_store(events, str(tmp_path / 'store'))
+
+    frame = EventStore(str(tmp_path / 'store')).to_frame()
+    pd.testing.assert_series_equal(pd.Series(store.decode_ids(frame['distinct_id'].values), name='distinct_id'),
+                                   events['distinct_id'].reset_index(drop=True))
+    pd.testing.assert_frame_equal(retention_table(frame, 'Install', period='m')[1],
+                                  retention_table(events, 'Install', period='m')[1])
+
+
+def test_missing_ids_are_rejected(events, tmp_path):
+    events = events.assign(distinct_id=events['distinct_id'].where(events.index % 50 != 0))
+
+    with pytest.raises(ValueError):
+        write_event_store(events, str(tmp_path / 'store'))
+
+
+def test_decode_missing_code(events, tmp_path):
+    store = write_event_store(events, str(tmp_path / 'store'))
+
+    decoded = store.decode_ids([0, -1])
+    # -1 is a missing id, not the last one
+    assert decoded[0] == events['distinct_id'].iloc[0] and np.isnan(decoded[1])
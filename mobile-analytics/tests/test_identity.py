@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from stats.identity import IdentityIndex
+
+
+def test_chain_resolves_to_identified_id():
+    index = IdentityIndex([('anon', 'device'), ('device', 'user')])
+
+    assert index.to_dict() == {'anon': 'user', 'device': 'user'}
+
+
+def test_merging_two_identified_users():
+    # the same anonymous id was identified as two users: both end up as the first one seen
+    index = IdentityIndex([('anon', 'user-1'), ('anon', 'user-2')])
+
+    assert index.to_dict() == {'anon': 'user-1', 'user-2': 'user-1'}
+
+
+def test_incremental_add_aliases_matches_single_batch():
+    pairs = [('a1', 'u1'), ('a2', 'a1'), ('a3', 'u2'), ('a4', 'u3'), ('a3', 'a4'), ('a5', 'u1')]
+
+    incremental = IdentityIndex()
+    for pair in pairs:
+        incremental.add_aliases([pair])
+
+    assert incremental.to_dict() == IdentityIndex(pairs).to_dict()
+    assert incremental.to_dict()['a5'] == 'u1'
+    assert incremental.to_dict()['a4'] == incremental.to_dict()['u3'] == 'u2'
+
+
+def test_remap_leaves_unknown_and_missing_ids():
+    events = pd.DataFrame({'distinct_id': ['anon', 'user', 'other', None, 'anon'],
+                           'name': ['Install', 'SignUp', 'Install', 'Install', 'Purchase']})
+
+    remapped = IdentityIndex([('anon', 'user')]).remap(events)
+
+    assert remapped['distinct_id'].tolist() == ['user', 'user', 'other', None, 'user']
+    assert events['distinct_id'].tolist() == ['anon', 'user', 'other', None, 'anon']
+    pd.testing.assert_series_equal(remapped['name'], events['name'])
+
+
+def test_remap_matches_dict_lookup(events):
+    pairs = pd.DataFrame({'alias': np.arange(1, 300), 'distinct_id': np.arange(2, 301)})
+    index = IdentityIndex(pairs)
+    mapping = index.to_dict()
+
+    remapped = index.remap(events)
+
+    assert (remapped['distinct_id'] == 300).sum() == events['distinct_id'].between(1, 300).sum()
+    pd.testing.assert_series_equal(remapped['distinct_id'], events['distinct_id'].map(lambda x: mapping.get(x, x)),
+                                   check_dtype=False)
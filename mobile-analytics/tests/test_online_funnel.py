@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import make_events
+from stats.funnel import create_funnel_df
+from stats.online_funnel import OnlineFunnel
+
+STEPS = ['Install', 'SignUp', 'Click Product', 'Purchase']
+
+
+@pytest.fixture(scope='module')
+def day_events():
+    # the yearly dummy events squeezed into a single day, so that users do several steps within minutes
+    events = make_events(n=20000, n_users=500)
+    start = events['time'].min()
+    events['time'] = (start + (events['time'] - start) / 365).dt.floor('s')
+
+    return events
+
+
+def _replay(events, funnel, freq='5min'):
+    # events with the same time are never split across batches
+    for _, batch in events.groupby(events['time'].dt.floor(freq), sort=True):
+        funnel.update(batch)
+
+    return funnel
+
+
+@pytest.mark.parametrize('kwargs', [{},
+                                    {'step_interval': pd.Timedelta('5min')},
+                                    {'from_date': '2018-01-01 06:00', 'to_date': '2018-01-01 18:00'}])
+def test_replay_matches_create_funnel_df(day_events, kwargs):
+    funnel = _replay(day_events, OnlineFunnel(STEPS, **kwargs))
+
+    pd.testing.assert_frame_equal(funnel.funnel_df(), create_funnel_df(day_events, STEPS, **kwargs))
+
+
+def test_replay_with_string_ids_and_checkpoint(day_events, tmp_path):
+    events = day_events.assign(distinct_id='user-' + day_events['distinct_id'].astype(str))
+    half = events['time'] < events['time'].quantile(0.5)
+
+    path = str(tmp_path / 'funnel.pkl')
+    _replay(events[half], OnlineFunnel(STEPS)).save(path)
+    funnel = _replay(events[~half], OnlineFunnel.load(path))
+
+    pd.testing.assert_frame_equal(funnel.funnel_df(), create_funnel_df(events, STEPS))
+
+
+def test_batches_with_missing_ids(day_events):
+    funnel = OnlineFunnel(STEPS)
+
+    # a batch where no event has an id is ignored
+    start = day_events['time'].min()
+    funnel.update(pd.DataFrame({'distinct_id': [np.nan, np.nan], 'name': ['Install', 'SignUp'],
+                                'time': [start, start]}))
+    assert len(funnel) == 0
+
+    events = day_events.assign(distinct_id=day_events['distinct_id'].where(day_events['distinct_id'] % 9 != 0))
+    _replay(events, funnel)
+
+    tracked = day_events[day_events['distinct_id'] % 9 != 0]
+    pd.testing.assert_frame_equal(funnel.funnel_df(), create_funnel_df(tracked, STEPS))
+
+
+def _windowed_funnel(events, steps, window):
+    # reference: each step is the first event of the step after the previous one and within the window
+    reached = np.zeros(len(steps), dtype=int)
+    for _, user in events.sort_values('time', kind='mergesort').groupby('distinct_id'):
+        times = user.loc[user['name'] == steps[0], 'time']
+        if not len(times):
+            continue
+        start = last = times.iloc[0]
+        reached[0] += 1
+        for i, step in enumerate(steps[1:], 1):
+            times = user.loc[(user['name'] == step) & (user['time'] >= last) & (user['time'] <= start + window), 'time']
+            if not len(times):
+                break
+            last = times.iloc[0]
+            reached[i] += 1
+
+    return pd.DataFrame({'step': steps, 'val': reached})
+
+
+def test_conversion_window_across_batches_and_checkpoint(tmp_path):
+    start = pd.Timestamp('2019-01-01 10:00')
+    minutes = [pd.Timedelta(minutes=m) for m in range(15)]
+    # user 1 converts within the 10 minute window, but purchases after it;
+    # user 2 signs up after the window; user 3 completes the funnel
+    batches = [pd.DataFrame({'distinct_id': [1, 2, 3], 'name': ['Install'] * 3,
+                             'time': [start, start, start + minutes[1]]}),
+               pd.DataFrame({'distinct_id': [1, 3], 'name': ['SignUp', 'SignUp'],
+                             'time': [start + minutes[8], start + minutes[9]]}),
+               pd.DataFrame({'distinct_id': [1, 2, 3], 'name': ['Purchase', 'SignUp', 'Purchase'],
+                             'time': [start + minutes[12], start + minutes[12], start + minutes[11]]})]
+
+    funnel = OnlineFunnel(['Install', 'SignUp', 'Purchase'], conversion_window=pd.Timedelta('10min'))
+    funnel.update(batches[0]).save(str(tmp_path / 'funnel.pkl'))
+
+    # the window started in the 1st batch carries over the checkpoint
+    funnel = OnlineFunnel.load(str(tmp_path / 'funnel.pkl'))
+    funnel.update(batches[1]).update(batches[2])
+
+    assert funnel.funnel_df()['val'].tolist() == [3, 2, 1]
+    pd.testing.assert_frame_equal(funnel.funnel_df(),
+                                  _windowed_funnel(pd.concat(batches), ['Install', 'SignUp', 'Purchase'],
+                                                   pd.Timedelta('10min')))
+
+
+def test_conversion_window_replay(day_events, tmp_path):
+    window = pd.Timedelta('30min')
+    half = day_events['time'] < day_events['time'].quantile(0.5)
+
+    path = str(tmp_path / 'funnel.pkl')
+    _replay(day_events[half], OnlineFunnel(STEPS, conversion_window=window)).save(path)
+    funnel = _replay(day_events[~half], OnlineFunnel.load(path))
+
+    expected = _windowed_funnel(day_events, STEPS, window)
+    # the window drops some of the conversions counted without it
+    assert (expected['val'] < create_funnel_df(day_events, STEPS)['val']).any()
+    pd.testing.assert_frame_equal(funnel.funnel_df(), expected)
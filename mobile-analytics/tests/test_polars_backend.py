@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+from stats.acquisition import users_per_period
+from stats.retention import retention_table
+from stats.funnel import create_funnel_df
+from stats.user_journey import user_journey
+
+pl = pytest.importorskip('polars')
+polars_backend = pytest.importorskip('stats.polars_backend')
+
+STEPS = ['Install', 'SignUp', 'Purchase']
+
+
+@pytest.fixture(scope='module')
+def segment_events(events):
+    # some users have no source on their acquisition event
+    return events.assign(user_source=events['user_source'].where(events['distinct_id'] % 10 != 0))
+
+
+@pytest.fixture(scope='module', params=['pandas', 'polars', 'arrow'])
+def table(request, segment_events):
+    if request.param == 'polars':
+        return pl.from_pandas(segment_events)
+    elif request.param == 'arrow':
+        pa = pytest.importorskip('pyarrow')
+        return pa.Table.from_pandas(segment_events, preserve_index=False)
+
+    return segment_events
+
+
+@pytest.mark.parametrize('period', ['d', 'w', 'm'])
+def test_users_per_period(table, segment_events, period):
+    pd.testing.assert_frame_equal(polars_backend.users_per_period(table, 'Install', 'user_source', period=period),
+                                  users_per_period(segment_events, 'Install', 'user_source', period=period))
+
+
+@pytest.mark.parametrize('period, month_fmt, event_filter, segment_col', [('w', 'period', None, None),
+                                                                          ('m', 'period', None, None),
+                                                                          ('m', 'datetime', None, None),
+                                                                          ('m', 'period', 'Purchase', None),
+                                                                          ('w', 'period', None, 'user_source'),
+                                                                          ('m', 'period', 'Purchase', 'user_source')])
+def test_retention_table(table, segment_events, period, month_fmt, event_filter, segment_col):
+    result = polars_backend.retention_table(table, 'Install', period=period, month_fmt=month_fmt,
+                                            event_filter=event_filter, segment_col=segment_col)
+    expected = retention_table(segment_events, 'Install', period=period, month_fmt=month_fmt,
+                               event_filter=event_filter, segment_col=segment_col)
+
+    for r, e in zip(result, expected):
+        pd.testing.assert_frame_equal(r, e)
+
+
+@pytest.mark.parametrize('from_date, to_date, step_interval', [(None, None, 0),
+                                                               ('2018-03-01', '2018-10-01', 0),
+                                                               (None, None, pd.Timedelta('1 days 1 ms'))])
+def test_create_funnel_df(table, segment_events, from_date, to_date, step_interval):
+    pd.testing.assert_frame_equal(polars_backend.create_funnel_df(table, STEPS, from_date, to_date, step_interval),
+                                  create_funnel_df(segment_events, STEPS, from_date, to_date, step_interval))
+
+
+def test_user_journey(table, segment_events):
+    pd.testing.assert_frame_equal(polars_backend.user_journey(table, 'Install', n_steps=3),
+                                  user_journey(segment_events, 'Install', n_steps=3))
+
+
+def test_backend_argument(segment_events):
+    for r, e in zip(retention_table(segment_events, 'Install', period='m', segment_col='user_source',
+                                    backend='polars'),
+                    retention_table(segment_events, 'Install', period='m', segment_col='user_source')):
+        pd.testing.assert_frame_equal(r, e)
+
+
+def test_benchmark(events):
+    timings = polars_backend.benchmark(events.head(2000), 'Install', STEPS, 'Install', period='m', repeat=1)
+
+    assert sorted(timings.index) == ['create_funnel_df', 'retention_table', 'user_journey', 'users_per_period']
+    assert sorted(timings.columns) == ['pandas', 'polars']
+    assert (timings.values > 0).all()
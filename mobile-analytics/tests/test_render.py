@@ -0,0 +1,85 @@
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+from visualisations.render import lttb_indices, MAX_POINTS, MAX_ANNOTATED_CELLS, MAX_MATPLOTLIB_ROWS
+from visualisations.growth import users_per_period_figure
+from visualisations.retention_plots import retention_heatmap
+
+matplotlib.use('Agg')
+
+COLUMNS = ['New Users (Total)', 'New Organic Users', 'New Paid Users', 'Active Users', 'Returning Users',
+           'W/W Growth', 'N/R Ratio']
+
+
+@pytest.mark.parametrize('n, n_out', [(1000, 100), (1000, 3), (101, 100), (7, 5)])
+def test_lttb_indices(n, n_out):
+    y = np.random.RandomState(0).normal(size=n).cumsum()
+    y[n // 3] = np.nan
+    indices = lttb_indices(y, n_out)
+
+    assert len(indices) == n_out
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert (np.diff(indices) > 0).all()
+
+
+def test_lttb_indices_keeps_peaks():
+    y = np.zeros(1000)
+    y[[250, 600]] = [10, -10]
+
+    assert {250, 600} <= set(lttb_indices(y, 50))
+
+
+@pytest.mark.parametrize('n_out', [2, 1000, 2000])
+def test_lttb_indices_keeps_every_point(n_out):
+    # nothing to downsample, or too few points to keep more than the first and the last one
+    assert lttb_indices(np.arange(1000), n_out).tolist() == list(range(1000))
+
+
+def _users_per_period(n):
+    values = np.random.RandomState(0).randint(1, 100, size=(n, len(COLUMNS)))
+    return pd.DataFrame(values, columns=COLUMNS, index=pd.date_range('2018-01-01', periods=n, freq='D'))
+
+
+@pytest.mark.parametrize('n, render', [(MAX_POINTS, 'svg'), (MAX_POINTS + 1, 'webgl')])
+def test_users_per_period_auto_render(n, render):
+    fig = users_per_period_figure(_users_per_period(n))
+
+    types = {trace.type for trace in fig['data']}
+    if render == 'webgl':
+        assert types == {'scattergl'}
+        assert all(len(trace.x) == MAX_POINTS for trace in fig['data'])
+    else:
+        assert 'bar' in types and 'scattergl' not in types
+        assert all(len(trace.x) == n for trace in fig['data'])
+
+
+def _retention(n_rows, n_cols):
+    index = pd.MultiIndex.from_arrays([pd.date_range('2018-01-01', periods=n_rows, freq='D'),
+                                       np.arange(n_rows) + 100], names=['cohort', 'size'])
+    return pd.DataFrame(np.random.RandomState(0).uniform(size=(n_rows, n_cols)), index=index)
+
+
+@pytest.mark.parametrize('n_rows, engine', [(MAX_MATPLOTLIB_ROWS, 'matplotlib'),
+                                            (MAX_MATPLOTLIB_ROWS + 1, 'plotly')])
+def test_retention_heatmap_auto_engine(n_rows, engine):
+    # a single column, so that every table is annotated
+    h = retention_heatmap(_retention(n_rows, 1), type='perc')
+
+    if engine == 'plotly':
+        assert len(h.layout.annotations) == n_rows
+    else:
+        assert isinstance(h, matplotlib.axes.Axes) and len(h.texts) == n_rows
+        matplotlib.pyplot.close('all')
+
+
+@pytest.mark.parametrize('n_cols, annotated', [(MAX_ANNOTATED_CELLS // 20, True),
+                                               (MAX_ANNOTATED_CELLS // 20 + 1, False)])
+@pytest.mark.parametrize('engine', ['matplotlib', 'plotly'])
+def test_retention_heatmap_auto_annotations(n_cols, annotated, engine):
+    df = _retention(20, n_cols)
+    h = retention_heatmap(df, type='perc', engine=engine)
+
+    texts = h.texts if engine == 'matplotlib' else h.layout.annotations
+    assert len(texts) == (df.size if annotated else 0)
+    matplotlib.pyplot.close('all')
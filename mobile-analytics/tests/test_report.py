@@ -0,0 +1,71 @@
+import os
+import pandas as pd
+import pytest
+from stats.acquisition import MISSING_SEGMENT
+from stats.retention import retention_table
+from visualisations.report import compute_report_stats, check_spec, generate_report
+
+SPEC = {'metrics': ['retention', 'funnel'],
+        'periods': ['m'],
+        'acquisition_event_name': 'Install',
+        'steps': ['Install', 'SignUp', 'Purchase']}
+
+
+def test_segments_match_the_segmented_retention(events):
+    # the segment of some users changes after their acquisition event
+    events = events.assign(user_source=events['user_source'].where(events['distinct_id'] % 10 != 0))
+    later = events['name'] != 'Install'
+    events.loc[later & (events['distinct_id'] % 7 == 0), 'user_source'] = 'Referral'
+
+    stats = compute_report_stats(events, dict(SPEC, segment_col='user_source'))
+    counts, _ = retention_table(events, 'Install', period='m', segment_col='user_source')
+
+    segments = {figure['segment'] for figure in stats.values()}
+    assert segments == {'All', MISSING_SEGMENT} | set(counts.index.get_level_values(0))
+    # the segmented table spans the cohorts of all the segments, so only the users of each cohort are compared
+    for segment in counts.index.get_level_values(0).unique():
+        sizes = counts.loc[segment].index.to_frame(index=False).set_index('cohort')['size']
+        report_sizes = stats['{}_retention_m'.format(segment)]['result'][0].index.to_frame(index=False) \
+            .set_index('cohort')['size']
+        pd.testing.assert_series_equal(report_sizes[report_sizes > 0], sizes[sizes > 0])
+
+
+def test_segment_without_acquisition_is_skipped(events):
+    # no user is acquired, but the funnel can still be calculated
+    events = events.assign(name=events['name'].replace('Install', 'Open'))
+    spec = dict(SPEC, steps=['Open', 'SignUp', 'Purchase'])
+
+    with pytest.warns(UserWarning, match='has no "Install" event'):
+        stats = compute_report_stats(events, spec)
+
+    assert list(stats) == ['All_funnel']
+
+
+def test_segment_col_needs_acquisition_event():
+    spec = {key: value for key, value in SPEC.items() if key != 'acquisition_event_name'}
+    spec.update(metrics=['funnel'], segment_col='user_source')
+
+    with pytest.raises(AssertionError):
+        check_spec(spec)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_generate_report_html(events, tmp_path, max_workers):
+    events = events[events['time'] < '2018-04-01']
+    spec = dict(SPEC, metrics=['growth', 'retention', 'funnel', 'funnel_trend', 'sankey'], periods=['w', 'm'],
+                segment_col='user_source', user_source_col='user_source', starting_step='Install')
+
+    timings = generate_report(events, spec, str(tmp_path), max_workers=max_workers)
+
+    names = sorted(compute_report_stats(events, spec))
+    # All, Organic and Non-organic segments, with 8 figures each
+    assert sorted(timings.index) == names and len(names) == 3 * 8
+    assert timings[['compute_time', 'render_time', 'export_time']].notna().all().all()
+    assert (timings[['compute_time', 'render_time', 'export_time']] >= 0).all().all()
+    assert (timings[['render_time', 'export_time']] > 0).any().all()
+
+    assert sorted(os.listdir(str(tmp_path))) == sorted(name + '.html' for name in names)
+    for name, files in timings['files'].items():
+        assert files == [str(tmp_path / (name + '.html'))]
+        with open(files[0]) as f:
+            assert 'plotly' in f.read()
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from stats.acquisition import MISSING_SEGMENT
+from stats.event_store import write_event_store
+from stats.retention import retention_table
+
+
+def _segment_events():
+    start = pd.Timestamp('2019-01-07')
+    return pd.DataFrame({
+        'distinct_id': [1, 1, 2, 2, 3, 3],
+        # user 1 has another event at the very time of the acquisition, with a different country
+        'name': ['Open', 'Install', 'Install', 'Purchase', 'Install', 'Purchase'],
+        'time': [start, start, start, start + pd.Timedelta('7d'), start, start + pd.Timedelta('8d')],
+        'country': ['US', 'UK', 'UK', 'UK', np.nan, 'US']})
+
+
+def test_segment_is_taken_from_the_acquisition_event():
+    counts, _ = retention_table(_segment_events(), 'Install', period='w', segment_col='country')
+
+    # users 1 and 2 are acquired in the UK; user 3 has no country on the acquisition event
+    assert counts.index.get_level_values('country').unique().tolist() == ['UK', MISSING_SEGMENT]
+    assert counts.loc['UK'].index.get_level_values('size').tolist() == [2, 0]
+    assert counts.loc[MISSING_SEGMENT].index.get_level_values('size').tolist() == [1, 0]
+
+
+def test_segments_add_up_to_the_whole_table(events):
+    events = events.assign(user_source=events['user_source'].where(events['distinct_id'] % 10 != 0))
+
+    counts, _ = retention_table(events, 'Install', period='m', segment_col='user_source')
+    total, _ = retention_table(events, 'Install', period='m')
+
+    summed = counts.fillna(0).groupby(level='cohort').sum()
+    pd.testing.assert_frame_equal(summed, total.fillna(0).reset_index(level='size', drop=True),
+                                  check_names=False)
+    sizes = counts.index.to_frame()['size'].groupby(level='cohort').sum()
+    assert sizes.tolist() == total.index.get_level_values('size').tolist()
+
+
+@pytest.mark.parametrize('sources', [['Organic', 'Non-organic'], ['Organic', 'Non-organic', 'Referral']])
+def test_categorical_segment_matches_object(events, tmp_path, sources):
+    # some users have no source, and "Referral" is a category without any user
+    source = events['user_source'].where(events['distinct_id'] % 10 != 0)
+    categorical = events.assign(user_source=pd.Categorical(source, categories=sources))
+
+    expected = retention_table(events.assign(user_source=source), 'Install', period='m', segment_col='user_source')
+    for frame in (categorical, write_event_store(categorical, str(tmp_path / 'store')).to_frame()):
+        result = retention_table(frame, 'Install', period='m', segment_col='user_source')
+        for table, expected_table in zip(result, expected):
+            assert table.index.tolist() == expected_table.index.tolist()
+            np.testing.assert_array_equal(table.values, expected_table.values)
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from stats.rollup import AcquisitionCube, MAX_LAG, hll_registers
+from stats.acquisition import users_per_period
+
+
+@pytest.fixture(scope='module')
+def cube(events):
+    return AcquisitionCube('Install', user_source_col='user_source').refresh(events)
+
+
+def test_daily_counts_are_exact(cube, events):
+    pd.testing.assert_frame_equal(cube.users_per_period(period='d'),
+                                  users_per_period(events, 'Install', 'user_source', period='d'),
+                                  check_index_type=False, check_dtype=False)
+
+
+@pytest.mark.parametrize('period', ['w', 'm'])
+def test_period_estimates(cube, events, period):
+    result = cube.users_per_period(period=period)
+    expected = users_per_period(events, 'Install', 'user_source', period=period)
+
+    # new users are exact, active and returning users are within a few times the HyperLogLog error
+    for col in ['New Users (Total)', 'New Organic Users', 'New Paid Users']:
+        assert result[col].tolist() == expected[col].tolist()
+    for col in ['Active Users', 'Returning Users']:
+        expected_values = expected[col].astype(float).values
+        error = np.abs(result[col].astype(float).values - expected_values) / np.maximum(expected_values, 1)
+        assert error.max() < 4 * 1.04 / np.sqrt(2 ** cube.precision)
+
+
+def test_day_by_day_refresh_matches_single_refresh(cube, events):
+    daily = AcquisitionCube('Install', user_source_col='user_source')
+    for _, day in events.sort_values('time').groupby(events['time'].dt.floor('D').sort_values().values):
+        daily.refresh(day)
+
+    for period in ['d', 'w', 'm']:
+        pd.testing.assert_frame_equal(daily.users_per_period(period=period), cube.users_per_period(period=period))
+
+
+def test_refresh_replaces_every_cell_of_the_refreshed_days(events):
+    days = events[events['time'] < '2018-02-01']
+    cube = AcquisitionCube('Install', user_source_col='user_source').refresh(days)
+
+    # corrected events of the last day: only one user left, which was acquired earlier
+    day = days[days['time'].dt.floor('D') == '2018-01-31']
+    acquired = cube.users[cube.users['acquisition_time'] < '2018-01-31'].index
+    user = day.loc[day['distinct_id'].isin(acquired), 'distinct_id'].iloc[0]
+    corrected = day[day['distinct_id'] == user]
+    assert day['distinct_id'].nunique() > 1 and (day['name'] == 'Install').any()
+    cube.refresh(corrected)
+
+    expected = AcquisitionCube('Install', user_source_col='user_source') \
+        .refresh(pd.concat([days[days['time'].dt.floor('D') != '2018-01-31'], corrected]))
+    pd.testing.assert_frame_equal(cube.cells.sort_values(['activity_day', 'user_source', 'lag'])
+                                  .reset_index(drop=True),
+                                  expected.cells.sort_values(['activity_day', 'user_source', 'lag'])
+                                  .reset_index(drop=True))
+    assert cube.cells[cube.cells['activity_day'] == '2018-01-31']['users'].sum() == 1
+    pd.testing.assert_frame_equal(cube.users, expected.users)
+    pd.testing.assert_frame_equal(cube.users_per_period(period='d'), expected.users_per_period(period='d'))
+
+
+def test_sparse_sketches(cube, events, tmp_path):
+    # at most one register per (cell, user), far below the dense 2 ** precision registers per cell
+    assert len(cube.sketches) <= cube.cells['users'].sum() < len(cube.cells) * 2 ** cube.precision
+    assert not cube.sketches.duplicated(['cell', 'register']).any() and (cube.sketches['value'] > 0).all()
+
+    # the registers of a cell are the ones of its users
+    cell = cube.cells['users'].idxmax()
+    day, source, lag = cube.cells.loc[cell, ['activity_day', 'user_source', 'lag']]
+    active = events[events['time'].dt.floor('D') == day]
+    acquisition_day = cube.users['acquisition_time'].dt.floor('D')
+    ids = [i for i in active['distinct_id'].unique()
+           if i in cube.users.index and cube.users.loc[i, 'user_source'] == source
+           and min((day - acquisition_day[i]).days, MAX_LAG) == lag]
+    index, rho = hll_registers(np.array(ids), cube.precision)
+    registers = pd.Series(rho).groupby(index).max()
+    sketch = cube.sketches[cube.sketches['cell'] == cell].set_index('register')['value'].sort_index()
+    assert sketch.tolist() == registers.tolist() and sketch.index.tolist() == registers.index.tolist()
+
+    path = str(tmp_path / 'cube.pkl')
+    cube.save(path)
+    loaded = AcquisitionCube.load(path)
+    pd.testing.assert_frame_equal(loaded.users_per_period(period='w', user_source='Organic'),
+                                  cube.users_per_period(period='w', user_source='Organic'))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from stats.acquisition import users_per_period
+from stats.funnel import create_funnel_df, group_funnel_dfs, funnel_trend_df
+from stats.retention import retention_table, retention_intervals
+from stats.user_journey import user_journey, sankey_df
+
+STEPS = ['Install', 'SignUp', 'Purchase']
+
+
+def _assert_bounds(df, columns):
+    for col in columns:
+        assert (df[col + '_low'] <= df[col]).all() and (df[col] <= df[col + '_high']).all()
+
+
+def test_users_per_period_intervals(events):
+    df = users_per_period(events, 'Install', 'user_source', period='m', sample=0.5, numeric=True)
+    counts = ['New Users (Total)', 'New Organic Users', 'New Paid Users', 'Active Users', 'Returning Users']
+
+    assert [col + '_low' for col in counts] == [col for col in df.columns if col.endswith('_low')]
+    _assert_bounds(df, counts)
+    assert (df['Active Users_high'] > df['Active Users_low']).all()
+
+
+def test_funnel_intervals(events):
+    funnel_df = create_funnel_df(events, STEPS, sample=0.5)
+    _assert_bounds(funnel_df, ['val'])
+
+    for group_df in group_funnel_dfs(events, STEPS, 'user_source', sample=0.5).values():
+        _assert_bounds(group_df, ['val'])
+
+
+def test_funnel_trend_intervals(events):
+    trend_df = funnel_trend_df(events, STEPS, period='m', sample=0.5)
+
+    assert list(trend_df.columns) == STEPS + [step + suffix for step in STEPS for suffix in ('_low', '_high')]
+    _assert_bounds(trend_df, STEPS)
+
+
+def test_journey_intervals(events):
+    flow = user_journey(events, 'Install', sample=0.5)
+    _assert_bounds(flow, ['count'])
+
+    # the intervals of the links are calculated from their summed counts
+    _, _, links = sankey_df(events, 'Install', sample=0.5)
+    _assert_bounds(links, ['count'])
+    assert list(links.columns[:3]) == ['source', 'target', 'count']
+
+
+def test_retention_intervals(events):
+    counts, pct = retention_table(events, 'Install', period='m', sample=0.5)
+    low, high = retention_intervals(counts, 0.5)
+
+    assert low.shape == high.shape == pct.shape
+    filled = pct.notna().values
+    # masked cells have no interval
+    assert np.array_equal(low.notna().values, filled)
+    assert (low.values[filled] <= pct.values[filled] + 1e-12).all()
+    assert (pct.values[filled] <= high.values[filled] + 1e-12).all()
+    assert (0 <= low.values[filled]).all() and (high.values[filled] <= 1 + 1e-12).all()
+
+
+def test_full_sample_has_exact_counts(events):
+    funnel_df = create_funnel_df(events, STEPS, sample=1)
+
+    pd.testing.assert_frame_equal(funnel_df[['step', 'val']], create_funnel_df(events, STEPS))
+    np.testing.assert_allclose(funnel_df['val_low'], funnel_df['val'])
+    np.testing.assert_allclose(funnel_df['val_high'], funnel_df['val'])
+
+    counts, pct = retention_table(events, 'Install', period='m', sample=1)
+    low, high = retention_intervals(counts, 1)
+    filled = pct.notna().values
+    np.testing.assert_allclose(low.values[filled], pct.values[filled])
+    np.testing.assert_allclose(high.values[filled], pct.values[filled])
+
+
+@pytest.mark.parametrize('rate', [0.2, 0.5])
+def test_intervals_cover_the_full_count(events, rate):
+    full = create_funnel_df(events, STEPS)['val']
+    funnel_df = create_funnel_df(events, STEPS, sample=rate)
+
+    # the deterministic sample is a single draw; 95% intervals of these few counts should all cover the truth
+    assert ((funnel_df['val_low'] <= full) & (full <= funnel_df['val_high'])).all()
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import pytest
+from visualisations.server import MetricsService, serve
+
+SPEC = {'metrics': ['funnel'], 'steps': ['Install', 'SignUp', 'Purchase']}
+
+
+def _wait(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def server(events):
+    # every refresh after the first one is held until "release" is set
+    loads = []
+    release = threading.Event()
+
+    def load_events():
+        loads.append(time.time())
+        if len(loads) > 1:
+            release.wait(30)
+        return events
+
+    service = MetricsService(load_events, SPEC, refresh_interval=3600, figures=False)
+    server = serve(service, port=0)
+    _wait(lambda: service.age() is not None)
+
+    yield service, 'http://127.0.0.1:{}'.format(server.server_address[1]), loads, release
+
+    release.set()
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def _get(url):
+    try:
+        with urlopen(url) as response:
+            return response.status, json.loads(response.read()), response.headers
+    except HTTPError as error:
+        return error.code, json.loads(error.read()), error.headers
+
+
+def test_concurrent_refresh_requests_start_one_refresh(server):
+    service, url, loads, release = server
+
+    barrier = threading.Barrier(8)
+    requested = []
+
+    def post():
+        barrier.wait()
+        with urlopen(Request(url + '/refresh', data=b'', method='POST')) as response:
+            requested.append(json.loads(response.read())['requested'])
+
+    threads = [threading.Thread(target=post) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(requested) == [False] * 7 + [True]
+
+    release.set()
+    _wait(lambda: service.stats()['refresh']['refreshes'] == 2)
+    time.sleep(0.2)
+    assert len(loads) == 2 and not service.stats()['refresh']['refreshing']
+
+
+def test_unknown_figures_are_misses(server):
+    service, url, _, _ = server
+
+    assert _get(url + '/metrics/All_funnel')[0] == 200
+    assert _get(url + '/metrics/nothing')[0] == 404
+    # figures are not precomputed
+    assert _get(url + '/figures/All_funnel')[0] == 404
+
+    cache = _get(url + '/stats')[1]['cache']
+    assert (cache['hits'], cache['misses']) == (1, 2)
+    assert cache['hit_rate'] == pytest.approx(1 / 3)
+
+
+def test_previous_responses_are_served_during_a_refresh(server):
+    service, url, loads, release = server
+    status, previous, headers = _get(url + '/metrics/All_funnel')
+    assert status == 200 and headers['X-Cache'] == 'HIT'
+
+    assert service.request_refresh()
+    _wait(lambda: len(loads) == 2)
+    assert _get(url + '/health')[1]['refreshing']
+
+    # the refresh is held: the previous responses are still served, and flagged once older than the interval
+    assert _get(url + '/metrics/All_funnel')[:2] == (200, previous)
+    service.refresh_interval = 0.01
+    time.sleep(0.05)
+    status, body, headers = _get(url + '/metrics/All_funnel')
+    assert (status, body, headers['X-Cache']) == (200, previous, 'STALE')
+
+    # the refresh is only seen as done once the new responses are swapped in: the state is recorded every time
+    # the service lock is released
+    states = []
+
+    class RecordingLock(object):
+        def __init__(self, lock):
+            self.lock = lock
+
+        def __enter__(self):
+            return self.lock.__enter__()
+
+        def __exit__(self, *args):
+            states.append((service._refreshing, service._refresh_stats['refreshes']))
+            return self.lock.__exit__(*args)
+
+    service._lock = RecordingLock(service._lock)
+    service.refresh_interval = 3600
+    release.set()
+    _wait(lambda: not service.stats()['refresh']['refreshing'])
+    assert service.stats()['refresh']['refreshes'] == 2 and service.age() < 1
+    assert (False, 1) not in states
+
+
+def test_stats_latencies(server):
+    _, url, _, _ = server
+
+    for _ in range(3):
+        _get(url + '/metrics/All_funnel')
+    _get(url + '/metrics')
+
+    requests = _get(url + '/stats')[1]['requests']
+    assert set(requests) == {'/metrics', '/metrics/<name>'}
+    assert requests['/metrics/<name>']['count'] == 3 and requests['/metrics']['count'] == 1
+    for latency in requests.values():
+        assert 0 < latency['p50_ms'] <= latency['p95_ms'] <= latency['max_ms']
+        assert 0 < latency['mean_ms'] <= latency['max_ms']
@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+from stats import sql_backend
+from stats.acquisition import users_per_period
+from stats.retention import retention_table
+from stats.funnel import create_funnel_df
+from stats.user_journey import user_journey, sankey_df
+
+STEPS = ['Install', 'SignUp', 'Purchase']
+
+
+@pytest.fixture(scope='module', params=['sqlite', 'duckdb'])
+def con(request, events):
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+
+    con = sql_backend.connect(engine=request.param)
+    sql_backend.load_events(con, events)
+    yield con
+    con.close()
+
+
+@pytest.mark.parametrize('period', ['d', 'w', 'm'])
+def test_users_per_period(con, events, period):
+    pd.testing.assert_frame_equal(sql_backend.users_per_period_sql(con, 'Install', 'user_source', period=period),
+                                  users_per_period(events, 'Install', 'user_source', period=period))
+
+
+@pytest.mark.parametrize('period, month_fmt, event_filter', [('w', 'period', None), ('m', 'period', None),
+                                                             ('m', 'datetime', None), ('m', 'period', 'Purchase')])
+def test_retention_table(con, events, period, month_fmt, event_filter):
+    result = sql_backend.retention_table_sql(con, 'Install', period=period, month_fmt=month_fmt,
+                                             event_filter=event_filter)
+    expected = retention_table(events, 'Install', period=period, month_fmt=month_fmt, event_filter=event_filter)
+
+    for r, e in zip(result, expected):
+        pd.testing.assert_frame_equal(r, e)
+
+
+@pytest.mark.parametrize('from_date, to_date, step_interval', [(None, None, 0),
+                                                               ('2018-03-01', '2018-10-01', 0),
+                                                               (None, None, pd.Timedelta('1 days 1 ms'))])
+def test_create_funnel_df(con, events, from_date, to_date, step_interval):
+    pd.testing.assert_frame_equal(sql_backend.create_funnel_df_sql(con, STEPS, from_date, to_date, step_interval),
+                                  create_funnel_df(events, STEPS, from_date, to_date, step_interval))
+
+
+@pytest.mark.parametrize('engine', ['sqlite', 'duckdb'])
+def test_create_funnel_df_step_interval_boundary(engine):
+    if engine == 'duckdb':
+        pytest.importorskip('duckdb')
+
+    start = pd.Timestamp('2019-01-01 10:00:00.123456')
+    interval = pd.Timedelta('1 days 00:00:00.000001')
+    # user 1 signs up exactly on the boundary, user 2 one microsecond before it
+    events = pd.DataFrame({'distinct_id': [1, 1, 2, 2],
+                           'name': ['Install', 'SignUp', 'Install', 'SignUp'],
+                           'time': [start, start + interval, start, start + interval - pd.Timedelta('1us')]})
+
+    con = sql_backend.connect(engine=engine)
+    sql_backend.load_events(con, events)
+
+    result = sql_backend.create_funnel_df_sql(con, ['Install', 'SignUp'], step_interval=interval)
+
+    assert result['val'].tolist() == [2, 1]
+    pd.testing.assert_frame_equal(result, create_funnel_df(events, ['Install', 'SignUp'], step_interval=interval))
+
+
+def test_user_journey(con, events):
+    pd.testing.assert_frame_equal(sql_backend.user_journey_sql(con, 'Install', n_steps=3),
+                                  user_journey(events, 'Install', n_steps=3))
+
+
+def test_sankey_df(con, events):
+    label_list, colors_list, source_target_df = sql_backend.sankey_df_sql(con, 'Install', n_steps=3)
+    expected_labels, expected_colors, expected_df = sankey_df(events, 'Install', n_steps=3)
+
+    assert label_list == expected_labels
+    assert colors_list == expected_colors
+    pd.testing.assert_frame_equal(source_target_df.reset_index(drop=True), expected_df.reset_index(drop=True))
+
+
+def test_benchmark(events):
+    timings = sql_backend.benchmark(events.head(2000), 'Install', 'user_source', STEPS, 'Install',
+                                    engines=('sqlite',), repeat=1)
+
+    assert list(timings.columns) == ['pandas', 'sqlite']
+    assert set(timings.index) == {'load_events', 'users_per_period', 'retention_table', 'create_funnel_df',
+                                  'user_journey'}
+
+
+def test_benchmark_without_user_source(events):
+    timings = sql_backend.benchmark(events.head(2000), 'Install', None, STEPS, 'Install',
+                                    engines=('sqlite',), repeat=1)
+
+    # pandas has no loading step
+    assert timings.drop('load_events').notna().all().all() and timings.loc['load_events', 'sqlite'] > 0
+
+
+@pytest.mark.parametrize('engine', ['sqlite', 'duckdb'])
+def test_benchmark_replaces_events_of_previous_runs(events, tmp_path, engine):
+    if engine == 'duckdb':
+        pytest.importorskip('duckdb')
+
+    for _ in range(2):
+        sql_backend.benchmark(events.head(2000), 'Install', 'user_source', STEPS, 'Install',
+                              engines=(engine,), directory=str(tmp_path), repeat=1)
+
+    con = sql_backend.connect(str(tmp_path / 'events.{}'.format(engine)), engine=engine)
+    assert con.execute('SELECT COUNT(*) FROM events').fetchone()[0] == 2000
+    con.close()
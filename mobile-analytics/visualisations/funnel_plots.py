@@ -1,8 +1,9 @@
+import pandas as pd
 from plotly import graph_objs as go
-from stats.funnel import create_funnel_df, group_funnel_dfs
+from stats.funnel import create_funnel_df, group_funnel_dfs, funnel_trend_df
 
 
-def plot_stacked_funnel(events, steps, col=None, from_date=None, to_date=None, step_interval=0):
+def plot_stacked_funnel(events, steps, col=None, from_date=None, to_date=None, step_interval=0, sample=None):
     """
     Function used for producing a funnel plot
 
@@ -15,28 +16,56 @@ def plot_stacked_funnel(events, steps, col=None, from_date=None, to_date=None, s
     :param col: (str)
                     column to be used for grouping the funnel dataframes
 
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
     :return: (plt.figure) funnel plot
     """
 
-    # create list to append each trace to
-    # this will be passed to "go.Figure" at the end
-    data = []
-
     # if col is provided, create a funnel_df for each entry in the "col"
     if col:
         # generate dict of funnel dataframes
-        dict_ = group_funnel_dfs(events, steps, col)
+        dict_ = group_funnel_dfs(events, steps, col, sample=sample)
         title = 'Funnel plot per {}'.format(col)
     else:
-        funnel_df = create_funnel_df(events, steps, from_date=from_date, to_date=to_date, step_interval=step_interval)
+        funnel_df = create_funnel_df(events, steps, from_date=from_date, to_date=to_date, step_interval=step_interval,
+                                     sample=sample)
         dict_ = {'Total': funnel_df}
         title = 'Funnel plot'
 
+    return stacked_funnel_figure(dict_, title=title)
+
+
+def stacked_funnel_figure(dict_, title='Funnel plot'):
+    """
+    Function used to build the funnel plot from already calculated funnel dataframes
+
+    :param dict_: (dict)
+                    funnel dataframes as returned by "stats.funnel.create_funnel_df", keyed by trace name.
+                    The confidence intervals of sampled counts are shown on hover
+
+    :param title: (str)
+                    title of the plot
+
+    :return: (plt.figure) funnel plot
+    """
+    # create list to append each trace to
+    # this will be passed to "go.Figure" at the end
+    data = []
+
     for t in dict_.keys():
+        funnel_df = dict_[t]
+        # confidence interval of the sampled counts, shown on hover
+        hovertext = None
+        if 'val_low' in funnel_df.columns:
+            hovertext = ['{:.0f} users (95% CI {:.0f}-{:.0f})'.format(val, low, high)
+                         for val, low, high in funnel_df[['val', 'val_low', 'val_high']].values]
+
         trace = go.Funnel(
             name=t,
-            y=dict_[t].step.values,
-            x=dict_[t].val.values,
+            y=funnel_df.step.values,
+            x=funnel_df.val.values,
+            hovertext=hovertext,
             textinfo="value+percent previous"
         )
         data.append(trace)
@@ -45,7 +74,100 @@ def plot_stacked_funnel(events, steps, col=None, from_date=None, to_date=None, s
                        funnelmode="stack",
                        showlegend=True,
                        hovermode='closest',
-                       title='Funnel plot per {}'.format(col),
+                       title=title,
+                       legend=dict(orientation="v",
+                                   bgcolor='#E2E2E2',
+                                   xanchor='left',
+                                   font=dict(
+                                       size=12)
+                                   )
+                       )
+
+    return go.Figure(data, layout)
+
+
+def plot_funnel_trend(events, steps, period='w', from_date=None, to_date=None, step_interval=0, sample=None):
+    """
+    Function used for producing a line plot of the conversion from the 1st step to every subsequent step,
+    per period in which the users did the 1st step
+
+    :param events: (DataFrame)
+                    events dataframe
+
+    :param steps: (list)
+                    list containing funnel steps as strings
+
+    :param period: (str)
+                    str denoting period for cohort breakdown.
+                    Use 'd' for daily, 'w' for weekly or 'm' for monthly
+
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
+    :return: (plt.figure) funnel trend plot
+    """
+    trend_df = funnel_trend_df(events, steps, period=period, from_date=from_date, to_date=to_date,
+                               step_interval=step_interval, sample=sample)
+
+    title = 'Conversion from {} per period'.format(steps[0])
+    if sample is not None:
+        title += ' ({:g}% sample)'.format(sample * 100)
+
+    return funnel_trend_figure(trend_df, title=title)
+
+
+def funnel_trend_figure(trend_df, title=None):
+    """
+    Function used to build the funnel trend plot from an already calculated "stats.funnel.funnel_trend_df"
+
+    :param trend_df: (DataFrame)
+                    number of users per step (columns) and period of the 1st step (index). The confidence intervals
+                    of sampled counts are shown on hover
+
+    :param title: (str)
+                    title of the plot; defaults to the conversion from the 1st step
+
+    :return: (plt.figure) funnel trend plot
+    """
+    # confidence interval columns of sampled counts, as added by "stats.funnel.funnel_trend_df"
+    interval_cols = [col for col in trend_df.columns
+                     if str(col).endswith(('_low', '_high')) and str(col).rsplit('_', 1)[0] in trend_df.columns]
+    intervals = trend_df[interval_cols]
+    trend_df = trend_df.drop(interval_cols, axis=1)
+
+    if title is None:
+        title = 'Conversion from {} per period'.format(trend_df.columns[0])
+
+    # needed to convert the month period to time_manipulations
+    if isinstance(trend_df.index, pd.PeriodIndex):
+        trend_df = trend_df.copy()
+        trend_df.index = trend_df.index.to_timestamp().strftime("%Y-%m")
+
+    # conversion of each step relative to the users that started the funnel in the period
+    conversion = trend_df.iloc[:, 1:].div(trend_df.iloc[:, 0], axis=0) * 100
+
+    data = []
+    for i, step in enumerate(conversion.columns):
+        text = trend_df.iloc[:, i + 1].values
+        if step + '_low' in intervals.columns:
+            text = ['{:.0f}, 95% CI {:.0f}-{:.0f}'.format(val, low, high)
+                    for val, low, high in zip(text, intervals[step + '_low'], intervals[step + '_high'])]
+
+        trace = go.Scatter(
+            name=step,
+            x=conversion.index,
+            y=conversion.iloc[:, i].values,
+            text=text,
+            mode='lines+markers',
+            hovertemplate='%{y:.1f}% (%{text} users)'
+        )
+        data.append(trace)
+
+    layout = go.Layout(margin={"l": 60, "r": 0, "t": 30, "b": 0, "pad": 0},
+                       showlegend=True,
+                       hovermode='closest',
+                       title=title,
+                       yaxis=dict(title='Conversion (%)', ticksuffix='%'),
                        legend=dict(orientation="v",
                                    bgcolor='#E2E2E2',
                                    xanchor='left',
@@ -1,8 +1,11 @@
+import pandas as pd
 from plotly import graph_objs as go
 from stats.acquisition import users_per_period
+from visualisations.render import lttb_indices, MAX_POINTS
 
 
-def plot_users_per_period(events, acquisition_event_name, user_source_col, period='w'):
+def plot_users_per_period(events, acquisition_event_name, user_source_col, period='w', sample=None, render='auto',
+                          max_points=MAX_POINTS):
     """
     Function use to create multi-axes plot and table for all the stats generated by
     "stats.retention.users_per_period"
@@ -21,22 +24,137 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
                     str denoting period for cohort breakdown.
                     Use 'd' for daily, 'w' for weekly or 'm' for monthly
 
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
+    :param render: (str)
+                    "svg" for bars with the values as text, "webgl" for WebGL line traces downsampled to
+                    "max_points" points per stat, or "auto" to use "webgl" only when there are more than
+                    "max_points" periods (e.g. daily stats over a long range)
+
+    :param max_points: (int)
+                    maximum number of points per stat drawn in "webgl" mode
+
     :return: (fig)
                     plotly figure
     """
 
-    # generate user stats per period
-    df = users_per_period(events, acquisition_event_name, user_source_col, period)
+    assert render in ['auto', 'svg', 'webgl'], '"render" should be either "auto", "svg" or "webgl"'
+
+    # generate user stats per period, keeping growth and ratios numeric
+    df = users_per_period(events, acquisition_event_name, user_source_col, period, sample=sample, numeric=True)
+
+    return users_per_period_figure(df, render=render, max_points=max_points)
+
+
+def users_per_period_figure(df, render='auto', max_points=MAX_POINTS):
+    """
+    Function used to build the multi-axes plot from an already calculated "stats.acquisition.users_per_period"
+    table, e.g. one computed with "stats.analysis.Analysis".
+
+    :param df: (DataFrame)
+                    "users_per_period" table with the user source breakdown, preferably with "numeric=True".
+                    The confidence intervals of sampled counts are drawn as error bars
+
+    :param render: (str)
+                    "svg", "webgl" or "auto" (see "plot_users_per_period")
+
+    :param max_points: (int)
+                    maximum number of points per stat drawn in "webgl" mode
+
+    :return: (fig)
+                    plotly figure
+    """
+    assert render in ['auto', 'svg', 'webgl'], '"render" should be either "auto", "svg" or "webgl"'
 
     # needed to convert the month period to time_manipulations
-    if period == 'm':
+    if isinstance(df.index, pd.PeriodIndex):
+        df = df.copy()
         df.index = df.index.to_timestamp().strftime("%Y-%m")
 
+    if render == 'auto':
+        render = 'webgl' if len(df) > max_points else 'svg'
+
+    if render == 'webgl':
+        data = _webgl_traces(df, max_points)
+    else:
+        data = _svg_traces(df)
+
+    # axis object
+    axis = dict(
+        showline=True,
+        zeroline=False,
+        showgrid=True,
+        ticklen=4,
+        gridcolor='#ffffff',
+        tickfont=dict(size=10),
+        linecolor='black',
+        linewidth=1
+    )
+
+    layout = dict(
+        width=950,
+        height=800,
+        autosize=True,
+        barmode='group',
+        margin={"l": 100, "r": 0, "t": 10, "b": 0, "pad": 0},
+        showlegend=True,
+        xaxis1=dict(axis, **dict(domain=[0, 1], anchor='y1', showticklabels=True,
+                                 ticktext=df.index,
+                                 tickvals=df.index,
+                                 tickangle=-45),
+                    rangeselector=dict(
+                        buttons=list([
+                            dict(count=1,
+                                 label="1m",
+                                 step="month",
+                                 stepmode="backward"),
+                            dict(count=3,
+                                 label="3m",
+                                 step="month",
+                                 stepmode="backward"),
+                            dict(count=6,
+                                 label="6m",
+                                 step="month",
+                                 stepmode="backward"),
+                            dict(count=1,
+                                 label="1yr",
+                                 step="year",
+                                 stepmode="backward"),
+                            dict(step="all")
+                        ])
+                    ),
+                    rangeslider=dict(
+                        visible=False,
+                        thickness=0.05
+                    ),
+                    type="date"),
+        yaxis1=dict(axis, **dict(domain=[0, 0.10], anchor='x1', title='New users<br>per source')),
+        yaxis2=dict(axis, **dict(domain=[0.12, 0.7], anchor='x1', title='New/Active/<br>Returning')),
+        yaxis3=dict(axis, **dict(domain=[0.705, 0.85], anchor='x1', hoverformat='.2f', ticksuffix='%',
+                                 title='Growth%')),
+        yaxis4=dict(axis, **dict(domain=[0.855, 1], anchor='x1', title='NR<br>Ratio')),
+        plot_bgcolor='rgba(228, 222, 239, 0.65)',
+        hovermode='closest'
+    )
+
+    # with hundreds of periods every tick label would be drawn; let plotly choose them instead
+    if render == 'webgl':
+        del layout['xaxis1']['ticktext'], layout['xaxis1']['tickvals']
+
+    return dict(data=data, layout=layout)
+
+
+def _svg_traces(df):
+    """
+    Bar and line traces of every stat, with the values as text on the bars.
+    """
     # new users
     new1 = go.Bar(
         x=df.index,
         y=df['New Users (Total)'].values,
         text=df['New Users (Total)'].values,
+        error_y=_error_y(df, 'New Users (Total)'),
         textposition='auto',
         marker=dict(
             color='rgb(0,0,204)'),
@@ -50,6 +168,7 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
         x=df.index,
         y=df['New Users (Total)'].values,
         text=df['New Users (Total)'].values,
+        error_y=_error_y(df, 'New Users (Total)'),
         textposition='auto',
         marker=dict(
             color='rgb(0,0,204)'),
@@ -63,6 +182,7 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
         x=df.index,
         y=df['New Organic Users'].values,
         text=df['New Organic Users'].values,
+        error_y=_error_y(df, 'New Organic Users'),
         textposition='auto',
         xaxis='x1',
         yaxis='y1',
@@ -76,6 +196,7 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
         x=df.index,
         y=df['New Paid Users'].values,
         text=df['New Paid Users'].values,
+        error_y=_error_y(df, 'New Paid Users'),
         textposition='auto',
         xaxis='x1',
         yaxis='y1',
@@ -89,6 +210,7 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
         x=df.index,
         y=df['Active Users'].values,
         text=df['Active Users'].values,
+        error_y=_error_y(df, 'Active Users'),
         textposition='auto',
         name='Active Users',
         xaxis='x1',
@@ -102,6 +224,7 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
         x=df.index,
         y=df['Returning Users'].values,
         text=df['Returning Users'].values,
+        error_y=_error_y(df, 'Returning Users'),
         textposition='auto',
         name='Returning Users',
         xaxis='x1',
@@ -132,66 +255,57 @@ def plot_users_per_period(events, acquisition_event_name, user_source_col, perio
             color='rgb(192,192,192)')
     )
 
-    # axis object
-    axis = dict(
-        showline=True,
-        zeroline=False,
-        showgrid=True,
-        ticklen=4,
-        gridcolor='#ffffff',
-        tickfont=dict(size=10),
-        linecolor='black',
-        linewidth=1
-    )
-
-    layout = dict(
-        width=950,
-        height=800,
-        autosize=True,
-        barmode='group',
-        margin={"l": 100, "r": 0, "t": 10, "b": 0, "pad": 0},
-        showlegend=True,
-        xaxis1=dict(axis, **dict(domain=[0, 1], anchor='y1', showticklabels=True,
-                                 ticktext=df.index,
-                                 tickvals=df.index,
-                                 tickangle=-45),
-                    rangeselector=dict(
-                        buttons=list([
-                            dict(count=1,
-                                 label="1m",
-                                 step="month",
-                                 stepmode="backward"),
-                            dict(count=3,
-                                 label="3m",
-                                 step="month",
-                                 stepmode="backward"),
-                            dict(count=6,
-                                 label="6m",
-                                 step="month",
-                                 stepmode="backward"),
-                            dict(count=1,
-                                 label="1yr",
-                                 step="year",
-                                 stepmode="backward"),
-                            dict(step="all")
-                        ])
-                    ),
-                    rangeslider=dict(
-                        visible=False,
-                        thickness=0.05
-                    ),
-                    type="date"),
-        yaxis1=dict(axis, **dict(domain=[0, 0.10], anchor='x1', title='New users<br>per source')),
-        yaxis2=dict(axis, **dict(domain=[0.12, 0.7], anchor='x1', title='New/Active/<br>Returning')),
-        yaxis3=dict(axis, **dict(domain=[0.705, 0.85], anchor='x1', hoverformat='.2f', title='Growth%')),
-        yaxis4=dict(axis, **dict(domain=[0.855, 1], anchor='x1', title='NR<br>Ratio')),
-        plot_bgcolor='rgba(228, 222, 239, 0.65)',
-        hovermode='closest'
-    )
-
-    data = [new1, organic, non_organic,
+    return [new1, organic, non_organic,
             new2, active, returning,
             growth,
             NR_ratio]
 
-    return dict(data=data, layout=layout)
+
+def _error_y(df, col, keep=None):
+    """
+    Error bars of a sampled user count, from the "<col>_low" and "<col>_high" confidence interval columns
+    returned by "stats.acquisition.users_per_period" with "sample"; None if the counts are exact.
+    """
+    if col + '_low' not in df.columns:
+        return None
+
+    y, low, high = (df[c].astype(float).values for c in [col, col + '_low', col + '_high'])
+    if keep is not None:
+        y, low, high = y[keep], low[keep], high[keep]
+
+    return dict(type='data', symmetric=False, array=high - y, arrayminus=y - low)
+
+
+def _webgl_trace(df, col, name, yaxis, color, max_points):
+    """
+    WebGL line trace of a single stat, downsampled to at most "max_points" points.
+    """
+    y = df[col].astype(float).values
+    keep = lttb_indices(y, max_points)
+
+    return go.Scattergl(
+        x=df.index[keep],
+        y=y[keep],
+        error_y=_error_y(df, col, keep),
+        mode='lines',
+        name=name,
+        xaxis='x1',
+        yaxis=yaxis,
+        line=dict(
+            color=color)
+    )
+
+
+def _webgl_traces(df, max_points):
+    """
+    WebGL line traces of every stat, used for long series where bars and per-bar text would be unreadable
+    and slow to render.
+    """
+    return [_webgl_trace(df, 'New Users (Total)', 'New Users(Total)', 'y1', 'rgb(0,0,204)', max_points),
+            _webgl_trace(df, 'New Organic Users', 'New Organic Users', 'y1', 'rgb(58,193,0)', max_points),
+            _webgl_trace(df, 'New Paid Users', 'New Paid Users', 'y1', 'rgb(255,0,0)', max_points),
+            _webgl_trace(df, 'New Users (Total)', 'New Users(Total)', 'y2', 'rgb(0,0,204)', max_points),
+            _webgl_trace(df, 'Active Users', 'Active Users', 'y2', 'rgb(153,0,76)', max_points),
+            _webgl_trace(df, 'Returning Users', 'Returning Users', 'y2', 'rgb(255,128,0)', max_points),
+            _webgl_trace(df, 'W/W Growth', 'W/W Growth', 'y3', 'rgb(0,153,153)', max_points),
+            _webgl_trace(df, 'N/R Ratio', 'N/R Ratio', 'y4', 'rgb(192,192,192)', max_points)]
@@ -0,0 +1,54 @@
+"""
+    Helpers used by the plotting functions to keep large figures responsive: thresholds above which the plots
+    switch to their scalable render mode and server-side downsampling of long series.
+"""
+import numpy as np
+
+# series longer than this are drawn with WebGL traces and downsampled to this many points
+MAX_POINTS = 500
+# tables with more cells than this are drawn without per-cell annotations
+MAX_ANNOTATED_CELLS = 400
+# retention tables with more cohorts than this are drawn as a plotly heatmap instead of matplotlib
+MAX_MATPLOTLIB_ROWS = 60
+
+
+def lttb_indices(y, n_out):
+    """
+    Function used to downsample a series with the Largest-Triangle-Three-Buckets algorithm, which keeps the
+    visual shape of the series (peaks and troughs) unlike taking every n-th point.
+    Points are assumed to be equally spaced, as the periods of the stats are.
+
+    :param y: (array)
+                    values of the series; NaN values are treated as 0 when choosing the points
+
+    :param n_out: (int)
+                    number of points to keep
+
+    :return: (np.array)
+                    sorted positions of the points to keep, always including the first and the last one
+    """
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=np.float64)
+    # edges of the n_out - 2 buckets between the first and the last point
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.int64), n)
+
+    indices = np.zeros(n_out, dtype=np.int64)
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average point of the next bucket (the last point for the last bucket)
+        avg_x = x[end:edges[i + 2]].mean()
+        avg_y = y[end:edges[i + 2]].mean()
+
+        # keep the point forming the largest triangle with the previously kept point and the next average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + area.argmax()
+        indices[i + 1] = a
+
+    indices[-1] = n - 1
+
+    return indices
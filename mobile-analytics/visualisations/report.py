@@ -0,0 +1,322 @@
+"""
+    Batch report generation: every (metric, segment, period) figure of a report spec is computed, rendered
+    and exported to HTML/PNG in one call.
+
+    The stats of each segment are planned together with "stats.analysis.Analysis", so the events are sorted once
+    and the cohorts and groupbys are shared between the metrics and periods of the segment. Building and
+    exporting the figures, which takes most of the time, is then spread over a process pool.
+    "compute_report_stats" computes the stats alone, e.g. to serve them with "visualisations.server".
+
+    Example spec:
+        spec = {'metrics': ['growth', 'retention', 'funnel', 'funnel_trend', 'sankey'],
+                'periods': ['w', 'm'],
+                'segment_col': 'country',                 # optional, only the "All" segment if missing;
+                                                          # taken from the acquisition event of each user
+                'segments': ['UK', 'US'],                 # optional, every value of "segment_col" if missing
+                'acquisition_event_name': 'Install',      # growth, retention and "segment_col"
+                'user_source_col': 'user_source',         # growth
+                'steps': ['Install', 'SignUp', 'Purchase'],   # funnel and funnel_trend
+                'starting_step': 'Install',               # sankey, with optional 'n_steps' and 'events_per_step'
+                }
+"""
+import os
+import re
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from plotly import graph_objs as go
+from plotly import io as pio
+from stats.acquisition import acquisition_segments
+from stats.analysis import Analysis
+from visualisations.growth import users_per_period_figure
+from visualisations.retention_plots import retention_figure
+from visualisations.funnel_plots import stacked_funnel_figure, funnel_trend_figure
+from visualisations.user_journey_plots import user_flow_figure
+
+# metrics computed once per period and the periods each of them supports
+PERIOD_METRICS = {'growth': ['d', 'w', 'm'],
+                  'retention': ['w', 'm'],
+                  'funnel_trend': ['d', 'w', 'm']}
+# metrics computed once per segment
+SEGMENT_METRICS = ['funnel', 'sankey']
+
+# spec keys needed by each metric
+REQUIRED_KEYS = {'growth': ['acquisition_event_name', 'user_source_col'],
+                 'retention': ['acquisition_event_name'],
+                 'funnel_trend': ['steps'],
+                 'funnel': ['steps'],
+                 'sankey': ['starting_step']}
+
+# name of the segment with all the users
+TOTAL_SEGMENT = 'All'
+
+
+def check_spec(spec):
+    """
+    Function used to validate a report spec.
+
+    :param spec: (dict)
+                    report spec (see the module docstring)
+    """
+    if not isinstance(spec, dict):
+        raise TypeError('"spec" should be a dict')
+
+    metrics = spec.get('metrics', [])
+    assert isinstance(metrics, list) and metrics, '"metrics" should be a non-empty list'
+    for metric in metrics:
+        assert metric in PERIOD_METRICS or metric in SEGMENT_METRICS, \
+            '"{}" is not a valid metric; use one of {}'.format(metric, list(PERIOD_METRICS) + SEGMENT_METRICS)
+        for key in REQUIRED_KEYS[metric]:
+            assert key in spec, '"{}" should be in the spec for the "{}" metric'.format(key, metric)
+
+    if spec.get('segment_col'):
+        assert 'acquisition_event_name' in spec, \
+            '"acquisition_event_name" should be in the spec to assign the users to the segments of "segment_col"'
+
+    for period in spec.get('periods', ['w']):
+        assert period in ['d', 'w', 'm'], '"periods" should only contain "d", "w" or "m"'
+
+
+def report_figures(spec):
+    """
+    Function used to list the (metric, period) figures of each segment of a report spec.
+
+    :param spec: (dict)
+                    report spec
+
+    :return: (list)
+                    (metric, period) pairs; period is None for metrics that do not depend on it
+    """
+    figures = []
+    for metric in spec['metrics']:
+        if metric in PERIOD_METRICS:
+            figures += [(metric, period) for period in spec.get('periods', ['w'])
+                        if period in PERIOD_METRICS[metric]]
+        else:
+            figures.append((metric, None))
+
+    return figures
+
+
+def _segments(events, spec):
+    """
+    Events of each segment, keyed by segment name. Each user belongs to the segment of his/her acquisition event,
+    as in the segmented retention tables (see "stats.acquisition.acquisition_segments"), so users that were never
+    acquired are only in the "All" segment. "events" should already be sorted by ("distinct_id", "time").
+    """
+    segments = {TOTAL_SEGMENT: events}
+
+    segment_col = spec.get('segment_col')
+    if not segment_col:
+        return segments
+
+    user_segment = acquisition_segments(events, spec['acquisition_event_name'], segment_col)
+    event_segment = events['distinct_id'].map(user_segment)
+
+    values = spec.get('segments')
+    if values is None:
+        values = user_segment.unique().tolist()
+
+    # split the events of all the segments in one pass; the sort order is kept within each group
+    groups = events.groupby(event_segment.values, sort=False).indices
+    for value in values:
+        if value in groups:
+            segments[value] = events.iloc[groups[value]]
+
+    return segments
+
+
+def _record(analysis, metric, period, spec):
+    """
+    Record the request of a figure in the segment's analysis and return its position.
+    """
+    if metric == 'growth':
+        return analysis.users_per_period(spec['acquisition_event_name'], spec['user_source_col'], period=period,
+                                         numeric=True)
+    elif metric == 'retention':
+        return analysis.retention_table(spec['acquisition_event_name'], period=period)
+    elif metric == 'funnel_trend':
+        return analysis.funnel_trend_df(spec['steps'], period=period)
+    elif metric == 'funnel':
+        return analysis.create_funnel_df(spec['steps'])
+
+    return analysis.sankey_df(spec['starting_step'], n_steps=spec.get('n_steps', 3),
+                              events_per_step=spec.get('events_per_step', 5))
+
+
+def build_figure(metric, result, spec, title=None):
+    """
+    Function used to build the figure of a metric from its stats.
+
+    :param metric: (str)
+                    one of the report metrics
+
+    :param result: (DataFrame/tuple)
+                    stats of the metric, as returned by "stats.analysis.Analysis"
+
+    :param spec: (dict)
+                    report spec
+
+    :param title: (str)
+                    title of the plot, if the figure has one
+
+    :return: (go.Figure)
+    """
+    if metric == 'growth':
+        figure = users_per_period_figure(result, render=spec.get('render', 'auto'))
+    elif metric == 'retention':
+        figure = retention_figure(result[1], type='perc')
+    elif metric == 'funnel_trend':
+        figure = funnel_trend_figure(result)
+    elif metric == 'funnel':
+        figure = stacked_funnel_figure({TOTAL_SEGMENT: result})
+    else:
+        label_list, colors_list, source_target_df = result
+        figure = user_flow_figure(label_list, colors_list, source_target_df, n_steps=spec.get('n_steps', 3))
+
+    figure = go.Figure(figure)
+    if title:
+        figure.update_layout(title=title)
+
+    return figure
+
+
+def _render(task):
+    """
+    Build and export a single figure; run in the worker processes.
+    """
+    name, title, metric, result, spec, paths = task
+
+    start = time.time()
+    figure = build_figure(metric, result, spec, title=title)
+    render_time = time.time() - start
+
+    start = time.time()
+    for path in paths:
+        if path.endswith('.html'):
+            pio.write_html(figure, path, include_plotlyjs='cdn', auto_open=False)
+        else:
+            pio.write_image(figure, path)
+    export_time = time.time() - start
+
+    return name, render_time, export_time
+
+
+def _file_name(*parts):
+    return re.sub(r'[^\w\-]+', '_', '_'.join(str(part) for part in parts if part is not None))
+
+
+def compute_report_stats(events, spec, presorted=False):
+    """
+    Function used to compute the stats of every figure of a report spec, without building the figures.
+
+    :param events: (DataFrame)
+                    events dataframe
+
+    :param spec: (dict)
+                    report spec: metrics x segments x periods (see the module docstring)
+
+    :param presorted: (bool)
+                    True if events are already sorted by ("distinct_id", "time")
+
+    :return: (dict)
+                    figure name -> dict with its 'segment', 'metric', 'period', 'title', the stats as returned by
+                    "stats.analysis.Analysis" ('result') and the time spent computing the stats of its segment
+                    ('compute_time', shared by all the figures of the segment). The growth and retention figures
+                    of segments without any acquisition event are skipped with a warning.
+    """
+    if not isinstance(events, pd.DataFrame):
+        raise TypeError('"events" should be a pandas dataframe')
+    check_spec(spec)
+
+    # sort once; every segment keeps the order, so their analyses can skip sorting
+    if not presorted:
+        events = events.sort_values(['distinct_id', 'time'], kind='mergesort')
+
+    figures = report_figures(spec)
+    # figures that cannot be calculated for a segment without any acquired user
+    acquisition_figures = [(metric, period) for metric, period in figures
+                           if 'acquisition_event_name' in REQUIRED_KEYS[metric]]
+
+    stats = {}
+    for segment, segment_events in _segments(events, spec).items():
+        segment_figures = figures
+        if acquisition_figures and not (segment_events['name'] == spec['acquisition_event_name']).any():
+            warnings.warn('segment "{}" has no "{}" event; skipping its {} figures'.format(
+                segment, spec['acquisition_event_name'], ', '.join(sorted({m for m, _ in acquisition_figures}))))
+            segment_figures = [figure for figure in figures if figure not in acquisition_figures]
+            if not segment_figures:
+                continue
+
+        start = time.time()
+        analysis = Analysis(segment_events, presorted=True)
+        positions = [_record(analysis, metric, period, spec) for metric, period in segment_figures]
+        results = analysis.run()
+        compute_time = time.time() - start
+
+        for (metric, period), position in zip(segment_figures, positions):
+            stats[_file_name(segment, metric, period)] = {
+                'segment': segment, 'metric': metric, 'period': period,
+                'title': '{} - {}{}'.format(segment, metric, ' ({})'.format(period) if period else ''),
+                'result': results[position], 'compute_time': compute_time}
+
+    return stats
+
+
+def generate_report(events, spec, output_dir, formats=('html',), max_workers=None, presorted=False):
+    """
+    Function used to compute, render and export all the figures of a report spec.
+
+    :param events: (DataFrame)
+                    events dataframe
+
+    :param spec: (dict)
+                    report spec: metrics x segments x periods (see the module docstring)
+
+    :param output_dir: (str)
+                    directory where the figures are exported; created if it does not exist
+
+    :param formats: (tuple)
+                    file formats to export each figure to: "html" and/or image formats supported by
+                    "plotly.io.write_image" (e.g. "png", which needs the plotly image export engine)
+
+    :param max_workers: (int)
+                    number of processes used to render and export the figures; 1 renders them serially in
+                    this process. Defaults to the number of CPUs.
+
+    :param presorted: (bool)
+                    True if events are already sorted by ("distinct_id", "time")
+
+    :return: (DataFrame)
+                    one row per figure, indexed by figure name, with its segment, metric, period, the time spent
+                    computing the stats of its segment (shared by all the figures of the segment), the time spent
+                    building and exporting it (in seconds) and the exported files
+    """
+    stats = compute_report_stats(events, spec, presorted=presorted)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    rows = {}
+    for name, figure in stats.items():
+        paths = [os.path.join(output_dir, '{}.{}'.format(name, file_format)) for file_format in formats]
+        tasks.append((name, figure['title'], figure['metric'], figure['result'], spec, paths))
+        rows[name] = {'segment': figure['segment'], 'metric': figure['metric'], 'period': figure['period'],
+                      'compute_time': figure['compute_time'], 'files': paths}
+
+    # building and exporting the figures is independent for each figure
+    if max_workers == 1:
+        rendered = map(_render, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rendered = list(executor.map(_render, tasks))
+
+    for name, render_time, export_time in rendered:
+        rows[name].update(render_time=render_time, export_time=export_time)
+
+    timings = pd.DataFrame.from_dict(rows, orient='index')[['segment', 'metric', 'period', 'compute_time',
+                                                            'render_time', 'export_time', 'files']]
+    timings.index.name = 'figure'
+
+    return timings
@@ -1,8 +1,11 @@
+import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
+from plotly import graph_objs as go
+from visualisations.render import MAX_ANNOTATED_CELLS, MAX_MATPLOTLIB_ROWS
 
 
-def retention_heatmap(df, figsize=(12, 6), type='val'):
+def retention_heatmap(df, figsize=(12, 6), type='val', annot='auto', engine='auto', interval=None):
     """
     Function used to plot retention heatmaps.
 
@@ -15,8 +18,32 @@ def retention_heatmap(df, figsize=(12, 6), type='val'):
     :param type: (str)
                     either "val" or "perc"
 
+    :param annot: (bool/str)
+                    True to write the value in each cell; "auto" to do so only for tables of up to
+                    "visualisations.render.MAX_ANNOTATED_CELLS" cells
+
+    :param engine: (str)
+                    "matplotlib", "plotly" or "auto" to use plotly only for tables with more than
+                    "visualisations.render.MAX_MATPLOTLIB_ROWS" cohorts (e.g. daily cohorts)
+
+    :param interval: (tuple)
+                    (lower, upper) confidence interval tables of sampled percentages, as returned by
+                    "stats.retention.retention_intervals"; written under each annotated value
+
     :return:
     """
+    assert engine in ['auto', 'matplotlib', 'plotly'], '"engine" should be either "auto", "matplotlib" or "plotly"'
+
+    # one text artist per cell is what makes large heatmaps slow to draw
+    if annot == 'auto':
+        annot = bool(df.size <= MAX_ANNOTATED_CELLS)
+
+    if engine == 'auto':
+        engine = 'plotly' if df.shape[0] > MAX_MATPLOTLIB_ROWS else 'matplotlib'
+
+    if engine == 'plotly':
+        return retention_figure(df, figsize=figsize, type=type, annot=annot, interval=interval)
+
     sns.set()
 
     # used to set the number format (values vs percentages)
@@ -25,10 +52,15 @@ def retention_heatmap(df, figsize=(12, 6), type='val'):
     else:
         values_fmt = '.0%'
 
+    # annotate each cell with its value and confidence interval
+    if annot and interval is not None:
+        annot = _interval_labels(df, interval, values_fmt)
+        values_fmt = ''
+
     plt.figure(figsize=figsize)
     h = sns.heatmap(df,
                     cmap='Blues',
-                    annot=True,
+                    annot=annot,
                     yticklabels=list(zip(df.index.get_level_values(0).strftime('%Y-%m-%d').values,
                                          df.index.get_level_values(1))),
                     annot_kws={'fontsize': 14},
@@ -41,3 +73,156 @@ def retention_heatmap(df, figsize=(12, 6), type='val'):
     plt.show()
 
     return h
+
+
+def _interval_labels(df, interval, values_fmt):
+    """
+    Cell labels with the value and its confidence interval, empty for the cells without a value.
+    """
+    low, high = (bound.values for bound in interval)
+    labels = np.full(df.shape, '', dtype=object)
+    rows, cols = np.nonzero(~np.isnan(df.values))
+    for row, col in zip(rows, cols):
+        labels[row, col] = '{}\n({}-{})'.format(format(df.values[row, col], values_fmt),
+                                                 format(low[row, col], values_fmt), format(high[row, col], values_fmt))
+
+    return labels
+
+
+def retention_figure(df, figsize=(12, 6), type='val', annot=False, interval=None):
+    """
+    Function used to build the plotly version of "retention_heatmap". The whole table is passed as a single
+    numeric array and drawn by the browser, so it stays responsive for hundreds of cohorts.
+
+    :param df: (dataframe)
+                dataframe resembling the retention table
+
+    :param figsize: (tuple)
+                    (width, height) in inches, converted at 80 pixels per inch
+
+    :param type: (str)
+                    either "val" or "perc"
+
+    :param annot: (bool)
+                    write the value in each cell
+
+    :param interval: (tuple)
+                    (lower, upper) confidence interval tables of sampled percentages, as returned by
+                    "stats.retention.retention_intervals"; shown on hover
+
+    :return: (go.Figure)
+    """
+    cohorts = df.index.get_level_values(0).strftime('%Y-%m-%d')
+    labels = ['{} ({})'.format(cohort, size) for cohort, size in zip(cohorts, df.index.get_level_values(1))]
+    values_fmt = '.0f' if type == 'val' else '.0%'
+
+    hovertemplate = 'Cohort: %{y}<br>Cohort Period: %{x}<br>%{z:' + values_fmt + '}'
+    customdata = None
+    if interval is not None:
+        customdata = np.dstack([bound.values for bound in interval])
+        hovertemplate += ' (95% CI %{customdata[0]:' + values_fmt + '}-%{customdata[1]:' + values_fmt + '})'
+
+    heatmap = go.Heatmap(
+        z=df.values,
+        x=df.columns.values,
+        y=labels,
+        customdata=customdata,
+        colorscale='Blues',
+        zmin=0,
+        zmax=1 if type != 'val' else None,
+        colorbar=dict(tickformat=values_fmt),
+        hovertemplate=hovertemplate + '<extra></extra>'
+    )
+
+    layout = go.Layout(width=figsize[0] * 80,
+                       height=max(figsize[1] * 80, len(df) * 4),
+                       title='Retention',
+                       xaxis=dict(title='Cohort Period', side='bottom'),
+                       yaxis=dict(title='(Cohort, Cohort Size)', autorange='reversed'),
+                       margin={"l": 160, "r": 0, "t": 40, "b": 40, "pad": 0})
+
+    fig = go.Figure([heatmap], layout)
+
+    # one annotation per cell, so only used when explicitly requested or for small tables
+    if annot:
+        rows, cols = np.nonzero(~np.isnan(df.values))
+        fig.update_layout(annotations=[dict(x=df.columns[col], y=labels[row], showarrow=False,
+                                            text=format(df.values[row, col], values_fmt), font=dict(size=10))
+                                       for row, col in zip(rows, cols)])
+
+    return fig
+
+
+def retention_facets(df, col_wrap=3, figsize=None, type='val', annot=False):
+    """
+    Function used to plot one retention heatmap per segment, as returned by
+    "stats.retention.retention_table" with "segment_col".
+    All the facets share the same colour scale so that segments can be compared.
+
+    :param df: (dataframe)
+                dataframe resembling the segmented retention table, indexed by (segment, cohort, size)
+
+    :param col_wrap: (int)
+                    number of facets per row
+
+    :param figsize: (tuple)
+                    (width, height); defaults to 6x4 inches per facet
+
+    :param type: (str)
+                    either "val" or "perc"
+
+    :param annot: (bool)
+                    write the value in each cell
+
+    :return: (plt.figure)
+    """
+    assert df.index.nlevels == 3, '"df" should be indexed by (segment, cohort, size)'
+
+    sns.set()
+
+    # used to set the number format (values vs percentages)
+    if type == 'val':
+        values_fmt = '.0f'
+    else:
+        values_fmt = '.0%'
+
+    segments = df.index.get_level_values(0).unique()
+    n_cols = min(col_wrap, len(segments))
+    n_rows = -(-len(segments) // n_cols)
+    if figsize is None:
+        figsize = (6 * n_cols, 4 * n_rows)
+
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=figsize, squeeze=False, constrained_layout=True)
+    vmin, vmax = df.min().min(), df.max().max()
+
+    for i, (ax, segment) in enumerate(zip(axes.flat, segments)):
+        segment_df = df.loc[segment]
+        cohorts = segment_df.index.get_level_values(0)
+        # monthly periods are labelled by their first day, like the other periods
+        if hasattr(cohorts, 'start_time'):
+            cohorts = cohorts.start_time
+
+        # all segments share the same cohorts, so only the first column shows them
+        first_col = i % n_cols == 0
+        sns.heatmap(segment_df,
+                    cmap='Blues',
+                    annot=annot,
+                    fmt=values_fmt,
+                    vmin=vmin,
+                    vmax=vmax,
+                    cbar=False,
+                    yticklabels=list(cohorts.strftime('%Y-%m-%d')) if first_col else False,
+                    ax=ax)
+        ax.set_title('{} ({} users)'.format(segment, segment_df.index.get_level_values(1).values.sum()), fontsize=14)
+        ax.set_xlabel('Cohort Period')
+        ax.set_ylabel('Cohort' if first_col else '')
+
+    # hide the unused facets of the last row
+    for ax in axes.flat[len(segments):]:
+        ax.set_visible(False)
+
+    fig.colorbar(axes.flat[0].collections[0], ax=axes.ravel().tolist())
+    fig.suptitle('Retention per {}'.format(df.index.names[0]), fontsize=20)
+    plt.show()
+
+    return fig
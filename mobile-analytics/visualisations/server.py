@@ -0,0 +1,443 @@
+"""
+    Local HTTP/JSON service answering the stats and figures of a report spec (see "visualisations.report")
+    from precomputed responses, so that looking up the same numbers never recomputes them.
+
+    A background worker computes all the stats of the spec with "visualisations.report.compute_report_stats",
+    builds each figure and serialises every response to JSON once. Requests only look up these responses: while
+    a refresh is running the previous ones keep being served (flagged as stale once older than the refresh
+    interval) and they are all swapped at once when the refresh is done.
+
+    Endpoints:
+        GET  /health                status of the service and of the last refresh
+        GET  /metrics               available figures with their segment, metric and period
+        GET  /metrics/<name>        stats of a figure, as "split" oriented tables
+        GET  /figures/<name>        plotly figure dict of a figure
+        GET  /stats                 request latency per endpoint, cache hit rates and refresh timings
+        POST /refresh               start a refresh in the background
+
+    Every "/metrics/<name>" and "/figures/<name>" response has an "X-Cache" header ("HIT" or "STALE") and an
+    "Age" header with the seconds since its refresh.
+
+    Example:
+        service = MetricsService(lambda: EventStore('/data/events_store').to_frame(), spec, refresh_interval=600)
+        server = serve(service, port=8050)      # returns once the server listens on http://127.0.0.1:8050
+        ...
+        server.shutdown()
+        server.server_close()
+        service.stop()
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from plotly import io as pio
+from visualisations.report import check_spec, compute_report_stats, build_figure
+
+# number of latest requests per endpoint kept for the latency percentiles
+LATENCY_WINDOW = 1000
+
+
+def _table(df):
+    """
+    "split" oriented dict of a table, with periods written as strings and timestamps in ISO format.
+    """
+    index = df.index
+    if isinstance(index, pd.MultiIndex):
+        index = index.set_levels([level.astype(str) if isinstance(level, pd.PeriodIndex) else level
+                                  for level in index.levels])
+    elif isinstance(index, pd.PeriodIndex):
+        index = index.astype(str)
+
+    if index is not df.index:
+        df = df.copy()
+        df.index = index
+
+    return json.loads(df.to_json(orient='split', date_format='iso'))
+
+
+def stats_payload(metric, result):
+    """
+    Function used to convert the stats of a report metric to a JSON serialisable dict.
+
+    :param metric: (str)
+                    one of the report metrics
+
+    :param result: (DataFrame/tuple)
+                    stats of the metric, as returned by "stats.analysis.Analysis"
+
+    :return: (dict)
+                    "split" oriented tables of the stats: 'table' for a single table, 'counts' and 'percentages'
+                    for retention, 'labels', 'colors' and 'links' for sankey
+    """
+    if metric == 'retention':
+        counts, percentages = result
+        return {'counts': _table(counts), 'percentages': _table(percentages)}
+    elif metric == 'sankey':
+        label_list, colors_list, source_target_df = result
+        return {'labels': list(label_list), 'colors': list(colors_list), 'links': _table(source_target_df)}
+
+    return {'table': _table(result)}
+
+
+def _dumps(payload):
+    return json.dumps(payload, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+
+
+class MetricsService(object):
+    """
+    Precomputed stats and figures of a report spec, refreshed on a schedule by a background worker.
+
+    :param load_events: (callable)
+                    function without arguments returning the events dataframe; called on every refresh so that
+                    new events are picked up, e.g. reopening an "stats.event_store.EventStore"
+
+    :param spec: (dict)
+                    report spec: metrics x segments x periods (see "visualisations.report")
+
+    :param refresh_interval: (float)
+                    seconds between the start of two scheduled refreshes; responses older than this are stale
+
+    :param figures: (bool)
+                    True to also precompute the figures; only the stats are served otherwise
+
+    :param presorted: (bool)
+                    True if the loaded events are already sorted by ("distinct_id", "time")
+    """
+
+    def __init__(self, load_events, spec, refresh_interval=3600, figures=True, presorted=False):
+        assert callable(load_events), '"load_events" should be a function returning the events dataframe'
+        assert refresh_interval > 0, '"refresh_interval" should be positive'
+        check_spec(spec)
+
+        self.load_events = load_events
+        self.spec = spec
+        self.refresh_interval = refresh_interval
+        self.figures = figures
+        self.presorted = presorted
+
+        # name -> precomputed response; replaced as a whole by every refresh
+        self._responses = {}
+        self._refreshed_at = None
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._refresh_stats = {'refreshes': 0, 'failures': 0, 'last_duration': None, 'last_error': None}
+
+        self._latencies = {}
+        self._cache = {'hits': 0, 'stale': 0, 'misses': 0}
+
+        self._worker = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """
+        Function used to start the background worker, which refreshes the responses right away and then
+        every "refresh_interval" seconds.
+
+        :return: (MetricsService)
+                    self, to allow chaining
+        """
+        assert self._worker is None, 'the service is already started'
+
+        self._stopped.clear()
+        self._worker = threading.Thread(target=self._run, name='metrics-refresh', daemon=True)
+        self._worker.start()
+
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Function used to stop the background worker; a refresh in progress is finished first.
+
+        :param timeout: (float)
+                    maximum number of seconds to wait for the worker; no limit if None
+        """
+        if self._worker is None:
+            return
+
+        self._stopped.set()
+        self._wake.set()
+        self._worker.join(timeout)
+        self._worker = None
+
+        # a refresh requested while stopping will not run
+        with self._lock:
+            self._refreshing = False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            start = time.time()
+            self.refresh()
+            self._wake.wait(max(0, self.refresh_interval - (time.time() - start)))
+            self._wake.clear()
+
+    def request_refresh(self):
+        """
+        Function used to ask the background worker for a refresh now, unless one is already running.
+
+        :return: (bool)
+                    True if a refresh was requested
+        """
+        assert self._worker is not None, 'the service should be started first'
+
+        # checked and set at once, so that concurrent requests start a single refresh; the requested refresh
+        # counts as running until it is done
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+
+        self._wake.set()
+        return True
+
+    def refresh(self):
+        """
+        Function used to recompute every response in the calling thread. The previous responses are served
+        until the new ones are all ready, and kept if the refresh fails.
+
+        :return: (bool)
+                    True if the refresh succeeded
+        """
+        with self._refresh_lock:
+            with self._lock:
+                self._refreshing = True
+            start = time.time()
+            try:
+                stats = compute_report_stats(self.load_events(), self.spec, presorted=self.presorted)
+
+                responses = {}
+                for name, figure in stats.items():
+                    responses[name] = {
+                        'segment': figure['segment'], 'metric': figure['metric'], 'period': figure['period'],
+                        'stats': _dumps(stats_payload(figure['metric'], figure['result'])).encode(),
+                        'figure': pio.to_json(build_figure(figure['metric'], figure['result'], self.spec,
+                                                           title=figure['title'])).encode()
+                        if self.figures else None}
+            except Exception as error:
+                with self._lock:
+                    self._refreshing = False
+                    self._refresh_stats['failures'] += 1
+                    self._refresh_stats['last_error'] = '{}: {}'.format(type(error).__name__, error)
+                return False
+            except BaseException:
+                with self._lock:
+                    self._refreshing = False
+                raise
+
+            # cleared with the swap, so that a refresh is never seen as done while the previous responses are served
+            with self._lock:
+                self._refreshing = False
+                self._responses = responses
+                self._refreshed_at = time.time()
+                self._refresh_stats.update(refreshes=self._refresh_stats['refreshes'] + 1,
+                                           last_duration=self._refreshed_at - start, last_error=None)
+
+        return True
+
+    def lookup(self, kind, name):
+        """
+        Function used to get a precomputed response.
+
+        :param kind: (str)
+                    "stats" or "figure"
+
+        :param name: (str)
+                    figure name, as listed by "names"
+
+        :return: (tuple)
+                    the JSON response as bytes (None if it is not available) and its cache status: "hit",
+                    "stale" (older than "refresh_interval"), "miss" (not computed yet) or "unknown" (no such
+                    figure, or figures are not precomputed). Both of the latter count as cache misses.
+        """
+        assert kind in ['stats', 'figure'], '"kind" should be either "stats" or "figure"'
+
+        with self._lock:
+            if self._refreshed_at is None:
+                self._cache['misses'] += 1
+                return None, 'miss'
+
+            response = self._responses.get(name)
+            if response is None or response[kind] is None:
+                self._cache['misses'] += 1
+                return None, 'unknown'
+
+            status = 'stale' if self.age() > self.refresh_interval else 'hit'
+            self._cache['hits' if status == 'hit' else 'stale'] += 1
+
+        return response[kind], status
+
+    def names(self):
+        """
+        Function used to list the available figures.
+
+        :return: (dict)
+                    figure name -> dict with its 'segment', 'metric' and 'period'
+        """
+        with self._lock:
+            return {name: {key: response[key] for key in ('segment', 'metric', 'period')}
+                    for name, response in self._responses.items()}
+
+    def age(self):
+        """
+        (float) seconds since the last successful refresh; None before the first one
+        """
+        return time.time() - self._refreshed_at if self._refreshed_at is not None else None
+
+    def record_latency(self, endpoint, seconds):
+        """
+        Function used to record the latency of a request.
+
+        :param endpoint: (str)
+                    endpoint pattern, e.g. "/metrics/<name>"
+
+        :param seconds: (float)
+                    time spent answering the request
+        """
+        with self._lock:
+            if endpoint not in self._latencies:
+                self._latencies[endpoint] = {'count': 0, 'window': deque(maxlen=LATENCY_WINDOW)}
+            self._latencies[endpoint]['count'] += 1
+            self._latencies[endpoint]['window'].append(seconds)
+
+    def stats(self):
+        """
+        Function used to get the service stats.
+
+        :return: (dict)
+                    'requests': count and latency (mean, p50, p95 and max in ms over the latest requests) per
+                    endpoint; 'cache': hits, stale hits, misses (before the first refresh or of unknown
+                    figures) and the hit rate of the figure lookups;
+                    'refresh': refresh counts, duration and error, age of the responses and whether a refresh
+                    is running
+        """
+        with self._lock:
+            requests = {}
+            for endpoint, latencies in self._latencies.items():
+                window = np.array(latencies['window']) * 1000
+                requests[endpoint] = {'count': latencies['count'],
+                                      'mean_ms': window.mean(),
+                                      'p50_ms': np.percentile(window, 50),
+                                      'p95_ms': np.percentile(window, 95),
+                                      'max_ms': window.max()}
+
+            cache = dict(self._cache)
+            lookups = sum(cache.values())
+            cache['hit_rate'] = (cache['hits'] + cache['stale']) / lookups if lookups else None
+
+            refresh = dict(self._refresh_stats, refreshing=self._refreshing, age=self.age(),
+                           interval=self.refresh_interval)
+
+        return {'requests': requests, 'cache': cache, 'refresh': refresh}
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler answering the endpoints of the module docstring from "service".
+    """
+
+    service = None
+
+    def log_message(self, format, *args):
+        # requests are accounted for in the service stats instead of being logged to stderr
+        pass
+
+    def _send(self, status, body, headers=None):
+        if not isinstance(body, bytes):
+            body = _dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_response(self, kind, name):
+        body, status = self.service.lookup(kind, name)
+
+        if status == 'miss':
+            self._send(503, {'error': 'the first refresh is not done yet'}, {'Retry-After': '1'})
+        elif status == 'unknown':
+            self._send(404, {'error': 'no {} for "{}"'.format(kind, name)})
+        else:
+            self._send(200, body, {'X-Cache': status.upper(), 'Age': str(int(self.service.age()))})
+
+    def do_GET(self):
+        start = time.time()
+        path = self.path.split('?')[0].rstrip('/')
+        parts = path.split('/')
+
+        if path == '/health':
+            endpoint = path
+            refresh = self.service.stats()['refresh']
+            self._send(200, {'status': 'ok' if refresh['age'] is not None else 'starting',
+                             'refreshing': refresh['refreshing'], 'age': refresh['age'],
+                             'last_error': refresh['last_error']})
+        elif path == '/metrics':
+            endpoint = path
+            self._send(200, self.service.names())
+        elif len(parts) == 3 and parts[1] == 'metrics':
+            endpoint = '/metrics/<name>'
+            self._send_response('stats', parts[2])
+        elif len(parts) == 3 and parts[1] == 'figures':
+            endpoint = '/figures/<name>'
+            self._send_response('figure', parts[2])
+        elif path == '/stats':
+            endpoint = path
+            self._send(200, self.service.stats())
+        else:
+            endpoint = None
+            self._send(404, {'error': 'unknown endpoint "{}"'.format(path)})
+
+        if endpoint is not None:
+            self.service.record_latency(endpoint, time.time() - start)
+
+    def do_POST(self):
+        start = time.time()
+        path = self.path.split('?')[0].rstrip('/')
+
+        if path == '/refresh':
+            self._send(202, {'requested': self.service.request_refresh()})
+            self.service.record_latency(path, time.time() - start)
+        else:
+            self._send(404, {'error': 'unknown endpoint "{}"'.format(path)})
+
+
+def serve(service, host='127.0.0.1', port=8050, start=True):
+    """
+    Function used to serve a metrics service over HTTP from a background thread.
+
+    :param service: (MetricsService)
+                    service answering the requests
+
+    :param host: (str)
+                    address to listen on; the default only accepts local connections
+
+    :param port: (int)
+                    port to listen on; 0 picks a free port, available as "server.server_address[1]"
+
+    :param start: (bool)
+                    True to also start the background worker of the service if it is not running
+
+    :return: (ThreadingHTTPServer)
+                    running server; stop it with "server.shutdown()" and "server.server_close()"
+    """
+    if not isinstance(service, MetricsService):
+        raise TypeError('"service" should be a MetricsService')
+
+    if start and service._worker is None:
+        service.start()
+
+    handler = type('Handler', (MetricsRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+
+    return server
@@ -1,7 +1,7 @@
 from stats.user_journey import sankey_df
 
 
-def plot_user_flow(events, starting_step, n_steps=3, events_per_step=5, title='Sankey Diagram'):
+def plot_user_flow(events, starting_step, n_steps=3, events_per_step=5, title='Sankey Diagram', sample=None):
     """
     Function used to generate the sankey plot for user journeys.
 
@@ -21,10 +21,45 @@ def plot_user_flow(events, starting_step, n_steps=3, events_per_step=5, title='S
     :param title: (str)
                     Title for the plot
 
+    :param sample: (float)
+                    fraction of users to keep for a fast preview (see "stats.sampling"). All users if None.
+
     :return: (plotly fig)
     """
     # transform raw events dataframe into  source:target pairs including node ids and count of each combination
-    label_list, colors_list, source_target_df = sankey_df(events, starting_step, n_steps, events_per_step)
+    label_list, colors_list, source_target_df = sankey_df(events, starting_step, n_steps, events_per_step,
+                                                          sample=sample)
+
+    return user_flow_figure(label_list, colors_list, source_target_df, n_steps=n_steps, title=title)
+
+
+def user_flow_figure(label_list, colors_list, source_target_df, n_steps=3, title='Sankey Diagram'):
+    """
+    Function used to build the sankey plot from an already calculated "stats.user_journey.sankey_df".
+
+    :param label_list: (list)
+                    node labels
+
+    :param colors_list: (list)
+                    node colours
+
+    :param source_target_df: (DataFrame)
+                    source-target pairs with their node ids and counts. The confidence intervals of sampled counts
+                    are shown on hover
+
+    :param n_steps: (int)
+                    number of events in each journey, used to set the width of the plot
+
+    :param title: (str)
+                    Title for the plot
+
+    :return: (plotly fig)
+    """
+    link_hover = {}
+    if 'count_low' in source_target_df.columns:
+        link_hover = dict(customdata=source_target_df[['count_low', 'count_high']].values.tolist(),
+                          hovertemplate='%{source.label} -> %{target.label}<br>%{value} users '
+                                        '(95% CI %{customdata[0]:.0f}-%{customdata[1]:.0f})<extra></extra>')
 
     # creating the sankey diagram
     data = dict(
@@ -44,7 +79,8 @@ def plot_user_flow(events, starting_step, n_steps=3, events_per_step=5, title='S
             target=source_target_df['target_id'].values.tolist(),
             value=source_target_df['count'].astype(int).values.tolist(),
             hoverlabel=dict(
-                bgcolor='#C2C4C7')
+                bgcolor='#C2C4C7'),
+            **link_hover
         )
     )
 